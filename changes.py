@@ -0,0 +1,88 @@
+"""Flux des modifications de la base, reçu par LISTEN/NOTIFY.
+
+Les triggers de la migration 6 signalent chaque écriture sur le canal
+data_changes. Un seul thread par processus écoute ce canal, incrémente la
+version de la table modifiée et prévient les caches abonnés; les pages
+comparent ces versions pour ne se rafraîchir que si leurs données ont changé.
+"""
+import json
+import select
+import threading
+import time
+
+CHANNEL = 'data_changes'
+
+
+class ChangeFeed:
+    def __init__(self, connect, poll_timeout=5.0, reconnect_delay=2.0):
+        self._connect = connect
+        self.poll_timeout = poll_timeout
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._subscribers = []
+        self._thread = None
+
+    def subscribe(self, tables, callback):
+        """Appelle callback(change) pour chaque modification d'une des tables.
+
+        change est un dict avec table, op, pid (processus serveur de l'écriture)
+        et ids (None si inconnus).
+        """
+        with self._lock:
+            self._subscribers.append((frozenset(tables), callback))
+
+    def version(self, *tables):
+        """Renvoie les versions des tables: elles changent à chaque modification reçue."""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def start(self):
+        """Démarre le thread d'écoute s'il ne tourne pas déjà."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-changes', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                if reconnecting:
+                    # Des notifications ont pu être perdues pendant la coupure
+                    self._dispatch(None)
+                reconnecting = True
+                while True:
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._dispatch(json.loads(notify.payload))
+            except Exception as e:
+                print(f"Erreur lors de l'écoute des modifications: {str(e)}")
+                reconnecting = True
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def _dispatch(self, change):
+        """Signale une modification; change=None signifie que toutes les tables ont pu changer."""
+        with self._lock:
+            if change is None:
+                tables = {table for tables, _ in self._subscribers for table in tables} | set(self._versions)
+            else:
+                tables = {change['table']}
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            subscribers = [callback for watched, callback in self._subscribers if watched & tables]
+        for callback in subscribers:
+            try:
+                callback(change)
+            except Exception as e:
+                print(f"Erreur lors du traitement d'une modification: {str(e)}")
@@ -0,0 +1,134 @@
+"""Vérifie que les requêtes fréquentes utilisent bien les index du schéma.
+
+Le script crée un schéma temporaire, y applique les migrations, le remplit
+de données synthétiques puis lit le plan de chaque requête avec
+EXPLAIN (FORMAT JSON). Les requêtes viennent de database.py, pour que la
+vérification suive le code. Il échoue si une requête parcourt
+séquentiellement la table qu'elle interroge. Le schéma temporaire est
+supprimé à la fin.
+
+    python check_indexes.py
+    python check_indexes.py --rows 500000
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+from database import (CATEGORY_IN_USE_QUERY, PROJECT_IN_USE_QUERY, UNDO_IMPORT_BATCH_QUERY,
+                      UNPAID_TRANSACTIONS_QUERY, TransactionQuery, get_pool)
+from migrations import apply_migrations
+
+INDEX_NODES = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+# (nom, table interrogée, (requête, paramètres)), construites comme dans database.py
+HOT_QUERIES = [
+    ("Transactions récentes", 'transactions', TransactionQuery().select(limit=16)),
+    ("Page suivante des transactions", 'transactions', TransactionQuery().select(
+        after=(datetime.datetime(2022, 6, 1, 12), datetime.date(2022, 6, 1), 100000), limit=16)),
+    ("Transactions d'une catégorie", 'transactions', TransactionQuery(category_id=7).select(limit=16)),
+    ("Transactions d'un mois", 'transactions', TransactionQuery(
+        date_from=datetime.date(2024, 3, 1), date_to=datetime.date(2024, 3, 31), order='date').select(limit=16)),
+    ("Totaux d'un mois", 'transactions', TransactionQuery(
+        date_from=datetime.date(2024, 3, 1), date_to=datetime.date(2024, 3, 31)).totals()),
+    ("Paiements d'un mois", 'transactions', TransactionQuery(
+        payment_date_from=datetime.date(2024, 3, 1), payment_date_to=datetime.date(2024, 3, 31),
+        order='date').select(limit=16)),
+    ("Recherche dans les libellés", 'transactions', TransactionQuery(search='Opération 4242').ranked(limit=16)),
+    ("Recherche dans les libellés et les projets", 'transactions',
+     TransactionQuery(search='Projet 3').ranked(search_project_ids=[3], limit=16)),
+    ("Transactions à rapprocher d'un relevé", 'transactions',
+     (UNPAID_TRANSACTIONS_QUERY, (datetime.date(2024, 3, 1), datetime.date(2024, 3, 31)))),
+    ("Catégorie utilisée", 'transactions', (CATEGORY_IN_USE_QUERY, (7,))),
+    ("Projet utilisé", 'transactions', (PROJECT_IN_USE_QUERY, (3,))),
+    ("Annulation d'un import", 'transactions', (UNDO_IMPORT_BATCH_QUERY, (1, 1))),
+]
+
+SEED = """
+    INSERT INTO categories (name) SELECT 'Catégorie ' || i FROM generate_series(1, 50) i;
+    INSERT INTO projects (name) SELECT 'Projet ' || i FROM generate_series(1, 20) i;
+
+    INSERT INTO transactions (date, montant, libelle, category_id, type, project_id, payer, payment_date, created_at)
+    SELECT d, m, 'Opération ' || i, 1 + i %% 50,
+           CASE WHEN i %% 3 = 0 THEN 'recette' ELSE 'charge' END,
+           1 + i %% 20, NOT unpaid,
+           CASE WHEN unpaid THEN NULL ELSE d + (i %% 30) END,
+           d + make_interval(secs => i %% 86400)
+    FROM (
+        SELECT i,
+               DATE '2020-01-01' + (i %% 2000) AS d,
+               round((random() * 5000)::numeric, 2) + 1 AS m,
+               i %% 50 = 0 AS unpaid
+        FROM generate_series(1, %(rows)s) i
+    ) s;
+"""
+
+
+def _plan_nodes(plan):
+    """Parcourt l'arbre du plan et renvoie ses nœuds à plat."""
+    nodes = [plan]
+    for child in plan.get('Plans', []):
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def explain(cur, query, params):
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _plan_nodes(plan[0]['Plan'])
+
+
+def check_queries(cur):
+    """Renvoie la liste des requêtes dont le plan parcourt la table sans index."""
+    failures = []
+    for name, table, (query, params) in HOT_QUERIES:
+        nodes = explain(cur, query, params)
+        seq_scans = [n for n in nodes if n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == table]
+        used = sorted({n['Index Name'] for n in nodes if n['Node Type'] in INDEX_NODES and 'Index Name' in n})
+        if seq_scans or not used:
+            failures.append(name)
+            print(f"ÉCHEC  {name}: parcours séquentiel de {table}")
+        else:
+            print(f"OK     {name}: {', '.join(used)}")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vérifie l'utilisation des index par les requêtes fréquentes")
+    parser.add_argument('--rows', type=int, default=200000, help="nombre de transactions synthétiques")
+    args = parser.parse_args(argv)
+
+    schema = f"index_check_{os.getpid()}"
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {schema}")
+            # public reste visible pour les extensions (pg_trgm) qui y sont installées
+            cur.execute(f"SET search_path TO {schema}, public")
+        apply_migrations(conn)
+        with conn.cursor() as cur:
+            print(f"Insertion de {args.rows} transactions synthétiques...")
+            cur.execute(SEED, {'rows': args.rows})
+            cur.execute("VACUUM ANALYZE transactions")
+            failures = check_queries(cur)
+        if failures:
+            print(f"{len(failures)} requête(s) sans index: {', '.join(failures)}")
+            return 1
+        print("Toutes les requêtes fréquentes utilisent un index")
+        return 0
+    except Exception as e:
+        print(f"Erreur: {str(e)}")
+        return 1
+    finally:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+            cur.execute("RESET search_path")
+        pool.putconn(conn)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,233 +1,809 @@
 import os
+import random
+import threading
+import time
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+import numpy as np
 import pandas as pd
 import hashlib
+import io
 import json
-
-class Database:
-    def __init__(self):
-        self.conn = None
-        self.connect()
-        self._create_tables()
-
-    def connect(self):
-        """Établit une nouvelle connexion à la base de données."""
-        max_attempts = 3
+from changes import ChangeFeed
+from migrations import COMPATIBLE_VERSION, LATEST_VERSION, apply_migrations, current_version
+
+
+class ConnectionPool:
+    """Pool borné et thread-safe de connexions PostgreSQL, partagé par tout le processus.
+
+    Une connexion au repos n'est sondée (SELECT 1) à l'emprunt que si elle est
+    restée inutilisée plus de probe_after secondes, ou si une erreur de
+    connexion a été signalée depuis son retour au pool (mark_suspect).
+    """
+
+    def __init__(self, minconn=1, maxconn=10, idle_timeout=300, checkout_timeout=10, probe_after=30,
+                 connect_attempts=3, backoff_base=0.2, backoff_cap=2.0, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Tailles de pool invalides: 0 <= minconn <= maxconn et maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.probe_after = probe_after
+        self.connect_attempts = connect_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # pile LIFO de (connexion, instant du dernier retour)
+        self._size = 0  # connexions ouvertes, empruntées ou au repos
+        self._cond = threading.Condition()
+        self._closed = False
+        self._suspect_before = 0.0  # les connexions rendues avant cet instant sont sondées
+        self._down_until = 0.0  # échec rapide tant que la base vient d'être jugée injoignable
+
+    def _connect(self):
+        """Ouvre une nouvelle connexion en autocommit, avec un repli exponentiel borné entre les tentatives."""
+        if time.monotonic() < self._down_until:
+            raise psycopg2.OperationalError("Base de données injoignable, nouvelle tentative dans quelques secondes")
         attempt = 0
-        while attempt < max_attempts:
+        while True:
             try:
-                if self.conn is None or self.conn.closed:
-                    self.conn = psycopg2.connect(
-                        dbname=os.environ['PGDATABASE'],
-                        user=os.environ['PGUSER'],
-                        password=os.environ['PGPASSWORD'],
-                        host=os.environ['PGHOST'],
-                        port=os.environ['PGPORT']
-                    )
-                    self.conn.autocommit = True
-                    print("Connexion à la base de données établie avec succès")
-                    return
-                else:
-                    return
-            except Exception as e:
+                conn = psycopg2.connect(**self._connect_kwargs)
+                conn.autocommit = True
+                print("Connexion à la base de données établie avec succès")
+                return conn
+            except psycopg2.OperationalError as e:
                 attempt += 1
-                if attempt == max_attempts:
-                    print(f"Erreur de connexion à la base de données après {max_attempts} tentatives: {str(e)}")
+                if attempt >= self.connect_attempts:
+                    print(f"Erreur de connexion à la base de données après {attempt} tentatives: {str(e)}")
+                    self._down_until = time.monotonic() + self.backoff_cap
                     raise
-                print(f"Tentative de connexion {attempt}/{max_attempts} échouée, nouvelle tentative dans 5 secondes...")
-                import time
-                time.sleep(5)
-
-    def ensure_connection(self):
-        """Assure que la connexion est active."""
+                # Repli exponentiel avec gigue complète, pour ne pas synchroniser les sessions
+                delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1)))
+                print(f"Tentative de connexion {attempt}/{self.connect_attempts} échouée, nouvelle tentative dans {delay:.2f} secondes...")
+                time.sleep(delay)
+
+    @staticmethod
+    def _is_usable(conn):
+        """Vérifie sans aller-retour réseau qu'une connexion au repos est réutilisable."""
+        return not conn.closed and conn.info.transaction_status != TRANSACTION_STATUS_UNKNOWN
+
+    @staticmethod
+    def _probe(conn):
+        """Vérifie par un aller-retour que le serveur répond encore sur cette connexion."""
         try:
-            if self.conn is None or self.conn.closed:
-                self.connect()
-            # Vérifie si la connexion est active
-            with self.conn.cursor() as cur:
+            with conn.cursor() as cur:
                 cur.execute('SELECT 1')
-        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            return True
+        except psycopg2.Error as e:
             print(f"Erreur de connexion détectée: {str(e)}")
-            self.connect()
+            return False
 
-    def _create_tables(self):
-        """Crée les tables si elles n'existent pas."""
-        self.ensure_connection()
+    def _close_locked(self, conn):
+        self._size -= 1
         try:
-            with self.conn.cursor() as cur:
-                # Create projects table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS projects (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT NOT NULL UNIQUE,
-                        description TEXT,
-                        inclus_calcul BOOLEAN DEFAULT TRUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Table 'projects' créée ou déjà existante")
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _reap_idle_locked(self):
+        """Ferme les connexions restées au repos plus de idle_timeout secondes, au-delà de minconn."""
+        now = time.monotonic()
+        # Les connexions les plus anciennes sont au fond de la pile
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self._close_locked(conn)
+
+    def _checkout_locked(self, deadline):
+        """Réserve une place: renvoie (connexion, à_sonder), ou (None, False) s'il faut en ouvrir une."""
+        while True:
+            if self._closed:
+                raise PoolError("Le pool de connexions est fermé")
+            self._reap_idle_locked()
+            while self._idle:
+                conn, returned_at = self._idle.pop()
+                if not self._is_usable(conn):
+                    self._close_locked(conn)
+                    continue
+                needs_probe = (returned_at <= self._suspect_before
+                               or time.monotonic() - returned_at > self.probe_after)
+                return conn, needs_probe
+            if self._size < self.maxconn:
+                self._size += 1
+                return None, False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolError(f"Aucune connexion disponible après {self.checkout_timeout} secondes ({self.maxconn} connexions utilisées)")
+            self._cond.wait(remaining)
+
+    def getconn(self):
+        """Emprunte une connexion, en attendant au plus checkout_timeout secondes si le pool est plein."""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                conn, needs_probe = self._checkout_locked(deadline)
+            # Les sondes et les connexions se font hors du verrou pour ne pas bloquer les autres threads
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            if not needs_probe or self._probe(conn):
+                return conn
+            with self._cond:
+                self._close_locked(conn)
+
+    def putconn(self, conn, discard=False):
+        """Rend une connexion au pool, en la remettant dans un état propre ou en la fermant."""
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    if conn.autocommit:
+                        # Transaction ouverte par un BEGIN explicite, que rollback() ignore en autocommit
+                        with conn.cursor() as cur:
+                            cur.execute("ROLLBACK")
+                    else:
+                        conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._close_locked(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+            self._reap_idle_locked()
+
+    def mark_suspect(self):
+        """Signale une erreur de connexion: les connexions au repos seront sondées avant réemploi."""
+        with self._cond:
+            self._suspect_before = time.monotonic()
+
+    def closeall(self):
+        """Ferme toutes les connexions au repos et refuse les emprunts suivants."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_locked(conn)
+            self._cond.notify_all()
+
+    def open_dedicated(self):
+        """Ouvre une connexion hors pool, pour un usage long comme LISTEN; à fermer par l'appelant."""
+        return self._connect()
+
+    def stats(self):
+        """Renvoie le nombre de connexions ouvertes et au repos."""
+        with self._cond:
+            return {'open': self._size, 'idle': len(self._idle), 'max': self.maxconn}
+
+
+def is_connection_error(error):
+    """Indique si une exception (éventuellement enveloppée par pandas) vient d'une connexion perdue."""
+    while error is not None:
+        if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            return True
+        error = error.__cause__
+    return False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Renvoie le pool du processus, créé au premier appel."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.environ.get('PGPOOL_MIN', 1)),
+                    maxconn=int(os.environ.get('PGPOOL_MAX', 10)),
+                    idle_timeout=float(os.environ.get('PGPOOL_IDLE_TIMEOUT', 300)),
+                    checkout_timeout=float(os.environ.get('PGPOOL_CHECKOUT_TIMEOUT', 10)),
+                    probe_after=float(os.environ.get('PGPOOL_PROBE_AFTER', 30)),
+                    connect_timeout=int(os.environ.get('PGCONNECT_TIMEOUT', 3)),
+                    dbname=os.environ['PGDATABASE'],
+                    user=os.environ['PGUSER'],
+                    password=os.environ['PGPASSWORD'],
+                    host=os.environ['PGHOST'],
+                    port=os.environ['PGPORT']
+                )
+    return _pool
+
+
+_schema_checked = False
+_schema_lock = threading.Lock()
+
+
+def check_schema(pool):
+    """Vérifie une fois par processus que le schéma est à jour.
+
+    Si DB_AUTO_MIGRATE=1, les migrations en attente sont appliquées. Sinon le
+    schéma doit être au moins en version COMPATIBLE_VERSION (déploiement en
+    cours) et une erreur invite à lancer `python migrations.py`.
+    """
+    global _schema_checked
+    if _schema_checked:
+        return
+    with _schema_lock:
+        if _schema_checked:
+            return
+        conn = pool.getconn()
+        try:
+            version = current_version(conn)
+            if version < LATEST_VERSION and os.environ.get('DB_AUTO_MIGRATE') == '1':
+                apply_migrations(conn)
+            elif version < COMPATIBLE_VERSION:
+                raise RuntimeError(
+                    f"Schéma de la base en version {version}, version {COMPATIBLE_VERSION} au moins attendue. "
+                    "Lancez `python migrations.py` avant de démarrer l'application."
+                )
+        finally:
+            pool.putconn(conn)
+        _schema_checked = True
+
+
+class ReferenceData:
+    """Instantané en lecture seule des catégories, projets et associés.
+
+    Les dictionnaires id -> nom sont triés par nom: leurs clés servent
+    directement d'options aux listes déroulantes et la recherche d'un
+    libellé se fait en temps constant.
+    """
+
+    def __init__(self, version, categories, projects, partners):
+        self.version = version
+        self.categories = categories
+        self.projects = projects
+        self.partners = partners
+        self.category_names = dict(zip(categories['id'].tolist(), categories['name'].tolist()))
+        self.project_names = dict(zip(projects['id'].tolist(), projects['name'].tolist()))
+        self.partner_names = dict(zip(partners['id'].tolist(), partners['name'].tolist()))
+        self.category_ids = {name: id_ for id_, name in self.category_names.items()}
+        self.project_ids = {name: id_ for id_, name in self.project_names.items()}
+        self.category_options = list(self.category_names)
+        self.project_options = list(self.project_names)
+        self.partner_options = list(self.partner_names)
+
+
+REFERENCE_QUERIES = {
+    'categories': "SELECT * FROM categories ORDER BY name",
+    'projects': "SELECT * FROM projects ORDER BY name",
+    'partners': "SELECT * FROM partners ORDER BY name",
+}
+
+_reference_data = None
+_reference_version = 0
+_reference_lock = threading.Lock()
+
+
+def invalidate_reference_data():
+    """À appeler après toute écriture sur categories, projects ou partners."""
+    global _reference_version
+    with _reference_lock:
+        _reference_version += 1
+
+
+class TransactionQuery:
+    """Filtres de la liste des transactions, compilés en SQL paramétré.
+
+    Les critères laissés à None ne filtrent pas. order choisit le tri et la
+    clé de pagination: 'created' (date de saisie) ou 'date' (date de l'opération).
+    """
+
+    # Colonnes du tri, toutes décroissantes; elles forment aussi le curseur de page
+    ORDERS = {
+        'created': ('created_at', 'date', 'id'),
+        'date': ('date', 'id'),
+    }
+
+    # Mots du libellé (plein texte français) ou sous-chaîne du libellé (trigrammes);
+    # chaque branche est servie par un index
+    SEARCH_CONDITION = """(
+        to_tsvector('french', t.libelle) @@ plainto_tsquery('french', %s)
+        OR t.libelle ILIKE %s
+    )"""
+
+    # Pertinence d'une transaction trouvée: meilleur score plein texte ou trigrammes.
+    # En double précision pour que le curseur relu par Python se compare exactement.
+    SEARCH_SCORE = """GREATEST(
+        ts_rank(to_tsvector('french', t.libelle), plainto_tsquery('french', %s)),
+        word_similarity(%s, t.libelle)
+    )::float8"""
+
+    @staticmethod
+    def search_params(term):
+        """Paramètres de SEARCH_CONDITION pour le terme recherché."""
+        pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return [term, pattern]
+
+    def __init__(self, category_id=None, project_id=None, date_from=None, date_to=None,
+                 payment_date_from=None, payment_date_to=None, payer=None, inclus_calcul=None,
+                 search=None, order='created'):
+        if order not in self.ORDERS:
+            raise ValueError(f"Tri inconnu: {order}")
+        self.category_id = category_id
+        self.project_id = project_id
+        self.date_from = date_from
+        self.date_to = date_to
+        self.payment_date_from = payment_date_from
+        self.payment_date_to = payment_date_to
+        self.payer = payer
+        self.inclus_calcul = inclus_calcul
+        self.search = search
+        self.order = order
+
+    def where(self, after=None, search_project_ids=()):
+        """Renvoie la clause WHERE (éventuellement vide) et ses paramètres.
+
+        after est le curseur renvoyé avec la page précédente. search_project_ids
+        sont les projets dont le nom correspond à la recherche: leurs
+        transactions sont aussi retenues.
+        """
+        filters = [
+            ("t.category_id = %s", self.category_id),
+            ("t.project_id = %s", self.project_id),
+            ("t.date >= %s", self.date_from),
+            ("t.date <= %s", self.date_to),
+            ("t.payment_date >= %s", self.payment_date_from),
+            ("t.payment_date <= %s", self.payment_date_to),
+            ("t.payer = %s", self.payer),
+            ("p.inclus_calcul = %s", self.inclus_calcul),
+        ]
+        conditions = [condition for condition, value in filters if value is not None]
+        params = [value for _, value in filters if value is not None]
+
+        if self.search:
+            if search_project_ids:
+                conditions.append(f"({self.SEARCH_CONDITION} OR t.project_id = ANY(%s))")
+                params.extend(self.search_params(self.search) + [list(search_project_ids)])
+            else:
+                conditions.append(self.SEARCH_CONDITION)
+                params.extend(self.search_params(self.search))
+
+        if after is not None:
+            columns = ', '.join(f"t.{column}" for column in self.ORDERS[self.order])
+            placeholders = ', '.join(['%s'] * len(after))
+            conditions.append(f"({columns}) < ({placeholders})")
+            params.extend(after)
+
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def order_by(self):
+        return ", ".join(f"t.{column} DESC" for column in self.ORDERS[self.order])
+
+    def select(self, after=None, search_project_ids=(), limit=None):
+        """Requête de la liste des transactions filtrées et triées, et ses paramètres."""
+        where, params = self.where(after, search_project_ids)
+        sql = f"""
+            SELECT t.id, t.date, t.montant, t.libelle, t.category_id, c.name as category_name, t.type,
+                   t.project_id, p.name as project, t.payer, t.payment_date, p.inclus_calcul, t.created_at
+            FROM transactions t
+            LEFT JOIN categories c ON t.category_id = c.id
+            LEFT JOIN projects p ON t.project_id = p.id
+            {where}
+            ORDER BY {self.order_by()}
+        """
+        if limit is not None:
+            sql += " LIMIT %s"
+            params = params + [limit]
+        return sql, params
 
-                # Reste du code existant pour users, categories
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        username TEXT NOT NULL UNIQUE,
-                        password TEXT NOT NULL,
-                        role TEXT CHECK (role IN ('admin', 'user')) NOT NULL,
-                        full_name TEXT,
-                        email TEXT UNIQUE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_login TIMESTAMP
-                    )
-                """)
+    def ranked(self, cursor=None, search_project_ids=(), limit=None):
+        """Requête des transactions trouvées par la recherche, les plus pertinentes d'abord.
 
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS categories (
-                        id SERIAL PRIMARY KEY,
-                        name TEXT NOT NULL UNIQUE,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
+        cursor est le couple (score, id) de la dernière ligne de la page précédente.
+        """
+        where, params = self.where(search_project_ids=search_project_ids)
+        sql = f"""
+            SELECT * FROM (
+                SELECT t.id, t.date, t.montant, t.libelle, t.category_id, c.name as category_name, t.type,
+                       t.project_id, p.name as project, t.payer, t.payment_date, p.inclus_calcul, t.created_at,
+                       {self.SEARCH_SCORE} as score
+                FROM transactions t
+                LEFT JOIN categories c ON t.category_id = c.id
+                LEFT JOIN projects p ON t.project_id = p.id
+                {where}
+            ) s
+            {"WHERE (s.score, s.id) < (%s, %s)" if cursor is not None else ""}
+            ORDER BY s.score DESC, s.id DESC
+        """
+        params = [self.search, self.search] + params + list(cursor or [])
+        if limit is not None:
+            sql += " LIMIT %s"
+            params.append(limit)
+        return sql, params
+
+    def totals(self, search_project_ids=()):
+        """Requête du nombre de transactions filtrées et des totaux charges et recettes."""
+        where, params = self.where(search_project_ids=search_project_ids)
+        sql = f"""
+            SELECT
+                COUNT(*) as count,
+                COALESCE(SUM(CASE WHEN t.type = 'charge' THEN t.montant ELSE 0 END), 0) as charges,
+                COALESCE(SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE 0 END), 0) as recettes
+            FROM transactions t
+            LEFT JOIN projects p ON t.project_id = p.id
+            {where}
+        """
+        return sql, params
+
+    def cursor(self, row):
+        """Curseur de pagination pointant après la ligne row d'une page."""
+        values = []
+        for column in self.ORDERS[self.order]:
+            value = row[column]
+            if column == 'id':
+                value = int(value)
+            elif column == 'date' and hasattr(value, 'to_pydatetime'):
+                value = value.date()
+            elif hasattr(value, 'to_pydatetime'):
+                value = value.to_pydatetime()
+            values.append(value)
+        return tuple(values)
+
+
+TRANSACTION_COLUMNS = [
+    'id', 'date', 'montant', 'libelle', 'category_id', 'category_name', 'type',
+    'project_id', 'project', 'payer', 'payment_date', 'inclus_calcul', 'created_at'
+]
+
+# Types compacts des transactions lues en DataFrame (voir compact_frame)
+CENTS_COLUMNS = ['montant']
+DAY_COLUMNS = ['date', 'payment_date']
+CATEGORY_COLUMNS = ['type', 'project', 'category_name']
+BOOLEAN_COLUMNS = ['payer', 'inclus_calcul']
+
+
+def compact_frame(df):
+    """Convertit des transactions lues en types compacts et vectorisés.
+
+    Les montants deviennent des centimes entiers (int64) dans <colonne>_cents,
+    les dates des datetime64 à la seconde, les booléens des booléens nullables
+    et les textes répétés (type, projet, catégorie) des catégories. Les sommes
+    se font alors en NumPy et sont exactes.
+    """
+    df = df.copy()
+    for column in CENTS_COLUMNS:
+        if column in df.columns:
+            # NUMERIC(15, 2): au plus 10^15 centimes, exact en float64 avant l'arrondi
+            cents = np.rint(pd.to_numeric(df[column]).to_numpy(dtype='float64') * 100)
+            df.insert(df.columns.get_loc(column), f"{column}_cents", cents.astype('int64'))
+            df = df.drop(columns=column)
+    for column in DAY_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column]).astype('datetime64[s]')
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    for column in BOOLEAN_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('boolean')
+    return df
+
+
+def amount_from_cents(cents):
+    """Montants en dirhams à partir de centimes, pour l'affichage."""
+    return cents / 100
+
+
+def frame_memory(df):
+    """Empreinte mémoire d'un DataFrame: octets par colonne et total."""
+    usage = df.memory_usage(deep=True, index=True)
+    return {
+        'columns': {column: int(usage[column]) for column in df.columns},
+        'total': int(usage.sum()),
+        'rows': len(df),
+    }
+
+
+# Transactions non payées entre deux dates, servies par l'index partiel transactions_unpaid_idx
+UNPAID_TRANSACTIONS_QUERY = """
+    SELECT t.id, t.date, t.montant, t.libelle, t.type, p.name as project
+    FROM transactions t
+    LEFT JOIN projects p ON t.project_id = p.id
+    WHERE t.payer = FALSE
+      AND t.type IN ('charge', 'recette')
+      AND t.date BETWEEN %s AND %s
+"""
+
+# Une catégorie ou un projet utilisé par des transactions ne peut pas être supprimé
+CATEGORY_IN_USE_QUERY = "SELECT EXISTS (SELECT 1 FROM transactions WHERE category_id = %s)"
+PROJECT_IN_USE_QUERY = "SELECT EXISTS (SELECT 1 FROM transactions WHERE project_id = %s)"
+
+
+# Colonnes attendues par Database.stage_import, dans l'ordre du COPY vers import_staging.
+# Les colonnes *_raw gardent la valeur lue quand elle n'a pas pu être convertie.
+IMPORT_COLUMNS = [
+    'line', 'date', 'date_raw', 'montant', 'montant_raw', 'libelle', 'type', 'projet', 'categorie',
+    'payer', 'date_paiement'
+]
+
+# Lignes d'imports en transit validées ensemble (paramètre: liste des ID des imports, un par
+# fichier, dans l'ordre des fichiers) avec toutes leurs erreurs, dans l'ordre des règles, puis
+# les lignes valides avec leur empreinte. Les lignes identiques de l'ensemble des fichiers sont
+# numérotées pour rester distinctes entre elles tout en retrouvant la même empreinte si les
+# fichiers sont importés à nouveau. import_staging.montant n'a pas de précision fixe: un
+# montant hors de NUMERIC(15, 2) est une erreur de sa ligne et non de tout l'import.
+IMPORT_CHECKED_ROWS = """
+    WITH category_keys AS (
+        -- Une seule catégorie par nom sans casse, même si deux catégories ne diffèrent que par la casse
+        SELECT DISTINCT ON (lower(name)) lower(name) as key, id
+        FROM categories
+        ORDER BY lower(name), id
+    ), checked AS (
+        SELECT f.import_id, f.rang as file_rank, s.line, s.date, s.montant, s.libelle, s.type, s.payer, s.date_paiement,
+               c.id as category_id, p.id as project_id,
+               ARRAY(
+                   SELECT e.erreur
+                   FROM (VALUES
+                       (1, s.date IS NULL, 'Date invalide: ' || COALESCE(s.date_raw, '')),
+                       (2, s.montant IS NULL, 'Montant invalide: ' || COALESCE(s.montant_raw, '')),
+                       (3, s.montant >= 1e13, 'Montant trop élevé: ' || COALESCE(s.montant_raw, s.montant::text)),
+                       (4, s.montant <= 0, 'Le montant doit être supérieur à 0'),
+                       (5, COALESCE(s.libelle, '') = '', 'Le libellé est obligatoire'),
+                       (6, s.type IS DISTINCT FROM 'charge' AND s.type IS DISTINCT FROM 'recette',
+                        'Type invalide: ' || COALESCE(s.type, '') || '. Utilisez ''charge'' ou ''recette'''),
+                       (7, p.id IS NULL, 'Projet inconnu: ' || COALESCE(s.projet, '')),
+                       (8, c.id IS NULL, 'Catégorie inconnue: ' || COALESCE(s.categorie, '')),
+                       (9, s.payer IS DISTINCT FROM 'oui' AND s.payer IS DISTINCT FROM 'non',
+                        'Valeur invalide pour ''payer'': ' || COALESCE(s.payer, '') || '. Utilisez ''oui'' ou ''non'''),
+                       (10, s.payer = 'oui' AND s.date_paiement IS NULL,
+                        'Date de paiement manquante pour une transaction payée')
+                   ) e(rang, en_erreur, erreur)
+                   WHERE e.en_erreur
+                   ORDER BY e.rang
+               ) as erreurs
+        FROM unnest(%s::bigint[]) WITH ORDINALITY f(import_id, rang)
+        JOIN import_staging s ON s.import_id = f.import_id
+        -- La catégorie écrite exactement pareil d'abord, sinon la même sans casse
+        LEFT JOIN categories ce ON ce.name = s.categorie
+        LEFT JOIN category_keys ck ON ck.key = lower(s.categorie)
+        CROSS JOIN LATERAL (SELECT COALESCE(ce.id, ck.id) as id) c
+        LEFT JOIN projects p ON p.name = s.projet
+    ), valid AS (
+        SELECT v.*,
+               md5(jsonb_build_array(
+                   v.date, v.montant, v.libelle, v.type, v.project_id, v.category_id,
+                   row_number() OVER (PARTITION BY v.date, v.montant, v.libelle, v.type, v.project_id, v.category_id
+                                      ORDER BY v.file_rank, v.line)
+               )::text)::uuid as fingerprint
+        FROM (
+            SELECT import_id, file_rank, line, date, montant::numeric(15, 2) as montant, libelle, category_id, type, project_id,
+                   payer = 'oui' as payer,
+                   CASE WHEN payer = 'oui' THEN date_paiement END as payment_date
+            FROM checked
+            WHERE cardinality(erreurs) = 0
+        ) v
+    )
+"""
+
+# Erreurs d'imports en transit (paramètres: ID des imports, nombre maximal de lignes en erreur)
+IMPORT_ERRORS_QUERY = f"""
+    {IMPORT_CHECKED_ROWS}
+    SELECT c.import_id, c.line as ligne, e.erreur
+    FROM (
+        SELECT import_id, file_rank, line, erreurs
+        FROM checked
+        WHERE cardinality(erreurs) > 0
+        ORDER BY file_rank, line
+        LIMIT %s
+    ) c
+    CROSS JOIN LATERAL unnest(c.erreurs) WITH ORDINALITY e(erreur, rang)
+    ORDER BY c.file_rank, c.line, e.rang
+"""
+
+# Comptes par import en transit (paramètre: ID des imports): lignes, lignes invalides, lignes
+# déjà importées et totaux des lignes valides
+IMPORT_SUMMARY_QUERY = f"""
+    {IMPORT_CHECKED_ROWS}
+    SELECT c.import_id, COUNT(*) as rows,
+           COUNT(*) FILTER (WHERE cardinality(c.erreurs) > 0) as invalid,
+           COUNT(t.id) as duplicates,
+           COALESCE(SUM(v.montant) FILTER (WHERE v.type = 'charge'), 0) as charges,
+           COALESCE(SUM(v.montant) FILTER (WHERE v.type = 'recette'), 0) as recettes
+    FROM checked c
+    LEFT JOIN valid v ON v.import_id = c.import_id AND v.line = c.line
+    LEFT JOIN transactions t ON t.fingerprint = v.fingerprint
+    GROUP BY c.import_id, c.file_rank
+    ORDER BY c.file_rank
+"""
+
+# Insertion des lignes valides d'imports en transit (paramètres: ID des imports, ID du lot).
+# Les lignes dont l'empreinte existe déjà sont ignorées.
+IMPORT_INSERT_QUERY = f"""
+    {IMPORT_CHECKED_ROWS}
+    INSERT INTO transactions (date, montant, libelle, category_id, type, project_id, payer,
+                              payment_date, fingerprint, import_batch_id)
+    SELECT date, montant, libelle, category_id, type, project_id, payer, payment_date, fingerprint, %s
+    FROM valid
+    ORDER BY file_rank, line
+    ON CONFLICT (fingerprint) WHERE fingerprint IS NOT NULL DO NOTHING
+"""
+
+# Colonnes déplacées entre transactions et transactions_archive par l'annulation d'un import
+ARCHIVE_COLUMNS = ', '.join([
+    'id', 'date', 'montant', 'libelle', 'category_id', 'type', 'created_at', 'is_paid', 'paid', 'payer',
+    'payment_date', 'project_id', 'fingerprint', 'import_batch_id'
+])
+
+# Annulation d'un lot d'import (paramètres: ID du lot deux fois): ses transactions passent dans l'archive
+UNDO_IMPORT_BATCH_QUERY = f"""
+    WITH moved AS (
+        DELETE FROM transactions WHERE import_batch_id = %s
+        RETURNING {ARCHIVE_COLUMNS}
+    ), archived AS (
+        INSERT INTO transactions_archive ({ARCHIVE_COLUMNS})
+        SELECT {ARCHIVE_COLUMNS} FROM moved
+        RETURNING 1
+    )
+    UPDATE import_batches SET undone_at = CURRENT_TIMESTAMP
+    WHERE id = %s
+    RETURNING (SELECT COUNT(*) FROM archived)
+"""
+
+# Canal NOTIFY qui réveille les travailleurs à chaque tâche soumise (voir jobs.py)
+JOBS_CHANNEL = 'jobs'
+
+
+_change_feed = None
+
+
+def _on_reference_change(change):
+    invalidate_reference_data()
+
+
+def get_change_feed():
+    """Renvoie le flux des modifications du processus, démarré au premier appel."""
+    global _change_feed
+    if _change_feed is None:
+        with _pool_lock:
+            if _change_feed is None:
+                feed = ChangeFeed(get_pool().open_dedicated)
+                feed.subscribe(['categories', 'projects', 'partners'], _on_reference_change)
+                feed.start()
+                _change_feed = feed
+    return _change_feed
+
+
+PERIOD_FORMATS = {
+    'day': 'YYYY-MM-DD',
+    'month': 'YYYY-MM',
+    'year': 'YYYY'
+}
+
+
+class DashboardCube:
+    """Agrégats du tableau de bord, calculés en une seule requête.
+
+    totals: dict des indicateurs (charges/recettes payées ou non, totaux, balance)
+    series: DataFrame period, charges, recettes, par période croissante
+    project_periods / category_periods: DataFrame period, project|category_name,
+        charges, recettes, balance, par période décroissante
+    projects / categories: mêmes colonnes sans la période, totalisées sur tout l'historique
+    """
+
+    # Valeur de GROUPING(period, project, category_name, type, payer) pour chaque ensemble:
+    # un bit à 1 signale une colonne absente du regroupement
+    GROUPING_SETS = {
+        28: 'totals',
+        15: 'series',
+        7: 'project_periods',
+        23: 'projects',
+        11: 'category_periods',
+        27: 'categories',
+    }
+
+    def __init__(self, rows):
+        sets = {name: rows[rows['grouping_set'] == key] for key, name in self.GROUPING_SETS.items()}
+        amounts = ['charges', 'recettes', 'balance']
+
+        totals = sets['totals']
+        def total(type_, payer):
+            selected = totals[(totals['type'] == type_) & (totals['payer'] == payer)]
+            return float(selected['charges' if type_ == 'charge' else 'recettes'].sum())
+        self.totals = {
+            'charges_payees': total('charge', True),
+            'charges_non_payees': total('charge', False),
+            'recettes_payees': total('recette', True),
+            'recettes_non_payees': total('recette', False),
+        }
+        self.totals['total_charges'] = self.totals['charges_payees'] + self.totals['charges_non_payees']
+        self.totals['total_recettes'] = self.totals['recettes_payees'] + self.totals['recettes_non_payees']
+        self.totals['balance'] = self.totals['total_recettes'] - self.totals['total_charges']
 
-                # Drop existing foreign key if exists
-                cur.execute("""
-                    DO $$ 
-                    BEGIN
-                        IF EXISTS (
-                            SELECT 1 FROM information_schema.table_constraints 
-                            WHERE constraint_name = 'transactions_project_fkey'
-                            AND table_name = 'transactions'
-                        ) THEN
-                            ALTER TABLE transactions DROP CONSTRAINT transactions_project_fkey;
-                        END IF;
-                    END $$;
-                """)
-                
-                # Create transactions table with foreign key to categories
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        id SERIAL PRIMARY KEY,
-                        date DATE NOT NULL,
-                        montant NUMERIC(15, 2) NOT NULL,
-                        libelle TEXT NOT NULL,
-                        category_id INTEGER REFERENCES categories(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
-                        type TEXT CHECK (type IN ('charge', 'recette')) NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        project TEXT,
-                        is_paid BOOLEAN DEFAULT FALSE,
-                        paid BOOLEAN DEFAULT TRUE,
-                        payer BOOLEAN DEFAULT FALSE,
-                        payment_date DATE
-                    )
-                """)
+        self.series = sets['series'][['period', 'charges', 'recettes']].sort_values('period').reset_index(drop=True)
 
-                # Insert missing projects from transactions
-                cur.execute("""
-                    INSERT INTO projects (name)
-                    SELECT DISTINCT t.project 
-                    FROM transactions t 
-                    LEFT JOIN projects p ON t.project = p.name 
-                    WHERE t.project IS NOT NULL 
-                    AND p.name IS NULL
-                    ON CONFLICT (name) DO NOTHING;
-                """)
+        # Les transactions sans projet n'apparaissent que dans les totaux et les catégories
+        project_periods = sets['project_periods'][sets['project_periods']['project'].notna()]
+        self.project_periods = project_periods[['period', 'project'] + amounts].sort_values(
+            ['period', 'project'], ascending=[False, True]).reset_index(drop=True)
+        projects = sets['projects'][sets['projects']['project'].notna()]
+        self.projects = projects[['project'] + amounts].sort_values('project').reset_index(drop=True)
 
-                # Create todo_tasks table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS todo_tasks (
-                        id SERIAL PRIMARY KEY,
-                        project_name TEXT NOT NULL,
-                        due_date DATE NOT NULL,
-                        description TEXT,
-                        steps JSONB DEFAULT '[]'::jsonb,
-                        requirements TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Tables créées ou mises à jour avec succès")
+        self.category_periods = sets['category_periods'][['period', 'category_name'] + amounts].sort_values(
+            ['period', 'category_name'], ascending=[False, True]).reset_index(drop=True)
+        self.categories = sets['categories'][['category_name'] + amounts].sort_values(
+            'category_name').reset_index(drop=True)
+
+    @property
+    def empty(self):
+        return self.series.empty
 
-                # Create partners table -------------  added by hamza -------------
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS partners (
-                        id SERIAL PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL,
-                        share_percentage NUMERIC(5, 2) NOT NULL
-                    )
-                """)
-                print("Table 'partners' créée ou déjà existante")
-                
-                
-                # Create partner_payments table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS partner_payments (
-                        id SERIAL PRIMARY KEY,
-                        partner_id INTEGER REFERENCES partners(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
-                        amount NUMERIC(15, 2) NOT NULL,
-                        payment_date DATE DEFAULT CURRENT_DATE,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Table 'partner_payments' créée ou déjà existante")
-                
-                # Create immobilisations table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS immobilisations (
-                        id SERIAL PRIMARY KEY,
-                        nom VARCHAR(255) NOT NULL,
-                        description TEXT,
-                        prix_total NUMERIC(15, 2) NOT NULL,
-                        date_acquisition DATE DEFAULT CURRENT_DATE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Table 'immobilisations' créée ou déjà existante")
-                
-                
-                # Create transactions_investissement table
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS transactions_investissement (
-                        id SERIAL PRIMARY KEY,
-                        associe_id INTEGER REFERENCES partners(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
-                        immobilisation_id INTEGER REFERENCES immobilisations(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
-                        montant NUMERIC(15, 2) NOT NULL,
-                        date_transaction DATE DEFAULT CURRENT_DATE,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Table 'transactions_investissement' créée ou déjà existante")
-                
-                # ---------- End section added by hamza ------- #
 
+class Database:
+    def __init__(self, listen_changes=True):
+        """listen_changes=False (travailleurs de jobs.py) ne démarre pas le flux des
+        modifications: data_version() n'est alors pas disponible et le cache des
+        données de référence n'est plus invalidé par les autres processus."""
+        self.pool = get_pool()
+        check_schema(self.pool)
+        self.changes = get_change_feed() if listen_changes else None
+
+    @contextmanager
+    def connection(self):
+        """Emprunte une connexion au pool pour la durée du bloc."""
+        conn = self.pool.getconn()
+        discard = False
+        try:
+            yield conn
         except Exception as e:
-            print(f"Erreur lors de la création des tables: {str(e)}")
+            if is_connection_error(e):
+                # Connexion cassée: elle ne retourne pas dans le pool et les autres seront sondées
+                discard = True
+                self.pool.mark_suspect()
             raise
+        finally:
+            self.pool.putconn(conn, discard=discard)
 
+    def _read(self, fn):
+        """Exécute la lecture idempotente fn(conn), rejouée une fois si la connexion est tombée."""
+        try:
+            with self.connection() as conn:
+                return fn(conn)
+        except Exception as e:
+            if not is_connection_error(e):
+                raise
+            print(f"Connexion perdue, nouvelle tentative de la lecture: {str(e)}")
+        with self.connection() as conn:
+            return fn(conn)
+
+    def _read_sql(self, query, params=None):
+        """Lit le résultat d'une requête dans un DataFrame, avec une nouvelle tentative sur coupure."""
+        return self._read(lambda conn: pd.read_sql(query, conn, params=params))
 
     def get_all_users(self):
         """Récupère tous les utilisateurs."""
-        self.ensure_connection()
-        try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+        def fetch(conn):
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
                     SELECT id, username, role, full_name, email, created_at, last_login
                     FROM users
                     ORDER BY username
                 """)
                 return cur.fetchall()
+        try:
+            return self._read(fetch)
         except Exception as e:
             print(f"Erreur lors de la récupération des utilisateurs: {str(e)}")
             return []
 
     def create_user(self, username, password, role, full_name=None, email=None):
         """Crée un nouvel utilisateur."""
-        self.ensure_connection()
         try:
             hashed_password = hashlib.sha256(password.encode()).hexdigest()
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO users (username, password, role, full_name, email)
                     VALUES (%s, %s, %s, %s, %s)
@@ -240,9 +816,8 @@ class Database:
 
     def update_user(self, user_id, full_name=None, email=None, new_password=None):
         """Met à jour les informations d'un utilisateur."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 if new_password:
                     hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
                     cur.execute("""
@@ -262,9 +837,8 @@ class Database:
 
     def delete_user(self, user_id):
         """Supprime un utilisateur."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
         except Exception as e:
             print(f"Erreur lors de la suppression de l'utilisateur: {str(e)}")
@@ -274,33 +848,46 @@ class Database:
         """Ajoute une nouvelle catégorie."""
         if not name:
             raise ValueError("Le nom de la catégorie est obligatoire")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO categories (name, description)
                     VALUES (%s, %s)
                     RETURNING id
                 """, (name, description))
                 category_id = cur.fetchone()[0]
+                invalidate_reference_data()
                 print(f"Catégorie '{name}' créée avec succès (ID: {category_id})")
                 return category_id
         except psycopg2.Error as e:
             print(f"Erreur lors de l'ajout de la catégorie: {str(e)}")
             raise
 
+    def get_reference_data(self):
+        """Renvoie les données de référence, relues seulement après une invalidation."""
+        global _reference_data
+        with _reference_lock:
+            if _reference_data is None or _reference_data.version != _reference_version:
+                def fetch(conn):
+                    return {name: pd.read_sql(query, conn) for name, query in REFERENCE_QUERIES.items()}
+                _reference_data = ReferenceData(_reference_version, **self._read(fetch))
+            return _reference_data
+
+    def data_version(self, *tables):
+        """Versions des tables, modifiées à chaque écriture signalée par la base (tous processus confondus)."""
+        if self.changes is None:
+            raise RuntimeError("Flux des modifications non démarré (Database(listen_changes=False))")
+        return self.changes.version(*tables)
+
     def get_categories(self):
         """Récupère toutes les catégories."""
-        self.ensure_connection()
-        query = "SELECT * FROM categories ORDER BY name"
         try:
-            return pd.read_sql(query, self.conn)
+            return self.get_reference_data().categories.copy()
         except Exception as e:
             print(f"Erreur lors de la récupération des catégories: {str(e)}")
             return pd.DataFrame(columns=['id', 'name', 'description', 'created_at'])
 
-    def add_transaction(self, date, montant, libelle, category_id, type_, projet=None, payer=False):
+    def add_transaction(self, date, montant, libelle, category_id, type_, project_id=None, payer=False, payment_date=None):
         """Ajoute une nouvelle transaction."""
         if not isinstance(category_id, int):
             raise ValueError("L'ID de catégorie doit être un entier")
@@ -310,10 +897,8 @@ class Database:
             raise ValueError("Le montant doit être supérieur à 0")
         if type_ not in ('charge', 'recette'):
             raise ValueError("Le type doit être 'charge' ou 'recette'")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 # Vérifie d'abord si la catégorie existe
                 cur.execute("SELECT id FROM categories WHERE id = %s", (category_id,))
                 if not cur.fetchone():
@@ -321,10 +906,10 @@ class Database:
 
                 # Ajoute la transaction
                 cur.execute("""
-                    INSERT INTO transactions (date, montant, libelle, category_id, type, project, payer)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO transactions (date, montant, libelle, category_id, type, project_id, payer, payment_date)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
-                """, (date, montant, libelle, category_id, type_, projet, payer))
+                """, (date, montant, libelle, category_id, type_, project_id, payer, payment_date))
                 transaction_id = cur.fetchone()[0]
                 print(f"Transaction créée avec succès (ID: {transaction_id})")
                 return transaction_id
@@ -332,90 +917,274 @@ class Database:
             print(f"Erreur lors de l'ajout de la transaction: {str(e)}")
             raise
 
-    def get_transactions(self):
-        """Récupère toutes les transactions avec leurs catégories."""
-        self.ensure_connection()
-        query = """
-            SELECT t.*, c.name as category_name, p.inclus_calcul 
-            FROM transactions t 
-            LEFT JOIN categories c ON t.category_id = c.id 
-            LEFT JOIN projects p ON t.project = p.name
-            ORDER BY t.created_at DESC, t.date DESC, t.id DESC
+    def new_import_id(self):
+        """Réserve l'identifiant d'un nouvel import en transit."""
+        def fetch(conn):
+            with conn.cursor() as cur:
+                cur.execute("SELECT nextval('import_staging_id_seq')")
+                return cur.fetchone()[0]
+        return self._read(fetch)
+
+    def stage_import(self, import_id, df):
+        """Copie un morceau d'import dans import_staging, sans le valider ni l'insérer.
+
+        df contient les colonnes IMPORT_COLUMNS, catégorie et projet par nom.
+        Les morceaux d'un même fichier s'accumulent sous import_id jusqu'à
+        load_import() ou discard_import().
         """
+        buffer = io.StringIO()
+        df[IMPORT_COLUMNS].assign(import_id=import_id).to_csv(
+            buffer, header=False, index=False, date_format='%Y-%m-%d'
+        )
+        buffer.seek(0)
+
         try:
-            return pd.read_sql(query, self.conn)
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.copy_expert(
+                    f"COPY import_staging ({', '.join(IMPORT_COLUMNS)}, import_id) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
         except Exception as e:
-            print(f"Erreur lors de la récupération des transactions: {str(e)}")
-            return pd.DataFrame(columns=['id', 'date', 'montant', 'libelle', 'category_name', 'type', 'project', 'payer', 'inclus_calcul'])
+            print(f"Erreur lors de la copie des lignes à importer: {str(e)}")
+            raise
 
-    def get_filtered_transactions(self, category_id=None, inclus_calcul_only=False):
-        """Récupère les transactions filtrées par catégorie et statut d'inclusion."""
-        self.ensure_connection()
-        query = """
-            SELECT t.*, c.name as category_name, p.inclus_calcul
-            FROM transactions t 
-            LEFT JOIN categories c ON t.category_id = c.id
-            LEFT JOIN projects p ON t.project = p.name
+    def check_import(self, import_ids, max_errors=100):
+        """Valide ensemble des imports en transit (un par fichier), sans rien insérer.
+
+        Renvoie (DataFrame import_id, rows, invalid, duplicates, charges,
+        recettes avec une ligne par import: lignes, lignes en erreur, lignes
+        valides déjà importées et totaux des lignes valides; DataFrame
+        import_id, ligne, erreur avec toutes les erreurs des max_errors
+        premières lignes en erreur).
+        """
+        def fetch(conn):
+            with conn.cursor() as cur:
+                cur.execute(IMPORT_SUMMARY_QUERY, (list(import_ids),))
+                counts = pd.DataFrame(cur.fetchall(), columns=[column.name for column in cur.description])
+                cur.execute(IMPORT_ERRORS_QUERY, (list(import_ids), max_errors))
+                errors = pd.DataFrame(cur.fetchall(), columns=['import_id', 'ligne', 'erreur'])
+            return counts, errors
+
+        try:
+            counts, errors = self._read(fetch)
+        except Exception as e:
+            print(f"Erreur lors de la validation de l'import: {str(e)}")
+            raise
+        counts[['charges', 'recettes']] = counts[['charges', 'recettes']].astype(float)
+        return counts, errors
+
+    def load_import(self, import_ids, row_count, file_name, username=None, checksum=None, max_errors=100):
+        """Importe ensemble des imports en transit (un par fichier), en une seule transaction.
+
+        row_count est le nombre total de lignes copiées par stage_import(): si
+        import_staging (non journalisée) en a perdu, rien n'est inséré. Les
+        lignes valides de tous les fichiers sont insérées par une seule
+        instruction, celles dont l'empreinte existe déjà étant ignorées, et
+        rattachées à un nouveau lot d'import (import_batches) annulable d'un
+        bloc. Les imports en transit sont ensuite supprimés. En cas d'erreur,
+        rien n'est importé.
+
+        Renvoie (ID du lot, nombre de transactions importées, nombre de
+        doublons ignorés, DataFrame import_id, ligne, erreur comme check_import).
         """
-        conditions = []
-        params = []
+        import_ids = list(import_ids)
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("BEGIN")
+                cur.execute("SELECT COUNT(*) FROM import_staging WHERE import_id = ANY(%s)", (import_ids,))
+                staged = cur.fetchone()[0]
+                if staged != row_count:
+                    raise RuntimeError(
+                        f"{row_count - staged} lignes à importer sur {row_count} ont été perdues, relancez l'import"
+                    )
+                cur.execute(f"""
+                    {IMPORT_CHECKED_ROWS}
+                    SELECT COUNT(*) FROM valid
+                """, (import_ids,))
+                valid_count = cur.fetchone()[0]
+                cur.execute(IMPORT_ERRORS_QUERY, (import_ids, max_errors))
+                errors = pd.DataFrame(cur.fetchall(), columns=['import_id', 'ligne', 'erreur'])
+                cur.execute("""
+                    INSERT INTO import_batches (file_name, username, checksum)
+                    VALUES (%s, %s, %s)
+                    RETURNING id
+                """, (file_name, username, checksum))
+                batch_id = cur.fetchone()[0]
+                cur.execute(IMPORT_INSERT_QUERY, (import_ids, batch_id))
+                inserted = cur.rowcount
+                cur.execute("""
+                    UPDATE import_batches
+                    SET row_count = %s, duplicate_count = %s, completed_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (inserted, valid_count - inserted, batch_id))
+                cur.execute("DELETE FROM import_staging WHERE import_id = ANY(%s)", (import_ids,))
+                cur.execute("COMMIT")
+            print(f"{inserted} transactions importées, {valid_count - inserted} doublons ignorés")
+            return batch_id, inserted, valid_count - inserted, errors
+        except Exception as e:
+            print(f"Erreur lors de l'import des transactions: {str(e)}")
+            raise
+
+    def discard_import(self, import_ids):
+        """Supprime les lignes d'imports en transit abandonnés."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("DELETE FROM import_staging WHERE import_id = ANY(%s)", (list(import_ids),))
+        except Exception as e:
+            print(f"Erreur lors de la suppression de l'import en transit: {str(e)}")
+            raise
+
+    def purge_import_staging(self, hours=24):
+        """Supprime les imports en transit copiés depuis plus de hours heures (imports interrompus)."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM import_staging
+                    WHERE staged_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+                """, (hours,))
+                return cur.rowcount
+        except Exception as e:
+            print(f"Erreur lors de la purge des imports en transit: {str(e)}")
+            raise
 
-        if category_id:
-            conditions.append("t.category_id = %s")
-            params.append(category_id)
+    def get_import_batches(self, limit=20):
+        """Récupère les derniers lots d'import, les plus récents d'abord."""
+        query = """
+            SELECT id, file_name, username, checksum, row_count, duplicate_count, created_at, completed_at, undone_at
+            FROM import_batches
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        try:
+            return self._read_sql(query, (limit,))
+        except Exception as e:
+            print(f"Erreur lors de la récupération des lots d'import: {str(e)}")
+            return pd.DataFrame(columns=['id', 'file_name', 'username', 'checksum', 'row_count', 'duplicate_count',
+                                         'created_at', 'completed_at', 'undone_at'])
 
-        if inclus_calcul_only:
-            conditions.append("p.inclus_calcul = TRUE OR t.project IS NULL")
+    def undo_import_batch(self, batch_id):
+        """Annule un lot d'import: ses transactions passent dans l'archive en une instruction.
 
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
+        Renvoie le nombre de transactions retirées.
+        """
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(UNDO_IMPORT_BATCH_QUERY, (batch_id, batch_id))
+                row = cur.fetchone()
+                if row is None:
+                    raise ValueError(f"Le lot d'import {batch_id} n'existe pas")
+            print(f"Import {batch_id} annulé: {row[0]} transactions retirées")
+            return row[0]
+        except Exception as e:
+            print(f"Erreur lors de l'annulation de l'import: {str(e)}")
+            raise
 
-        query += " ORDER BY t.date DESC"
+    def restore_import_batch(self, batch_id):
+        """Rétablit les transactions archivées d'un lot d'import annulé, en une instruction.
 
+        Les transactions réimportées entre-temps (même empreinte) restent dans
+        l'archive. Renvoie le nombre de transactions rétablies.
+        """
         try:
-            return pd.read_sql(query, self.conn, params=params)
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute(f"""
+                    WITH restored AS (
+                        INSERT INTO transactions ({ARCHIVE_COLUMNS})
+                        SELECT {ARCHIVE_COLUMNS} FROM transactions_archive WHERE import_batch_id = %s
+                        ON CONFLICT DO NOTHING
+                        RETURNING id
+                    ), removed AS (
+                        DELETE FROM transactions_archive a USING restored r
+                        WHERE a.id = r.id
+                        RETURNING 1
+                    )
+                    UPDATE import_batches SET undone_at = NULL
+                    WHERE id = %s
+                    RETURNING (SELECT COUNT(*) FROM removed)
+                """, (batch_id, batch_id))
+                row = cur.fetchone()
+                if row is None:
+                    raise ValueError(f"Le lot d'import {batch_id} n'existe pas")
+            print(f"Import {batch_id} rétabli: {row[0]} transactions")
+            return row[0]
         except Exception as e:
-            print(f"Erreur lors de la récupération des transactions filtrées: {str(e)}")
-            return pd.DataFrame(columns=['date', 'montant', 'libelle', 'category_name', 'type', 'project', 'payer', 'inclus_calcul'])
+            print(f"Erreur lors du rétablissement de l'import: {str(e)}")
+            raise
 
-    def get_summary_by_period(self, period='month', inclus_calcul_only=False):
-        """Récupère un résumé des transactions par période."""
-        self.ensure_connection()
-        period_format = {
-            'day': 'YYYY-MM-DD',
-            'month': 'YYYY-MM',
-            'year': 'YYYY'
-        }
-        query = f"""
-            SELECT 
-                TO_CHAR(t.date, '{period_format[period]}') as period,
-                c.name as category_name,
-                t.type,
-                t.payer,
-                SUM(CASE WHEN t.type = 'charge' THEN t.montant ELSE 0 END) as charges,
-                SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE 0 END) as recettes
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            LEFT JOIN projects p ON t.project = p.name
-            WHERE 1=1
-            {" AND (p.inclus_calcul = TRUE OR t.project IS NULL)" if inclus_calcul_only else ""}
-            GROUP BY period, c.name, t.type, t.payer 
-            ORDER BY period, c.name
+    def _search_project_ids(self, query):
+        """Projets dont le nom correspond à la recherche de query: leurs transactions sont aussi retenues."""
+        if not query.search:
+            return []
+        term = query.search.lower()
+        project_names = self.get_reference_data().project_names
+        return [id_ for id_, name in project_names.items() if term in name.lower()]
+
+    def get_transaction_page(self, query, limit=15, after=None):
+        """Récupère une page de transactions filtrées par query.
+
+        Renvoie (page, curseur de la page suivante ou None). La pagination par
+        clé reste rapide quelle que soit la profondeur de la page.
         """
+        sql, params = query.select(after, self._search_project_ids(query), limit + 1)
         try:
-            return pd.read_sql(query, self.conn)
+            df = compact_frame(self._read_sql(sql, params))
         except Exception as e:
-            print(f"Erreur lors de la récupération du résumé: {str(e)}")
-            return pd.DataFrame(columns=['period', 'category_name', 'type', 'payer', 'charges', 'recettes'])
+            print(f"Erreur lors de la récupération des transactions: {str(e)}")
+            return compact_frame(pd.DataFrame(columns=TRANSACTION_COLUMNS)), None
+        if len(df) <= limit:
+            return df, None
+        df = df.iloc[:limit]
+        return df, query.cursor(df.iloc[-1])
+
+    def search_transactions(self, term, limit=15, cursor=None):
+        """Recherche les transactions par libellé ou projet, les plus pertinentes d'abord.
+
+        Renvoie (page, curseur de la page suivante ou None) comme
+        get_transaction_page; les index de la migration 7 évitent de parcourir
+        la table.
+        """
+        query = TransactionQuery(search=term)
+        sql, params = query.ranked(cursor, self._search_project_ids(query), limit + 1)
+        try:
+            df = compact_frame(self._read_sql(sql, params))
+        except Exception as e:
+            print(f"Erreur lors de la recherche des transactions: {str(e)}")
+            return compact_frame(pd.DataFrame(columns=TRANSACTION_COLUMNS + ['score'])), None
+        if len(df) <= limit:
+            return df, None
+        df = df.iloc[:limit]
+        return df, (float(df.iloc[-1]['score']), int(df.iloc[-1]['id']))
+
+    def get_transaction_totals(self, query):
+        """Compte les transactions filtrées et totalise charges et recettes, sans charger les lignes."""
+        sql, params = query.totals(self._search_project_ids(query))
+
+        def fetch(conn):
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, params)
+                return dict(cur.fetchone())
+
+        try:
+            return self._read(fetch)
+        except Exception as e:
+            print(f"Erreur lors du calcul des totaux des transactions: {str(e)}")
+            return {'count': 0, 'charges': 0, 'recettes': 0}
+
+    def export_transactions(self, query):
+        """Récupère toutes les transactions filtrées par query, pour un export."""
+        sql, params = query.select(search_project_ids=self._search_project_ids(query))
+        try:
+            return compact_frame(self._read_sql(sql, params))
+        except Exception as e:
+            print(f"Erreur lors de l'export des transactions: {str(e)}")
+            return compact_frame(pd.DataFrame(columns=TRANSACTION_COLUMNS))
 
     def delete_transaction(self, transaction_id):
         """Supprime une transaction."""
         if not isinstance(transaction_id, int):
             raise ValueError("L'ID de transaction doit être un entier")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("DELETE FROM transactions WHERE id = %s RETURNING id", (transaction_id,))
                 if cur.fetchone() is None:
                     raise ValueError(f"La transaction avec l'ID {transaction_id} n'existe pas")
@@ -424,23 +1193,55 @@ class Database:
             print(f"Erreur lors de la suppression de la transaction: {str(e)}")
             raise
 
+    def get_unpaid_transactions(self, date_from, date_to):
+        """Récupère les transactions non payées entre deux dates, pour le rapprochement bancaire.
+
+        La condition payer = FALSE et le filtre (type, date) sont servis par
+        l'index partiel transactions_unpaid_idx.
+        """
+        try:
+            return self._read_sql(UNPAID_TRANSACTIONS_QUERY, (date_from, date_to))
+        except Exception as e:
+            print(f"Erreur lors de la récupération des transactions non payées: {str(e)}")
+            return pd.DataFrame(columns=['id', 'date', 'montant', 'libelle', 'type', 'project'])
+
+    def mark_transactions_paid(self, transaction_ids, payment_dates):
+        """Marque des transactions comme payées, chacune à sa date, en une seule instruction.
+
+        Les transactions déjà payées entre-temps ne sont pas modifiées.
+        Renvoie le nombre de transactions mises à jour.
+        """
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE transactions t
+                    SET payer = TRUE, payment_date = m.payment_date
+                    FROM unnest(%s::integer[], %s::date[]) AS m(id, payment_date)
+                    WHERE t.id = m.id AND t.payer = FALSE
+                """, ([int(id_) for id_ in transaction_ids], list(payment_dates)))
+                count = cur.rowcount
+            print(f"{count} transactions marquées comme payées")
+            return count
+        except Exception as e:
+            print(f"Erreur lors du rapprochement des paiements: {str(e)}")
+            raise
+
     def delete_category(self, category_id):
         """Supprime une catégorie si elle n'est pas utilisée."""
         if not isinstance(category_id, int):
             raise ValueError("L'ID de catégorie doit être un entier")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 # Vérifie si la catégorie est utilisée
-                cur.execute("SELECT COUNT(*) FROM transactions WHERE category_id = %s", (category_id,))
-                if cur.fetchone()[0] > 0:
+                cur.execute(CATEGORY_IN_USE_QUERY, (category_id,))
+                if cur.fetchone()[0]:
                     raise ValueError("Cette catégorie ne peut pas être supprimée car elle est utilisée par des transactions")
 
                 # Supprime la catégorie
                 cur.execute("DELETE FROM categories WHERE id = %s RETURNING id", (category_id,))
                 if cur.fetchone() is None:
                     raise ValueError(f"La catégorie avec l'ID {category_id} n'existe pas")
+                invalidate_reference_data()
                 print(f"Catégorie supprimée avec succès (ID: {category_id})")
         except Exception as e:
             print(f"Erreur lors de la suppression de la catégorie: {str(e)}")
@@ -448,10 +1249,9 @@ class Database:
 
     def verify_login(self, username, password):
         """Vérifie les identifiants de connexion."""
-        self.ensure_connection()
         try:
             hashed_password = hashlib.sha256(password.encode()).hexdigest()
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+            with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
                     SELECT id, username, role, full_name, email
                     FROM users
@@ -474,16 +1274,15 @@ class Database:
         """Ajoute un nouveau projet."""
         if not name:
             raise ValueError("Le nom du projet est obligatoire")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO projects (name, description, inclus_calcul)
                     VALUES (%s, %s, %s)
                     RETURNING id
                 """, (name, description, inclus_calcul))
                 project_id = cur.fetchone()[0]
+                invalidate_reference_data()
                 print(f"Projet '{name}' créé avec succès (ID: {project_id})")
                 return project_id
         except Exception as e:
@@ -492,10 +1291,8 @@ class Database:
 
     def get_projects(self):
         """Récupère tous les projets."""
-        self.ensure_connection()
-        query = "SELECT * FROM projects ORDER BY name"
         try:
-            return pd.read_sql(query, self.conn)
+            return self.get_reference_data().projects.copy()
         except Exception as e:
             print(f"Erreur lors de la récupération des projets: {str(e)}")
             return pd.DataFrame(columns=['id', 'name', 'description', 'created_at', 'inclus_calcul'])
@@ -504,100 +1301,128 @@ class Database:
         """Supprime un projet."""
         if not isinstance(project_id, int):
             raise ValueError("L'ID du projet doit être un entier")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 # Vérifie si le projet est utilisé dans des transactions
-                cur.execute("SELECT COUNT(*) FROM transactions WHERE project = (SELECT name FROM projects WHERE id = %s)", (project_id,))
-                if cur.fetchone()[0] > 0:
+                cur.execute(PROJECT_IN_USE_QUERY, (project_id,))
+                if cur.fetchone()[0]:
                     raise ValueError("Ce projet ne peut pas être supprimé car il est utilisé par des transactions")
 
                 # Supprime le projet
                 cur.execute("DELETE FROM projects WHERE id = %s RETURNING id", (project_id,))
                 if cur.fetchone() is None:
                     raise ValueError(f"Le projet avec l'ID {project_id} n'existe pas")
+                invalidate_reference_data()
                 print(f"Projet supprimé avec succès (ID: {project_id})")
         except Exception as e:
             print(f"Erreur lors de la suppression du projet: {str(e)}")
             raise
-    def get_project_summary(self, period='month', inclus_calcul_only=False):
-        """Récupère un résumé des transactions par projet."""
-        self.ensure_connection()
-        period_format = {
-            'day': 'YYYY-MM-DD',
-            'month': 'YYYY-MM',
-            'year': 'YYYY'
-        }
-        query = f"""
-            SELECT 
-                TO_CHAR(t.date, '{period_format[period]}') as period,
-                t.project,
-                SUM(CASE WHEN t.type = 'charge' THEN t.montant ELSE 0 END) as charges,
-                SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE 0 END) as recettes,
-                SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE -t.montant END) as balance
-            FROM transactions t
-            LEFT JOIN projects p ON t.project = p.name
-            WHERE t.project IS NOT NULL
-            {" AND p.inclus_calcul = TRUE" if inclus_calcul_only else ""}
-            GROUP BY period, t.project
-            ORDER BY period DESC, t.project
+
+    def get_financial_snapshot(self):
+        """Situation financière des associés en une seule requête.
+
+        Renvoie un dict avec les totaux des projets inclus dans les calculs
+        (total_recettes_payees, total_recettes_impayees, total_depenses) et, sous
+        'partners', un DataFrame id, name, share_percentage, total_investi,
+        montant_paye (une ligne par associé).
+        """
+        query = """
+            WITH totals AS (
+                SELECT
+                    COALESCE(SUM(r.montant) FILTER (WHERE r.type = 'recette' AND r.payer), 0)
+                        as total_recettes_payees,
+                    COALESCE(SUM(r.montant) FILTER (WHERE r.type = 'recette' AND NOT r.payer), 0)
+                        as total_recettes_impayees,
+                    COALESCE(SUM(r.montant) FILTER (WHERE r.type = 'charge'), 0) as total_depenses
+                FROM transaction_rollup_daily r
+                LEFT JOIN projects p ON r.project_id = p.id
+                WHERE p.inclus_calcul = TRUE OR r.project_id IS NULL
+            ),
+            investments AS (
+                SELECT associe_id, SUM(montant) as total_investi
+                FROM transactions_investissement
+                GROUP BY associe_id
+            ),
+            payments AS (
+                SELECT partner_id, SUM(amount) as montant_paye
+                FROM partner_payments
+                GROUP BY partner_id
+            ),
+            partner_totals AS (
+                SELECT
+                    pa.id,
+                    pa.name,
+                    pa.share_percentage,
+                    COALESCE(i.total_investi, 0) as total_investi,
+                    COALESCE(pp.montant_paye, 0) as montant_paye
+                FROM partners pa
+                LEFT JOIN investments i ON i.associe_id = pa.id
+                LEFT JOIN payments pp ON pp.partner_id = pa.id
+            )
+            SELECT t.*, pt.*
+            FROM totals t
+            LEFT JOIN partner_totals pt ON TRUE
+            ORDER BY pt.name
         """
+        balance_columns = ['total_recettes_payees', 'total_recettes_impayees', 'total_depenses']
+        partner_columns = ['id', 'name', 'share_percentage', 'total_investi', 'montant_paye']
         try:
-            return pd.read_sql(query, self.conn)
+            rows = self._read_sql(query)
+            snapshot = {column: float(rows[column].iloc[0]) for column in balance_columns}
+            partners = rows[rows['id'].notna()][partner_columns].reset_index(drop=True)
+            partners = partners.astype({'id': int, 'share_percentage': float, 'total_investi': float,
+                                        'montant_paye': float})
         except Exception as e:
-            print(f"Erreur lors de la récupération du résumé par projet: {str(e)}")
-            return pd.DataFrame(columns=['period', 'project', 'charges', 'recettes', 'balance'])
-
-    def get_category_summary(self, period='month', inclus_calcul_only=False):
-        """Récupère un résumé des transactions par catégorie."""
-        self.ensure_connection()
-        period_format = {
-            'day': 'YYYY-MM-DD',
-            'month': 'YYYY-MM',
-            'year': 'YYYY'
-        }
+            print(f"Erreur lors du chargement de la situation financière: {str(e)}")
+            snapshot = {column: 0 for column in balance_columns}
+            partners = pd.DataFrame(columns=partner_columns)
+        snapshot['partners'] = partners
+        return snapshot
+
+    def get_dashboard_cube(self, period='month', inclus_calcul_only=False):
+        """Calcule tous les indicateurs et répartitions du tableau de bord en un seul passage."""
         query = f"""
-            SELECT 
-                TO_CHAR(t.date, '{period_format[period]}') as period,
-                c.name as category_name,
-                SUM(CASE WHEN t.type = 'charge' THEN t.montant ELSE 0 END) as charges,
-                SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE 0 END) as recettes,
-                SUM(CASE WHEN t.type = 'recette' THEN t.montant ELSE -t.montant END) as balance
-            FROM transactions t
-            LEFT JOIN categories c ON t.category_id = c.id
-            LEFT JOIN projects p ON t.project = p.name
-            WHERE 1=1
-            {" AND (p.inclus_calcul = TRUE OR t.project IS NULL)" if inclus_calcul_only else ""}
-            GROUP BY period, c.name
-            ORDER BY period DESC, c.name
+            WITH base AS (
+                SELECT
+                    TO_CHAR(r.day, '{PERIOD_FORMATS[period]}') as period,
+                    p.name as project,
+                    c.name as category_name,
+                    r.type,
+                    COALESCE(r.payer, FALSE) as payer,
+                    r.montant
+                FROM transaction_rollup_daily r
+                LEFT JOIN categories c ON r.category_id = c.id
+                LEFT JOIN projects p ON r.project_id = p.id
+                WHERE 1=1
+                {" AND (p.inclus_calcul = TRUE OR r.project_id IS NULL)" if inclus_calcul_only else ""}
+            )
+            SELECT
+                GROUPING(period, project, category_name, type, payer) as grouping_set,
+                period,
+                project,
+                category_name,
+                type,
+                payer,
+                SUM(CASE WHEN type = 'charge' THEN montant ELSE 0 END) as charges,
+                SUM(CASE WHEN type = 'recette' THEN montant ELSE 0 END) as recettes,
+                SUM(CASE WHEN type = 'recette' THEN montant ELSE -montant END) as balance
+            FROM base
+            GROUP BY GROUPING SETS (
+                (type, payer),
+                (period),
+                (period, project),
+                (project),
+                (period, category_name),
+                (category_name)
+            )
         """
         try:
-            return pd.read_sql(query, self.conn)
-        except Exception as e:
-            print(f"Erreur lors de la récupération du résumé par catégorie: {str(e)}")
-            return pd.DataFrame(columns=['period', 'category_name', 'charges', 'recettes', 'balance'])
-
-    def create_todo_table(self):
-        """Crée la table todo_tasks si elle n'existe pas."""
-        self.ensure_connection()
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS todo_tasks (
-                        id SERIAL PRIMARY KEY,
-                        project_name TEXT NOT NULL,
-                        due_date DATE NOT NULL,
-                        description TEXT,
-                        steps JSONB DEFAULT '[]'::jsonb,
-                        requirements TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                print("Table 'todo_tasks' créée ou déjà existante")
+            rows = self._read_sql(query)
         except Exception as e:
-            print(f"Erreur lors de la création de la table todo_tasks: {str(e)}")
-            raise
+            print(f"Erreur lors du calcul du tableau de bord: {str(e)}")
+            rows = pd.DataFrame(columns=['grouping_set', 'period', 'project', 'category_name', 'type', 'payer',
+                                         'charges', 'recettes', 'balance'])
+        return DashboardCube(rows)
 
     def add_todo_task(self, project_name, due_date, description=None, steps=None, requirements=None):
         """Ajoute une nouvelle tâche todo."""
@@ -605,10 +1430,8 @@ class Database:
             raise ValueError("Le nom du projet est obligatoire")
         if not due_date:
             raise ValueError("La date d'échéance est obligatoire")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO todo_tasks (project_name, due_date, description, steps, requirements)
                     VALUES (%s, %s, %s, %s::jsonb, %s)
@@ -623,14 +1446,13 @@ class Database:
 
     def get_todo_tasks(self):
         """Récupère toutes les tâches todo."""
-        self.ensure_connection()
         query = """
             SELECT id, project_name, due_date, description, steps, requirements, created_at
             FROM todo_tasks
             ORDER BY due_date ASC
         """
         try:
-            return pd.read_sql(query, self.conn)
+            return self._read_sql(query)
         except Exception as e:
             print(f"Erreur lors de la récupération des tâches: {str(e)}")
             return pd.DataFrame(columns=['id', 'project_name', 'due_date', 'description', 'steps', 'requirements', 'created_at'])
@@ -639,10 +1461,8 @@ class Database:
         """Met à jour les étapes d'une tâche todo."""
         if not isinstance(task_id, int):
             raise ValueError("L'ID de la tâche doit être un entier")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 updates = []
                 params = []
 
@@ -670,10 +1490,8 @@ class Database:
         """Supprime une tâche todo."""
         if not isinstance(task_id, int):
             raise ValueError("L'ID de la tâche doit être un entier")
-
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("DELETE FROM todo_tasks WHERE id = %s RETURNING id", (task_id,))
                 if cur.fetchone() is None:
                     raise ValueError(f"La tâche avec l'ID {task_id} n'existe pas")
@@ -684,43 +1502,28 @@ class Database:
 
     def mark_all_transactions_as_paid(self):
         """Marque toutes les transactions comme payées."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
-                cur.execute("UPDATE transactions SET payer = TRUE")
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("UPDATE transactions SET payer = TRUE WHERE payer = FALSE")
             print("Toutes les transactions ont été marquées comme payées")
         except Exception as e:
             print(f"Erreur lors de la mise à jour des transactions: {str(e)}")
             raise
 
     def delete_payment(self, payment_id):
-        db = Database()
-        query = "DELETE FROM partner_payments WHERE id = %s"
-        cur = db.conn.cursor()
-        cur.execute(query, (payment_id,))
-        db.conn.commit()
+        """Supprime un paiement d'associé."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("DELETE FROM partner_payments WHERE id = %s", (payment_id,))
+        except Exception as e:
+            print(f"Erreur lors de la suppression du paiement: {str(e)}")
+            raise
 
 
     def get_next_invoice_sequence(self):
         """Récupère et incrémente la séquence des factures."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
-                # Créer la table de séquence si elle n'existe pas
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS invoice_sequence (
-                        id INTEGER PRIMARY KEY,
-                        current_value INTEGER DEFAULT 0
-                    )
-                """)
-
-                # Insérer la première valeur si la table est vide
-                cur.execute("""
-                    INSERT INTO invoice_sequence (id, current_value)
-                    SELECT 1, 0
-                    WHERE NOT EXISTS (SELECT 1 FROM invoice_sequence)
-                """)
-
+            with self.connection() as conn, conn.cursor() as cur:
                 # Incrémenter et récupérer la nouvelle valeur
                 cur.execute("""
                     UPDATE invoice_sequence 
@@ -741,23 +1544,8 @@ class Database:
 
     def add_invoice(self, invoice_number, date, client_info, lines, totals_info, pdf_data):
         """Ajoute une nouvelle facture à l'historique."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
-                # Créer la table si elle n'existe pas
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS invoices (
-                        id SERIAL PRIMARY KEY,
-                        invoice_number TEXT NOT NULL,
-                        date DATE NOT NULL,
-                        client_info JSONB NOT NULL,
-                        lines JSONB NOT NULL,
-                        totals_info JSONB NOT NULL,
-                        pdf_data BYTEA NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-
+            with self.connection() as conn, conn.cursor() as cur:
                 # Insérer la nouvelle facture
                 cur.execute("""
                     INSERT INTO invoices (invoice_number, date, client_info, lines, totals_info, pdf_data)
@@ -774,39 +1562,40 @@ class Database:
 
     def get_invoices(self):
         """Récupère toutes les factures."""
-        self.ensure_connection()
-        try:
-            with self.conn.cursor(cursor_factory=RealDictCursor) as cur:
+        def fetch(conn):
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute("""
                     SELECT id, invoice_number, date, client_info, lines, totals_info, created_at
                     FROM invoices
                     ORDER BY created_at DESC
                 """)
                 return cur.fetchall()
+        try:
+            return self._read(fetch)
         except Exception as e:
             print(f"Erreur lors de la récupération des factures: {str(e)}")
             return []
 
     def get_invoice_pdf(self, invoice_id):
         """Récupère le PDF d'une facture."""
-        self.ensure_connection()
-        try:
-            with self.conn.cursor() as cur:
+        def fetch(conn):
+            with conn.cursor() as cur:
                 cur.execute("SELECT pdf_data FROM invoices WHERE id = %s", (invoice_id,))
-                result = cur.fetchone()
-                if result and result[0]:
-                    # Convert memoryview to bytes
-                    return bytes(result[0])
-                return None
+                return cur.fetchone()
+        try:
+            result = self._read(fetch)
+            if result and result[0]:
+                # Convert memoryview to bytes
+                return bytes(result[0])
+            return None
         except Exception as e:
             print(f"Erreur lors de la récupération du PDF: {str(e)}")
             return None
 
     def delete_invoice(self, invoice_id):
         """Supprime une facture."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("DELETE FROM invoices WHERE id = %s RETURNING id", (invoice_id,))
                 if cur.fetchone() is None:
                     raise ValueError(f"La facture avec l'ID {invoice_id} n'existe pas")
@@ -817,70 +1606,209 @@ class Database:
 
     def update_project_inclusion(self, project_id, inclus_calcul):
         """Met à jour le statut d'inclusion d'un projet."""
-        self.ensure_connection()
         try:
-            with self.conn.cursor() as cur:
+            with self.connection() as conn, conn.cursor() as cur:
                 cur.execute("""
                     UPDATE projects
                     SET inclus_calcul = %s
                     WHERE id = %s
                 """, (inclus_calcul, project_id))
+                invalidate_reference_data()
                 print(f"Statut d'inclusion du projet (ID: {project_id}) mis à jour avec succès")
         except Exception as e:
             print(f"Erreur lors de la mise à jour du statut d'inclusion: {str(e)}")
             raise
 
     def update_project_name(self, project_id, new_name):
-        """Met à jour le nom d'un projet et ses références."""
+        """Met à jour le nom d'un projet (les transactions le référencent par son ID)."""
         if not isinstance(project_id, int):
             raise ValueError("L'ID du projet doit être un entier")
         if not new_name:
             raise ValueError("Le nouveau nom du projet est obligatoire")
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                # Vérifie si le nouveau nom n'existe pas déjà
+                cur.execute("SELECT id FROM projects WHERE name = %s AND id != %s", (new_name, project_id))
+                if cur.fetchone():
+                    raise ValueError(f"Un projet avec le nom '{new_name}' existe déjà")
 
-        self.ensure_connection()
+                cur.execute("""
+                    UPDATE projects 
+                    SET name = %s 
+                    WHERE id = %s
+                    RETURNING id
+                """, (new_name, project_id))
+                if cur.fetchone() is None:
+                    raise ValueError(f"Le projet avec l'ID {project_id} n'existe pas")
+                invalidate_reference_data()
+                print(f"Nom du projet mis à jour avec succès (ID: {project_id})")
+        except Exception as e:
+            print(f"Erreur lors de la mise à jour du nom du projet: {str(e)}")
+            raise
+
+    def submit_job(self, kind, params, payload=None, username=None):
+        """Ajoute une tâche de fond à la file et réveille les travailleurs; renvoie son ID.
+
+        params est déjà sérialisé en JSON.
+        """
         try:
-            with self.conn.cursor() as cur:
-                # Désactive temporairement l'autocommit pour gérer la transaction
-                old_autocommit = self.conn.autocommit
-                self.conn.autocommit = False
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    WITH job AS (
+                        INSERT INTO jobs (kind, params, payload, username)
+                        VALUES (%s, %s, %s, %s)
+                        RETURNING id
+                    )
+                    SELECT id, pg_notify(%s, id::text) FROM job
+                """, (kind, params, payload, username, JOBS_CHANNEL))
+                return cur.fetchone()[0]
+        except Exception as e:
+            print(f"Erreur lors de la soumission de la tâche: {str(e)}")
+            raise
 
-                try:
-                    # Vérifie si le nouveau nom n'existe pas déjà
-                    cur.execute("SELECT id FROM projects WHERE name = %s AND id != %s", (new_name, project_id))
-                    if cur.fetchone():
-                        raise ValueError(f"Un projet avec le nom '{new_name}' existe déjà")
-
-                    # Récupère l'ancien nom du projet
-                    cur.execute("SELECT name FROM projects WHERE id = %s", (project_id,))
-                    result= cur.fetchone()
-                    if not result:
-                        raise ValueError(f"Le projet avec l'ID {project_id} n'existe pas")
-                    old_name = result[0]
-
-                    #Met à jour les références dans la table transactions
-                    cur.execute("""
-                        UPDATE transactions 
-                        SET project = %s 
-                        WHERE project = %s
-                    """, (new_name, old_name))
+    def get_job(self, job_id):
+        """Récupère l'état d'une tâche de fond (sans ses données), ou None."""
+        def fetch(conn):
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT id, kind, username, status, attempts, progress, total, info, error,
+                           created_at, started_at, finished_at
+                    FROM jobs
+                    WHERE id = %s
+                """, (job_id,))
+                return cur.fetchone()
+        try:
+            return self._read(fetch)
+        except Exception as e:
+            print(f"Erreur lors de la récupération de la tâche: {str(e)}")
+            raise
 
-                    # Met à jour le nom du projet
-                    cur.execute("""
-                        UPDATE projects 
-                        SET name = %s 
-                        WHERE id = %s
-                    """, (new_name, project_id))
-
-                    # Commit la transaction
-                    self.conn.commit()
-                    print(f"Nom du projet mis à jour avec succès (ID: {project_id})")
-                except Exception as e:
-                    # En cas d'erreur, rollback la transaction
-                    self.conn.rollback()
-                    raise e
-                finally:
-                    # Restaure l'état d'autocommit
-                    self.conn.autocommit = old_autocommit
+    def get_job_result(self, job_id):
+        """Récupère le fichier produit par une tâche de fond, ou None."""
+        def fetch(conn):
+            with conn.cursor() as cur:
+                cur.execute("SELECT result FROM jobs WHERE id = %s", (job_id,))
+                return cur.fetchone()
+        try:
+            row = self._read(fetch)
+            return bytes(row[0]) if row and row[0] is not None else None
         except Exception as e:
-            print(f"Erreur lors de la mise à jour du nom du projet: {str(e)}")
+            print(f"Erreur lors de la récupération du résultat de la tâche: {str(e)}")
+            raise
+
+    def claim_job(self, worker, lease, max_attempts):
+        """Réserve la plus ancienne tâche disponible pour worker pendant lease secondes.
+
+        Une tâche est disponible si elle attend ou si le bail de son travailleur
+        a expiré avant max_attempts tentatives. FOR UPDATE SKIP LOCKED fait que deux travailleurs ne
+        réservent jamais la même tâche et ne s'attendent pas l'un l'autre.
+        Renvoie un dict id, kind, params, payload, username, attempts, ou None.
+        """
+        try:
+            with self.connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'running', attempts = attempts + 1, worker = %s, progress = 0,
+                        started_at = CURRENT_TIMESTAMP,
+                        locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                    WHERE id = (
+                        SELECT id FROM jobs
+                        WHERE status = 'pending'
+                           OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP AND attempts < %s)
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING id, kind, params, payload, username, attempts
+                """, (worker, lease, max_attempts))
+                job = cur.fetchone()
+            if job is not None and job['payload'] is not None:
+                job['payload'] = bytes(job['payload'])
+            return job
+        except Exception as e:
+            print(f"Erreur lors de la réservation d'une tâche: {str(e)}")
+            raise
+
+    # Les mises à jour d'une tâche en cours ne portent que sur une tâche encore réservée par
+    # worker: si son bail a expiré et qu'un autre travailleur l'a reprise, elles ne changent
+    # rien et renvoient False pour que l'ancien travailleur s'arrête.
+
+    def extend_job_lease(self, job_id, worker, lease):
+        """Prolonge de lease secondes le bail d'une tâche réservée par worker."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                WHERE id = %s AND worker = %s AND status = 'running'
+            """, (lease, job_id, worker))
+            return cur.rowcount > 0
+
+    def update_job_progress(self, job_id, worker, progress, total=None):
+        """Enregistre l'avancement d'une tâche réservée par worker."""
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                UPDATE jobs SET progress = %s, total = COALESCE(%s, total)
+                WHERE id = %s AND worker = %s AND status = 'running'
+            """, (progress, total, job_id, worker))
+            return cur.rowcount > 0
+
+    def finish_job(self, job_id, worker, info, result=None):
+        """Termine une tâche réservée par worker avec son résumé (JSON) et son éventuel fichier résultat."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'done', info = %s, result = %s, payload = NULL,
+                        locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker = %s AND status = 'running'
+                """, (info, result, job_id, worker))
+                return cur.rowcount > 0
+        except Exception as e:
+            print(f"Erreur lors de l'enregistrement du résultat de la tâche: {str(e)}")
+            raise
+
+    def fail_job(self, job_id, worker, error):
+        """Marque une tâche réservée par worker en échec avec son message d'erreur."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'failed', error = %s, payload = NULL,
+                        locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND worker = %s AND status = 'running'
+                """, (error, job_id, worker))
+                return cur.rowcount > 0
+        except Exception as e:
+            print(f"Erreur lors de l'enregistrement de l'échec de la tâche: {str(e)}")
+            raise
+
+    def fail_stale_jobs(self, max_attempts):
+        """Abandonne les tâches dont les travailleurs ont disparu max_attempts fois.
+
+        Renvoie le nombre de tâches abandonnées.
+        """
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'failed', payload = NULL, locked_until = NULL, finished_at = CURRENT_TIMESTAMP,
+                        error = 'Tâche interrompue ' || attempts || ' fois, abandonnée'
+                    WHERE status = 'running' AND locked_until < CURRENT_TIMESTAMP AND attempts >= %s
+                """, (max_attempts,))
+                return cur.rowcount
+        except Exception as e:
+            print(f"Erreur lors de l'abandon des tâches interrompues: {str(e)}")
+            raise
+
+    def purge_jobs(self, days):
+        """Supprime les tâches terminées depuis plus de days jours et leurs fichiers."""
+        try:
+            with self.connection() as conn, conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM jobs
+                    WHERE status IN ('done', 'failed')
+                      AND finished_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+                """, (days,))
+                return cur.rowcount
+        except Exception as e:
+            print(f"Erreur lors de la purge des tâches: {str(e)}")
             raise
@@ -0,0 +1,51 @@
+"""Mise en forme des transactions pour l'affichage et l'export CSV.
+
+Sans Streamlit: utilisé par la page des rapports et par les tâches de fond.
+"""
+import pandas as pd
+
+from database import amount_from_cents
+
+EXPORT_COLUMNS = ['Date', 'Libellé', 'Montant', 'Type', 'Catégorie', 'Projet', 'Payé', 'Date de paiement',
+                  'Inclus dans les calculs']
+
+
+def prepare_display(df):
+    """Met en forme les transactions pour l'affichage et l'export."""
+    df = df.copy()
+    df.insert(df.columns.get_loc('montant_cents'), 'montant', amount_from_cents(df.pop('montant_cents')))
+    df['date'] = pd.to_datetime(df['date']).dt.strftime('%d/%m/%Y')
+    df['payment_date'] = pd.to_datetime(df['payment_date']).dt.strftime('%d/%m/%Y')
+
+    # Suppression explicite des colonnes techniques
+    columns_to_drop = ['id', 'created_at', 'category_id', 'project_id']
+    display_df = df.drop(columns=[col for col in columns_to_drop if col in df.columns], errors='ignore')
+
+    display_df = display_df.rename(columns={
+        'date': 'Date',
+        'payment_date': 'Date de paiement',
+        'montant': 'Montant',
+        'libelle': 'Libellé',
+        'category_name': 'Catégorie',
+        'type': 'Type',
+        'project': 'Projet',
+        'payer': 'Payé',
+        'inclus_calcul': 'Inclus dans les calculs'
+    })
+
+    # Convert boolean payer to Oui/Non
+    display_df['Payé'] = display_df['Payé'].map({True: 'Oui', False: 'Non'})
+    display_df['Inclus dans les calculs'] = display_df['Inclus dans les calculs'].map({True: 'Oui', False: 'Non'})
+    return display_df
+
+
+def get_csv(display_df):
+    """Contenu CSV (séparateur ;, virgule décimale) des transactions mises en forme."""
+    export_df = display_df[EXPORT_COLUMNS]
+    return export_df.to_csv(
+        index=False,
+        sep=';',
+        encoding='utf-8-sig',
+        decimal=',',
+        float_format='%.2f'
+    )
@@ -0,0 +1,322 @@
+"""Import de transactions depuis un fichier Excel, CSV ou Parquet, par lots.
+
+Le fichier est lu par morceaux de taille fixe, copiés un à un dans la table
+de transit import_staging. Les lignes de tous les fichiers d'un import y sont
+ensuite validées ensemble en SQL pour l'aperçu (Database.check_import), puis
+insérées en une seule instruction et une seule transaction
+(Database.load_import). La mémoire utilisée ne dépend pas de la taille des
+fichiers.
+
+Excel est lu avec openpyxl en lecture seule. CSV et Parquet sont lus par
+pyarrow: les colonnes restent au format Arrow et dates et montants sont
+convertis par pyarrow.compute, sans passer par des objets Python ligne à
+ligne, ce qui est plusieurs fois plus rapide.
+"""
+import csv
+import datetime
+import hashlib
+import re
+
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+REQUIRED_COLUMNS = ['date', 'montant', 'libelle', 'type', 'projet', 'categorie', 'payer']
+
+CHUNK_SIZE = 5000
+
+# Au-delà, les erreurs sont seulement comptées
+MAX_REPORTED_ERRORS = 100
+
+# En-têtes de l'export CSV des rapports (exports.get_csv), pour qu'il puisse être réimporté
+COLUMN_ALIASES = {'paye': 'payer', 'date_de_paiement': 'date_paiement'}
+
+# Formats des dates écrites en texte, essayés dans l'ordre
+DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%Y-%m-%d %H:%M:%S']
+
+# Colonnes texte Arrow gardées au format Arrow dans pandas
+ARROW_TYPES = {pa.string(): pd.StringDtype('pyarrow'), pa.large_string(): pd.StringDtype('pyarrow')}
+
+
+def normalize_columns(columns):
+    """Noms de colonnes sans accents ni majuscules, espaces internes remplacés par _."""
+    return (pd.Index(columns).astype(str).str.lower().str.strip().str.replace(' ', '_')
+            .str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
+            .map(lambda column: COLUMN_ALIASES.get(column, column)))
+
+
+def _check_columns(columns):
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError(f"Colonnes manquantes: {', '.join(missing)}\nColonnes trouvées: {', '.join(columns)}")
+
+
+def _excel_chunks(file, chunk_size):
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = list(normalize_columns([column if column is not None else '' for column in header]))
+        _check_columns(columns)
+        # Numéro de la ligne dans la feuille: l'en-tête est la ligne 1
+        line = 1
+        lines, values = [], []
+        for row in rows:
+            line += 1
+            if all(value is None for value in row):
+                continue
+            lines.append(line)
+            values.append(row[:len(columns)] + (None,) * (len(columns) - len(row)))
+            if len(values) == chunk_size:
+                yield pd.DataFrame(values, columns=columns, index=lines)
+                lines, values = [], []
+        if values:
+            yield pd.DataFrame(values, columns=columns, index=lines)
+    finally:
+        workbook.close()
+
+
+def csv_format(file):
+    """Devine le séparateur de colonnes et le séparateur décimal d'un CSV sur son début.
+
+    Le séparateur est ; ou , selon l'en-tête; avec ;, la virgule décimale
+    (format de exports.get_csv) est reconnue si des valeurs comme 12,50
+    apparaissent. Renvoie (séparateur, séparateur décimal, noms des colonnes).
+    """
+    file.seek(0)
+    sample = file.read(64 * 1024).decode('utf-8-sig', errors='ignore')
+    file.seek(0)
+    lines = sample.splitlines()
+    header = lines[0] if lines else ''
+    sep = ';' if header.count(';') > header.count(',') else ','
+    decimal = '.'
+    if sep == ';':
+        number = re.compile(r'\s*[-+]?\d+,\d+\s*')
+        if any(number.fullmatch(field) for line in lines[1:] for field in line.split(';')):
+            decimal = ','
+    return sep, decimal, next(csv.reader([header], delimiter=sep), [])
+
+
+def _tables(batches, chunk_size):
+    """Regroupe des RecordBatch Arrow en tables de chunk_size lignes."""
+    pending = []
+    count = 0
+    for batch in batches:
+        pending.append(batch)
+        count += batch.num_rows
+        while count >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, chunk_size)
+            rest = table.slice(chunk_size)
+            pending = rest.to_batches()
+            count = rest.num_rows
+    if count:
+        yield pa.Table.from_batches(pending)
+
+
+def _csv_batches(file):
+    sep, decimal, columns = csv_format(file)
+    # Toutes les colonnes en texte: dates et montants sont convertis ensuite,
+    # pour garder la valeur brute des cellules invalides
+    reader = pa_csv.open_csv(
+        file,
+        read_options=pa_csv.ReadOptions(column_names=columns, skip_rows=1),
+        parse_options=pa_csv.ParseOptions(delimiter=sep),
+        convert_options=pa_csv.ConvertOptions(column_types={column: pa.string() for column in columns},
+                                              strings_can_be_null=True)
+    )
+    return reader, decimal
+
+
+def _arrow_chunks(batches, chunk_size, first_line, decimal):
+    for table in _tables(batches, chunk_size):
+        table = table.rename_columns(list(normalize_columns(table.column_names)))
+        _check_columns(table.column_names)
+        lines = pd.RangeIndex(first_line, first_line + table.num_rows)
+        first_line += table.num_rows
+        chunk = table.to_pandas(types_mapper=ARROW_TYPES.get)
+        chunk.index = lines
+        yield chunk, prepare_table(table, lines, decimal)
+
+
+def file_checksum(file):
+    """Empreinte SHA-256 du contenu du fichier, lu par blocs."""
+    file.seek(0)
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(1 << 20), b''):
+        digest.update(block)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def read_chunks(file, chunk_size=CHUNK_SIZE):
+    """Lit le fichier par morceaux de chunk_size lignes.
+
+    Produit des paires (morceau lu, lignes converties par prepare_chunk ou
+    prepare_table). Le morceau lu a des colonnes normalisées et pour index le
+    numéro de la ligne dans le fichier (la ligne dans la table pour Parquet).
+    Lève ValueError si des colonnes requises manquent.
+    """
+    file.seek(0)
+    name = getattr(file, 'name', '').lower()
+    if name.endswith('.csv'):
+        reader, decimal = _csv_batches(file)
+        return _arrow_chunks(reader, chunk_size, 2, decimal)
+    if name.endswith('.parquet'):
+        return _arrow_chunks(pq.ParquetFile(file).iter_batches(batch_size=chunk_size), chunk_size, 1, '.')
+    return ((chunk, prepare_chunk(chunk)) for chunk in _excel_chunks(file, chunk_size))
+
+
+def _text(series):
+    # PostgreSQL refuse le caractère nul dans un texte
+    return series.astype('string').str.replace('\x00', '', regex=False).str.strip()
+
+
+def parse_dates(values):
+    """Dates d'une colonne lue par pandas (NaT si invalide).
+
+    Les cellules date d'un classeur sont gardées telles quelles; le texte est
+    lu avec le premier des DATE_FORMATS qui convient, comme _arrow_dates: une
+    date ISO n'est jamais lue jour/mois inversés.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    is_date = values.map(lambda value: isinstance(value, datetime.date)).astype(bool)
+    dates = pd.to_datetime(values.where(is_date), errors='coerce')
+    text = _text(values.where(~is_date))
+    for date_format in DATE_FORMATS:
+        dates = dates.fillna(pd.to_datetime(text, format=date_format, errors='coerce'))
+    return dates
+
+
+def prepare_chunk(chunk):
+    """Convertit un morceau lu au format de Database.stage_import.
+
+    Seules les dates et montants sont convertis ici; les règles de
+    validation sont appliquées en SQL sur la table de transit.
+    """
+    date = parse_dates(chunk['date'])
+    # Un montant infini est invalide comme un texte illisible
+    montant = pd.to_numeric(chunk['montant'], errors='coerce').replace([float('inf'), float('-inf')], float('nan'))
+    if 'date_paiement' in chunk.columns:
+        date_paiement = parse_dates(chunk['date_paiement'])
+    else:
+        # Sans colonne date_paiement, une transaction payée l'est à sa date
+        date_paiement = date
+    return pd.DataFrame({
+        'line': chunk.index,
+        'date': date,
+        'date_raw': _text(chunk['date']).where(date.isna()),
+        'montant': montant.round(2),
+        'montant_raw': _text(chunk['montant']).where(montant.isna()),
+        'libelle': _text(chunk['libelle']),
+        'type': _text(chunk['type']).str.lower(),
+        'projet': _text(chunk['projet']),
+        'categorie': _text(chunk['categorie']),
+        'payer': _text(chunk['payer']).str.lower(),
+        'date_paiement': date_paiement,
+    }, index=chunk.index)
+
+
+def _arrow_text(column):
+    if pa.types.is_boolean(column.type):
+        # Colonne payer typée dans un fichier Parquet
+        return pc.if_else(column, 'oui', 'non')
+    text = pc.replace_substring(pc.cast(column, pa.string()), '\x00', '')
+    return pc.utf8_trim_whitespace(text)
+
+
+def _arrow_dates(column):
+    """Dates d'une colonne Arrow typée, ou texte dans un des DATE_FORMATS (null si invalide)."""
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        return pc.cast(column, pa.timestamp('s'), safe=False)
+    text = _arrow_text(column)
+    return pc.coalesce(*[pc.strptime(text, format=date_format, unit='s', error_is_null=True)
+                         for date_format in DATE_FORMATS])
+
+
+def _arrow_amounts(column, decimal):
+    """Montants arrondis au centime d'une colonne Arrow typée ou texte (null si invalide)."""
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+        amounts = pc.cast(column, pa.float64())
+        return pc.round(pc.if_else(pc.is_finite(amounts), amounts, pa.scalar(None, pa.float64())), 2)
+    text = _arrow_text(column)
+    if decimal == ',':
+        text = pc.replace_substring(text, ',', '.')
+    valid = pc.match_substring_regex(text, r'^[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?$')
+    return pc.round(pc.cast(pc.if_else(valid, text, pa.scalar(None, pa.string())), pa.float64()), 2)
+
+
+def _raw(column, parsed):
+    """Texte brut des cellules que la conversion n'a pas su lire."""
+    return pc.if_else(pc.is_null(parsed), _arrow_text(column), pa.scalar(None, pa.string()))
+
+
+def prepare_table(table, lines, decimal='.'):
+    """Équivalent de prepare_chunk pour une table Arrow (CSV ou Parquet).
+
+    Les conversions sont faites par pyarrow.compute sur les colonnes entières;
+    decimal est le séparateur décimal des montants écrits en texte.
+    """
+    date = _arrow_dates(table['date'])
+    montant = _arrow_amounts(table['montant'], decimal)
+    if 'date_paiement' in table.column_names:
+        date_paiement = _arrow_dates(table['date_paiement'])
+    else:
+        # Sans colonne date_paiement, une transaction payée l'est à sa date
+        date_paiement = date
+    rows = pa.table({
+        'line': pa.array(lines, pa.int64()),
+        'date': date,
+        'date_raw': _raw(table['date'], date),
+        'montant': montant,
+        'montant_raw': _raw(table['montant'], montant),
+        'libelle': _arrow_text(table['libelle']),
+        'type': pc.utf8_lower(_arrow_text(table['type'])),
+        'projet': _arrow_text(table['projet']),
+        'categorie': _arrow_text(table['categorie']),
+        'payer': pc.utf8_lower(_arrow_text(table['payer'])),
+        'date_paiement': date_paiement,
+    }).to_pandas(types_mapper=ARROW_TYPES.get)
+    rows.index = lines
+    return rows
+
+
+def stage_file(file, db, preview_rows=20, chunk_size=CHUNK_SIZE, progress=None):
+    """Copie tout le fichier, lot par lot, dans la table de transit sans le garder en mémoire.
+
+    progress(lignes lues) est appelée après chaque lot. Les lignes restent
+    en transit pour être validées puis importées avec celles des autres
+    fichiers (Database.check_import, Database.load_import); elles sont
+    supprimées si la lecture échoue. Renvoie un dict: import_id, rows et
+    preview (premières lignes).
+    """
+    preview = None
+    rows = 0
+    import_id = db.new_import_id()
+    try:
+        for chunk, prepared in read_chunks(file, chunk_size):
+            if preview is None:
+                preview = chunk.head(preview_rows)
+            db.stage_import(import_id, prepared)
+            rows += len(chunk)
+            if progress is not None:
+                progress(rows)
+    except Exception:
+        db.discard_import([import_id])
+        raise
+    if preview is None:
+        preview = pd.DataFrame(columns=REQUIRED_COLUMNS)
+    return {'import_id': import_id, 'rows': rows, 'preview': preview}
+
+
+def files_checksum(files):
+    """Empreinte d'un ensemble de fichiers: SHA-256 des empreintes de chacun, dans l'ordre."""
+    if len(files) == 1:
+        return file_checksum(files[0])
+    return hashlib.sha256(''.join(file_checksum(file) for file in files).encode()).hexdigest()
@@ -0,0 +1,159 @@
+"""Rendu PDF des factures.
+
+Sans Streamlit: appelé par la tâche de fond qui génère et enregistre une
+facture (voir jobs.py).
+"""
+import io
+
+from num2words import num2words
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+
+def invoice_totals(lines):
+    """Totaux HT, TVA et TTC des lignes de facture."""
+    total_ht = sum(line['quantite'] * line['prix_unitaire'] for line in lines)
+    total_tva = sum(line['quantite'] * line['prix_unitaire'] * (line['tva']/100) for line in lines)
+    return {
+        'total_ht': total_ht,
+        'total_tva': total_tva,
+        'total_ttc': total_ht + total_tva
+    }
+
+
+def render_invoice_pdf(invoice_number, invoice_date, date_debut, date_fin, client_info, lines):
+    """Renvoie le PDF de la facture (bytes)."""
+    totals = invoice_totals(lines)
+    buffer = io.BytesIO()
+
+    # Configuration du document avec des marges adaptées
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=1.5*cm,
+        leftMargin=1.5*cm,
+        topMargin=2.5*cm,
+        bottomMargin=3*cm
+    )
+
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # En-tête avec date à droite
+    header_data = [
+        ["", "Date: " + invoice_date.strftime("%d/%m/%Y")],
+        ["", f"Période de facturation: Du {date_debut.strftime('%d/%m/%Y')} au {date_fin.strftime('%d/%m/%Y')}"]
+    ]
+    header_table = Table(header_data, colWidths=[400, 150])
+    header_table.setStyle(TableStyle([
+        ('ALIGN', (-1, -1), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (-1, -1), (-1, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (-1, -1), (-1, -1), 10),
+    ]))
+    elements.append(header_table)
+    elements.append(Spacer(1, 20))
+
+    # Titre Facture
+    header_style = ParagraphStyle(
+        'CustomHeader',
+        parent=styles['Heading1'],
+        fontSize=16,
+        alignment=1,
+        spaceAfter=20
+    )
+    elements.append(Paragraph("FACTURE", header_style))
+
+    # Informations client et facture
+    info_data = [
+        ["N° Facture:", invoice_number],
+        ["Client:", client_info["nom"]],
+        ["ICE:", client_info["ice"]],
+        ["Adresse:", client_info["adresse"]]
+    ]
+
+    info_table = Table(info_data, colWidths=[100, 300])
+    info_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+    ]))
+    elements.append(info_table)
+    elements.append(Spacer(1, 20))
+
+    # Lignes de facture
+    invoice_data = [["Description", "Quantité", "Prix Unit. HT", "TVA", "Total HT"]]
+    for line in lines:
+        total_line = line['quantite'] * line['prix_unitaire']
+        invoice_data.append([
+            line['description'],
+            str(line['quantite']),
+            f"{line['prix_unitaire']:,.2f} DH",
+            f"{line['tva']}%",
+            f"{total_line:,.2f} DH"
+        ])
+
+    # Ajouter les totaux
+    invoice_data.extend([
+        ["", "", "", "Total HT:", f"{totals['total_ht']:,.2f} DH"],
+        ["", "", "", "Total TVA:", f"{totals['total_tva']:,.2f} DH"],
+        ["", "", "", "Total TTC:", f"{totals['total_ttc']:,.2f} DH"]
+    ])
+
+    # Créer le tableau des lignes
+    invoice_table = Table(invoice_data, colWidths=[250, 60, 80, 60, 80])
+    invoice_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('GRID', (0, 0), (-1, -4), 1, colors.black),
+        ('LINEABOVE', (3, -3), (-1, -3), 1, colors.black),
+        ('LINEABOVE', (3, -2), (-1, -2), 1, colors.black),
+        ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
+        ('ALIGN', (0, -3), (2, -1), 'RIGHT'),
+    ]))
+    elements.append(invoice_table)
+    elements.append(Spacer(1, 20))
+
+    # Montant en lettres
+    montant_lettres = num2words(totals['total_ttc'], lang='fr')
+    montant_text = f"Arrêté la présente facture à la somme de : {montant_lettres.upper()} DIRHAMS"
+    elements.append(Paragraph(montant_text, ParagraphStyle(
+        'MontantText',
+        parent=styles['Normal'],
+        fontSize=10,
+        alignment=0,
+        spaceBefore=10,
+        spaceAfter=20
+    )))
+
+    # Ajouter un espace pour pousser le footer vers le bas
+    elements.append(Spacer(1, 50))
+
+    # Footer avec les informations de la société (en bas de page)
+    footer_text = """
+    <para alignment="center">
+    <font size="10"><b>STE HABIBCASH SARL</b></font><br/>
+    <font size="8">ICE: 002184554000026<br/>
+    DR IKOURAMN AIT BRAIM CR BOUNAAMAN - TIZNIT<br/>
+    RC: 3939 - Patente: 49567063 - IF: 33668520 - CNSS: 2436357</font>
+    </para>
+    """
+
+    footer = Paragraph(footer_text, ParagraphStyle(
+        'Footer',
+        parent=styles['Normal'],
+        alignment=1,
+        textColor=colors.black,
+        leading=14  # Espacement entre les lignes
+    ))
+
+    elements.append(Spacer(1, 1*cm))  # Espace avant le footer
+    elements.append(footer)
+
+    doc.build(elements)
+    return buffer.getvalue()
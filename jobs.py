@@ -0,0 +1,283 @@
+"""File de tâches de fond dans PostgreSQL (table jobs).
+
+Les pages soumettent les travaux longs (lecture, validation et import de
+fichiers, export, facture) avec submit(), suivent leur avancement avec
+status() et lisent le résultat avec result(): la tâche continue si la page
+est relancée.
+Les tâches sont exécutées par `python jobs.py`, qui lance un processus
+travailleur par cœur. Chacun réserve la tâche suivante avec FOR UPDATE SKIP
+LOCKED et garde un bail qu'un thread prolonge tant que la tâche tourne: si
+le travailleur disparaît, la tâche est reprise par un autre.
+"""
+import argparse
+import datetime
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+import pandas as pd
+
+from database import JOBS_CHANNEL, Database, TransactionQuery
+from exports import get_csv, prepare_display
+from importer import MAX_REPORTED_ERRORS, stage_file
+
+FINISHED = ('done', 'failed')
+
+# Secondes pendant lesquelles une tâche réservée n'est pas reprise par un autre travailleur
+LEASE = 60
+
+# Une tâche dont le travailleur a disparu autant de fois est abandonnée
+MAX_ATTEMPTS = 3
+
+# Jours de conservation des tâches terminées et de leurs fichiers
+RETENTION_DAYS = 7
+
+# Heures après lesquelles un import en transit interrompu est supprimé
+STAGING_RETENTION_HOURS = 24
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Valeur non sérialisable: {value!r}")
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+def frame_to_json(df):
+    """Sérialise un DataFrame pour le résumé JSON d'une tâche."""
+    return json.loads(df.to_json(orient='split', date_format='iso', force_ascii=False))
+
+
+def frame_from_json(data):
+    """DataFrame sérialisé par frame_to_json()."""
+    return pd.read_json(io.StringIO(json.dumps(data)), orient='split', dtype=False)
+
+
+def _uploaded_file(payload, name):
+    """Fichier en mémoire portant le nom du fichier envoyé (le format en dépend)."""
+    file = io.BytesIO(payload)
+    file.name = name
+    return file
+
+
+def _scan(db, params, payload, progress):
+    summary = stage_file(_uploaded_file(payload, params['file_name']), db, progress=progress)
+    summary['preview'] = frame_to_json(summary['preview'])
+    return summary, None
+
+
+def _check(db, params, payload, progress):
+    counts, errors = db.check_import(params['import_ids'], MAX_REPORTED_ERRORS)
+    return {'files': frame_to_json(counts), 'errors': frame_to_json(errors)}, None
+
+
+def _import(db, params, payload, progress):
+    batch_id, inserted, skipped, errors = db.load_import(
+        params['import_ids'], params['total_rows'], params['file_name'], params.get('username'),
+        params.get('checksum'), MAX_REPORTED_ERRORS
+    )
+    return {'batch_id': batch_id, 'inserted': inserted, 'skipped': skipped, 'errors': frame_to_json(errors)}, None
+
+
+def _export_transactions(db, params, payload, progress):
+    for key in ('date_from', 'date_to', 'payment_date_from', 'payment_date_to'):
+        params[key] = _date(params.get(key))
+    transactions = db.export_transactions(TransactionQuery(**params))
+    return {'rows': len(transactions)}, get_csv(prepare_display(transactions)).encode('utf-8')
+
+
+def _invoice(db, params, payload, progress):
+    # reportlab n'est chargé que par les travailleurs qui rendent des factures
+    from invoices import invoice_totals, render_invoice_pdf
+
+    invoice_date = _date(params['date'])
+    pdf_data = render_invoice_pdf(
+        params['invoice_number'], invoice_date, _date(params['date_debut']), _date(params['date_fin']),
+        params['client_info'], params['lines']
+    )
+    invoice_id = db.add_invoice(
+        invoice_number=params['invoice_number'],
+        date=invoice_date,
+        client_info=params['client_info'],
+        lines=params['lines'],
+        totals_info=invoice_totals(params['lines']),
+        pdf_data=pdf_data
+    )
+    return {'invoice_id': invoice_id, 'invoice_number': params['invoice_number']}, pdf_data
+
+
+# Type de tâche -> fonction(db, params, payload, progress) renvoyant (résumé JSON, fichier ou None)
+HANDLERS = {
+    'import_scan': _scan,
+    'import_check': _check,
+    'import': _import,
+    'export_transactions': _export_transactions,
+    'invoice': _invoice,
+}
+
+
+def submit(db, kind, params=None, payload=None, username=None):
+    """Soumet une tâche de fond et renvoie son ID.
+
+    params doit être sérialisable en JSON (les dates sont acceptées); payload
+    est un fichier d'entrée (bytes) éventuel.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Type de tâche inconnu: {kind}")
+    return db.submit_job(kind, json.dumps(params or {}, default=_json_default), payload, username)
+
+
+def status(db, job_id):
+    """État d'une tâche: dict status ('pending', 'running', 'done', 'failed'),
+    progress, total, info (résumé), error..., ou None si elle n'existe pas."""
+    return db.get_job(job_id)
+
+
+def result(db, job_id):
+    """Renvoie (résumé, fichier ou None) d'une tâche terminée, None si elle tourne encore.
+
+    Lève RuntimeError si la tâche a échoué, ValueError si elle n'existe pas.
+    """
+    job = db.get_job(job_id)
+    if job is None:
+        raise ValueError(f"La tâche {job_id} n'existe pas")
+    if job['status'] == 'failed':
+        raise RuntimeError(job['error'])
+    if job['status'] != 'done':
+        return None
+    return job['info'], db.get_job_result(job_id)
+
+
+def run_job(db, job, worker, lease=LEASE):
+    """Exécute une tâche réservée par worker et enregistre son résultat ou son erreur.
+
+    Si la tâche n'appartient plus à worker (bail expiré, tâche reprise par un
+    autre travailleur), elle est arrêtée au prochain avancement et son
+    résultat n'est pas enregistré.
+    """
+    stop = threading.Event()
+    lost = threading.Event()
+
+    def keep_lease():
+        while not stop.wait(lease / 3):
+            try:
+                if not db.extend_job_lease(job['id'], worker, lease):
+                    lost.set()
+                    return
+            except Exception as e:
+                print(f"Erreur lors de la prolongation du bail de la tâche {job['id']}: {str(e)}")
+
+    def progress(done, total=None):
+        if lost.is_set() or not db.update_job_progress(job['id'], worker, done, total):
+            lost.set()
+            raise RuntimeError(f"La tâche {job['id']} a été reprise par un autre travailleur")
+
+    heartbeat = threading.Thread(target=keep_lease, name=f"job-{job['id']}-lease", daemon=True)
+    heartbeat.start()
+    try:
+        handler = HANDLERS.get(job['kind'])
+        if handler is None:
+            raise ValueError(f"Type de tâche inconnu: {job['kind']}")
+        info, data = handler(db, job['params'], job['payload'], progress)
+    except Exception as e:
+        print(f"Erreur lors de l'exécution de la tâche {job['id']} ({job['kind']}): {str(e)}")
+        if not lost.is_set():
+            db.fail_job(job['id'], worker, str(e))
+        return
+    finally:
+        stop.set()
+        heartbeat.join()
+    if not db.finish_job(job['id'], worker, json.dumps(info, default=_json_default), data):
+        print(f"Tâche {job['id']} ({job['kind']}) reprise par un autre travailleur, résultat abandonné")
+        return
+    print(f"Tâche {job['id']} ({job['kind']}) terminée")
+
+
+def work(name, poll_interval=5.0, lease=LEASE):
+    """Boucle d'un travailleur: exécute les tâches une à une, attend les suivantes sur NOTIFY.
+
+    S'arrête si le processus superviseur (main) disparaît.
+    """
+    # Les travailleurs ne lisent pas le flux des modifications: pas de connexion LISTEN inutile
+    db = Database(listen_changes=False)
+    listener = None
+    last_purge = None
+    parent = multiprocessing.parent_process()
+    while parent is None or parent.is_alive():
+        try:
+            if listener is None or listener.closed:
+                listener = db.pool.open_dedicated()
+                with listener.cursor() as cur:
+                    cur.execute(f"LISTEN {JOBS_CHANNEL}")
+            if last_purge is None or time.monotonic() - last_purge > 3600:
+                db.fail_stale_jobs(MAX_ATTEMPTS)
+                db.purge_jobs(RETENTION_DAYS)
+                db.purge_import_staging(STAGING_RETENTION_HOURS)
+                last_purge = time.monotonic()
+            job = db.claim_job(name, lease, MAX_ATTEMPTS)
+            if job is not None:
+                run_job(db, job, name, lease)
+                continue
+            # Rien à faire: attente d'une notification, ou d'un bail expiré au pire poll_interval
+            if select.select([listener], [], [], poll_interval) != ([], [], []):
+                listener.poll()
+                listener.notifies.clear()
+        except Exception as e:
+            print(f"Erreur du travailleur {name}: {str(e)}")
+            if listener is not None and not listener.closed:
+                listener.close()
+            listener = None
+            time.sleep(poll_interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Travailleurs de la file des tâches de fond")
+    parser.add_argument('--processes', type=int, default=int(os.environ.get('JOB_WORKERS', os.cpu_count() or 1)),
+                        help="nombre de processus travailleurs (par défaut JOB_WORKERS ou le nombre de cœurs)")
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help="secondes entre deux recherches de tâche sans notification")
+    args = parser.parse_args(argv)
+
+    # Arrêt propre sur SIGTERM (docker stop): les travailleurs sont arrêtés avec le superviseur
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Processus démarrés à neuf: chacun ouvre son propre pool de connexions
+    context = multiprocessing.get_context('spawn')
+    host = socket.gethostname()
+    serial = itertools.count()
+
+    def spawn(number):
+        # Nom unique par processus: un travailleur redémarré n'est pas le propriétaire des tâches du précédent
+        worker = context.Process(target=work, args=(f"{host}-{os.getpid()}-{next(serial)}", args.poll_interval),
+                                 name=f"job-worker-{number}", daemon=True)
+        worker.start()
+        return worker
+
+    workers = [spawn(number) for number in range(max(args.processes, 1))]
+    print(f"{len(workers)} travailleurs démarrés")
+    try:
+        while True:
+            time.sleep(args.poll_interval)
+            for number, worker in enumerate(workers):
+                if not worker.is_alive():
+                    # Un travailleur tué (mémoire, signal) est remplacé; sa tâche sera reprise après le bail
+                    print(f"Travailleur {worker.name} arrêté (code {worker.exitcode}), redémarrage")
+                    workers[number] = spawn(number)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
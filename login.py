@@ -19,7 +19,7 @@ def init_session_state():
 def check_admin_user():
     """Vérifie si un administrateur existe et en crée un si nécessaire."""
     try:
-        with st.session_state.db.conn.cursor() as cur:
+        with st.session_state.db.connection() as conn, conn.cursor() as cur:
             # Vérifier si des utilisateurs existent
             cur.execute("SELECT COUNT(*) FROM users")
             user_count = cur.fetchone()[0]
@@ -0,0 +1,627 @@
+"""Migrations versionnées du schéma de la base de données.
+
+Chaque migration est appliquée une seule fois, dans l'ordre, et enregistrée
+dans la table schema_migrations. À lancer au déploiement :
+
+    python migrations.py            # applique les migrations en attente
+    python migrations.py --status   # affiche la version du schéma
+"""
+import argparse
+import sys
+
+# Clé du verrou consultatif qui empêche deux déploiements de migrer en même temps
+MIGRATION_LOCK_KEY = 297002
+
+INITIAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS projects (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        description TEXT,
+        inclus_calcul BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        role TEXT CHECK (role IN ('admin', 'user')) NOT NULL,
+        full_name TEXT,
+        email TEXT UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS categories (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Ancienne clé étrangère texte vers projects, abandonnée
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.table_constraints
+            WHERE constraint_name = 'transactions_project_fkey'
+            AND table_name = 'transactions'
+            AND table_schema = current_schema()
+        ) THEN
+            ALTER TABLE transactions DROP CONSTRAINT transactions_project_fkey;
+        END IF;
+    END $$;
+
+    CREATE TABLE IF NOT EXISTS transactions (
+        id SERIAL PRIMARY KEY,
+        date DATE NOT NULL,
+        montant NUMERIC(15, 2) NOT NULL,
+        libelle TEXT NOT NULL,
+        category_id INTEGER REFERENCES categories(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
+        type TEXT CHECK (type IN ('charge', 'recette')) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        project TEXT,
+        is_paid BOOLEAN DEFAULT FALSE,
+        paid BOOLEAN DEFAULT TRUE,
+        payer BOOLEAN DEFAULT FALSE,
+        payment_date DATE
+    );
+
+    -- Projets référencés par des transactions mais absents de la table projects
+    INSERT INTO projects (name)
+    SELECT DISTINCT t.project
+    FROM transactions t
+    LEFT JOIN projects p ON t.project = p.name
+    WHERE t.project IS NOT NULL
+    AND p.name IS NULL
+    ON CONFLICT (name) DO NOTHING;
+
+    CREATE TABLE IF NOT EXISTS todo_tasks (
+        id SERIAL PRIMARY KEY,
+        project_name TEXT NOT NULL,
+        due_date DATE NOT NULL,
+        description TEXT,
+        steps JSONB DEFAULT '[]'::jsonb,
+        requirements TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS partners (
+        id SERIAL PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        share_percentage NUMERIC(5, 2) NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS partner_payments (
+        id SERIAL PRIMARY KEY,
+        partner_id INTEGER REFERENCES partners(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
+        amount NUMERIC(15, 2) NOT NULL,
+        payment_date DATE DEFAULT CURRENT_DATE,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS immobilisations (
+        id SERIAL PRIMARY KEY,
+        nom VARCHAR(255) NOT NULL,
+        description TEXT,
+        prix_total NUMERIC(15, 2) NOT NULL,
+        date_acquisition DATE DEFAULT CURRENT_DATE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS transactions_investissement (
+        id SERIAL PRIMARY KEY,
+        associe_id INTEGER REFERENCES partners(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
+        immobilisation_id INTEGER REFERENCES immobilisations(id) ON UPDATE NO ACTION ON DELETE NO ACTION,
+        montant NUMERIC(15, 2) NOT NULL,
+        date_transaction DATE DEFAULT CURRENT_DATE,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+INVOICES = """
+    CREATE TABLE IF NOT EXISTS invoice_sequence (
+        id INTEGER PRIMARY KEY,
+        current_value INTEGER DEFAULT 0
+    );
+
+    INSERT INTO invoice_sequence (id, current_value)
+    SELECT 1, 0
+    WHERE NOT EXISTS (SELECT 1 FROM invoice_sequence);
+
+    CREATE TABLE IF NOT EXISTS invoices (
+        id SERIAL PRIMARY KEY,
+        invoice_number TEXT NOT NULL,
+        date DATE NOT NULL,
+        client_info JSONB NOT NULL,
+        lines JSONB NOT NULL,
+        totals_info JSONB NOT NULL,
+        pdf_data BYTEA NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def transactions_project_id(cur):
+    """Ajoute à transactions.project (nom du projet) une clé étrangère entière project_id.
+
+    Le remplissage est validé par lots pour ne pas verrouiller la table
+    pendant toute la migration; l'étape peut être relancée sans risque.
+    L'ancienne colonne est gardée pour les processus encore sur l'ancien
+    code pendant un déploiement; elle est supprimée par drop_transactions_project.
+    """
+    conn = cur.connection
+    cur.execute("ALTER TABLE transactions ADD COLUMN IF NOT EXISTS project_id INTEGER REFERENCES projects(id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS transactions_project_id_idx ON transactions (project_id)")
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = 'transactions'
+        AND column_name = 'project'
+    """)
+    if cur.fetchone() is None:
+        return
+    cur.execute("""
+        INSERT INTO projects (name)
+        SELECT DISTINCT t.project
+        FROM transactions t
+        LEFT JOIN projects p ON t.project = p.name
+        WHERE t.project IS NOT NULL
+        AND p.name IS NULL
+        ON CONFLICT (name) DO NOTHING
+    """)
+    conn.commit()
+
+    cur.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM transactions")
+    first_id, last_id = cur.fetchone()
+    for start in range(first_id, last_id + 1, BACKFILL_BATCH_SIZE):
+        cur.execute("""
+            UPDATE transactions t
+            SET project_id = p.id
+            FROM projects p
+            WHERE t.project = p.name
+            AND t.project_id IS NULL
+            AND t.id BETWEEN %s AND %s
+        """, (start, start + BACKFILL_BATCH_SIZE - 1))
+        conn.commit()
+
+    cur.execute("SELECT COUNT(*) FROM transactions WHERE project IS NOT NULL AND project_id IS NULL")
+    missing = cur.fetchone()[0]
+    if missing:
+        raise RuntimeError(f"{missing} transactions n'ont pas pu être rattachées à un projet")
+
+
+def drop_transactions_project(cur):
+    """Supprime transactions.project une fois que plus aucun processus ne la lit.
+
+    Les transactions ajoutées par l'ancien code depuis la migration 3 sont
+    d'abord rattachées à leur projet.
+    """
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        AND table_name = 'transactions'
+        AND column_name = 'project'
+    """)
+    if cur.fetchone() is None:
+        return
+    cur.execute("""
+        INSERT INTO projects (name)
+        SELECT DISTINCT t.project
+        FROM transactions t
+        LEFT JOIN projects p ON t.project = p.name
+        WHERE t.project IS NOT NULL
+        AND t.project_id IS NULL
+        AND p.name IS NULL
+        ON CONFLICT (name) DO NOTHING
+    """)
+    cur.execute("""
+        UPDATE transactions t
+        SET project_id = p.id
+        FROM projects p
+        WHERE t.project = p.name
+        AND t.project_id IS NULL
+    """)
+    cur.execute("ALTER TABLE transactions DROP COLUMN project")
+
+
+# Index des requêtes fréquentes; vérifiés par check_indexes.py
+INDEXES = """
+    -- Filtres par période et tri de la liste des transactions
+    CREATE INDEX IF NOT EXISTS transactions_date_idx ON transactions (date, id);
+    CREATE INDEX IF NOT EXISTS transactions_payment_date_idx ON transactions (payment_date)
+        WHERE payment_date IS NOT NULL;
+    CREATE INDEX IF NOT EXISTS transactions_recent_idx ON transactions (created_at DESC, date DESC, id DESC);
+    CREATE INDEX IF NOT EXISTS transactions_category_id_idx ON transactions (category_id, date);
+
+    -- Transactions non payées: peu nombreuses, lues par montant
+    CREATE INDEX IF NOT EXISTS transactions_unpaid_idx ON transactions (type, date) INCLUDE (montant)
+        WHERE payer = FALSE;
+
+    -- Jointures des pages financières, couvrantes pour les sommes
+    CREATE INDEX IF NOT EXISTS partner_payments_partner_id_idx ON partner_payments (partner_id) INCLUDE (amount);
+    CREATE INDEX IF NOT EXISTS transactions_investissement_associe_id_idx
+        ON transactions_investissement (associe_id) INCLUDE (montant);
+    CREATE INDEX IF NOT EXISTS transactions_investissement_immobilisation_id_idx
+        ON transactions_investissement (immobilisation_id) INCLUDE (montant);
+"""
+
+
+# Agrégats journaliers des transactions, tenus à jour par triggers
+ROLLUP_DAILY = """
+    CREATE TABLE IF NOT EXISTS transaction_rollup_daily (
+        day DATE NOT NULL,
+        project_id INTEGER,
+        category_id INTEGER,
+        type TEXT NOT NULL,
+        payer BOOLEAN,
+        montant NUMERIC(15, 2) NOT NULL DEFAULT 0,
+        nb INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Les colonnes de la clé peuvent être NULL: elles sont ramenées à une valeur fixe pour l'unicité
+    CREATE UNIQUE INDEX IF NOT EXISTS transaction_rollup_daily_key
+        ON transaction_rollup_daily (day, COALESCE(project_id, 0), COALESCE(category_id, 0), type, COALESCE(payer::int, -1));
+
+    CREATE OR REPLACE FUNCTION transaction_rollup_apply() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            INSERT INTO transaction_rollup_daily AS r (day, project_id, category_id, type, payer, montant, nb)
+            SELECT date, project_id, category_id, type, payer, -SUM(montant), -COUNT(*)
+            FROM old_rows
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (day, COALESCE(project_id, 0), COALESCE(category_id, 0), type, COALESCE(payer::int, -1))
+            DO UPDATE SET montant = r.montant + EXCLUDED.montant, nb = r.nb + EXCLUDED.nb;
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO transaction_rollup_daily AS r (day, project_id, category_id, type, payer, montant, nb)
+            SELECT date, project_id, category_id, type, payer, SUM(montant), COUNT(*)
+            FROM new_rows
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (day, COALESCE(project_id, 0), COALESCE(category_id, 0), type, COALESCE(payer::int, -1))
+            DO UPDATE SET montant = r.montant + EXCLUDED.montant, nb = r.nb + EXCLUDED.nb;
+        END IF;
+
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            DELETE FROM transaction_rollup_daily
+            WHERE nb = 0
+            AND day IN (SELECT DISTINCT date FROM old_rows);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION transaction_rollup_truncate() RETURNS trigger AS $$
+    BEGIN
+        TRUNCATE transaction_rollup_daily;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS transaction_rollup_insert ON transactions;
+    CREATE TRIGGER transaction_rollup_insert
+        AFTER INSERT ON transactions
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transaction_rollup_apply();
+
+    DROP TRIGGER IF EXISTS transaction_rollup_update ON transactions;
+    CREATE TRIGGER transaction_rollup_update
+        AFTER UPDATE ON transactions
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transaction_rollup_apply();
+
+    DROP TRIGGER IF EXISTS transaction_rollup_delete ON transactions;
+    CREATE TRIGGER transaction_rollup_delete
+        AFTER DELETE ON transactions
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION transaction_rollup_apply();
+
+    DROP TRIGGER IF EXISTS transaction_rollup_truncate ON transactions;
+    CREATE TRIGGER transaction_rollup_truncate
+        AFTER TRUNCATE ON transactions
+        FOR EACH STATEMENT EXECUTE FUNCTION transaction_rollup_truncate();
+
+    -- Les triggers verrouillent la table: le remplissage initial est exact
+    TRUNCATE transaction_rollup_daily;
+    INSERT INTO transaction_rollup_daily (day, project_id, category_id, type, payer, montant, nb)
+    SELECT date, project_id, category_id, type, payer, SUM(montant), COUNT(*)
+    FROM transactions
+    GROUP BY 1, 2, 3, 4, 5;
+"""
+
+# Notification des modifications sur le canal data_changes, lue par changes.py.
+# Charge utile JSON: table, opération, PID du serveur qui a écrit et ID des
+# lignes touchées (null si elles sont trop nombreuses pour une notification).
+CHANGE_NOTIFICATIONS = """
+    CREATE OR REPLACE FUNCTION notify_data_change() RETURNS trigger AS $$
+    DECLARE
+        row_count INTEGER := 0;
+        row_ids JSONB;
+    BEGIN
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            SELECT COUNT(*), jsonb_agg(id) INTO row_count, row_ids FROM (SELECT id FROM new_rows LIMIT 501) r;
+        ELSIF TG_OP = 'DELETE' THEN
+            SELECT COUNT(*), jsonb_agg(id) INTO row_count, row_ids FROM (SELECT id FROM old_rows LIMIT 501) r;
+        END IF;
+        -- Instruction sans effet: rien à signaler
+        IF TG_OP <> 'TRUNCATE' AND row_count = 0 THEN
+            RETURN NULL;
+        END IF;
+        PERFORM pg_notify('data_changes', jsonb_build_object(
+            'table', TG_TABLE_NAME,
+            'op', TG_OP,
+            'pid', pg_backend_pid(),
+            'ids', CASE WHEN row_count <= 500 THEN row_ids END
+        )::text);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DO $$
+    DECLARE
+        tbl TEXT;
+    BEGIN
+        FOREACH tbl IN ARRAY ARRAY[
+            'transactions', 'projects', 'categories', 'partners', 'partner_payments',
+            'immobilisations', 'transactions_investissement', 'invoices'
+        ] LOOP
+            EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_insert ON %1$I', tbl);
+            EXECUTE format('CREATE TRIGGER %1$s_notify_insert AFTER INSERT ON %1$I
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', tbl);
+            EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_update ON %1$I', tbl);
+            EXECUTE format('CREATE TRIGGER %1$s_notify_update AFTER UPDATE ON %1$I
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', tbl);
+            EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_delete ON %1$I', tbl);
+            EXECUTE format('CREATE TRIGGER %1$s_notify_delete AFTER DELETE ON %1$I
+                REFERENCING OLD TABLE AS old_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', tbl);
+            EXECUTE format('DROP TRIGGER IF EXISTS %1$s_notify_truncate ON %1$I', tbl);
+            EXECUTE format('CREATE TRIGGER %1$s_notify_truncate AFTER TRUNCATE ON %1$I
+                FOR EACH STATEMENT EXECUTE FUNCTION notify_data_change()', tbl);
+        END LOOP;
+    END $$;
+"""
+
+# Recherche dans les libellés: trigrammes pour les sous-chaînes (ILIKE),
+# plein texte français pour les mots. Les requêtes doivent reprendre
+# l'expression to_tsvector('french', libelle) telle quelle pour utiliser l'index.
+LIBELLE_SEARCH = """
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+    CREATE INDEX IF NOT EXISTS transactions_libelle_trgm_idx
+        ON transactions USING gin (libelle gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS transactions_libelle_fts_idx
+        ON transactions USING gin (to_tsvector('french', libelle));
+"""
+
+# Table de transit des imports: les lignes brutes d'un fichier y sont copiées
+# morceau par morceau sous un identifiant tiré de import_staging_id_seq, puis
+# validées par jointures et insérées en une seule transaction. Le montant n'a
+# pas de précision fixe pour qu'un montant trop grand soit une erreur de sa
+# ligne; staged_at permet de purger les imports interrompus. Non journalisée:
+# son contenu ne survit pas à un arrêt brutal, ce que load_import vérifie.
+IMPORT_STAGING = """
+    CREATE SEQUENCE IF NOT EXISTS import_staging_id_seq;
+    CREATE UNLOGGED TABLE IF NOT EXISTS import_staging (
+        import_id BIGINT NOT NULL,
+        line INTEGER NOT NULL,
+        date DATE,
+        date_raw TEXT,
+        montant NUMERIC,
+        montant_raw TEXT,
+        libelle TEXT,
+        type TEXT,
+        projet TEXT,
+        categorie TEXT,
+        payer TEXT,
+        date_paiement DATE,
+        staged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (import_id, line)
+    );
+"""
+
+# Empreinte des transactions importées: un fichier importé deux fois n'ajoute
+# rien la seconde fois. Les transactions saisies à la main n'en ont pas.
+TRANSACTION_FINGERPRINT = """
+    ALTER TABLE transactions ADD COLUMN IF NOT EXISTS fingerprint UUID;
+    CREATE UNIQUE INDEX IF NOT EXISTS transactions_fingerprint_key ON transactions (fingerprint)
+        WHERE fingerprint IS NOT NULL;
+"""
+
+# Lots d'import: chaque transaction importée garde son lot, qui peut être
+# annulé d'un bloc. Les transactions d'un lot annulé sont déplacées dans
+# transactions_archive, d'où elles peuvent être rétablies.
+IMPORT_BATCHES = """
+    CREATE TABLE IF NOT EXISTS import_batches (
+        id SERIAL PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        username TEXT,
+        checksum TEXT,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        duplicate_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        completed_at TIMESTAMP,
+        undone_at TIMESTAMP
+    );
+
+    ALTER TABLE transactions ADD COLUMN IF NOT EXISTS import_batch_id INTEGER REFERENCES import_batches(id);
+    CREATE INDEX IF NOT EXISTS transactions_import_batch_id_idx ON transactions (import_batch_id)
+        WHERE import_batch_id IS NOT NULL;
+
+    CREATE TABLE IF NOT EXISTS transactions_archive (
+        id INTEGER PRIMARY KEY,
+        date DATE NOT NULL,
+        montant NUMERIC(15, 2) NOT NULL,
+        libelle TEXT NOT NULL,
+        category_id INTEGER,
+        type TEXT NOT NULL,
+        created_at TIMESTAMP,
+        is_paid BOOLEAN,
+        paid BOOLEAN,
+        payer BOOLEAN,
+        payment_date DATE,
+        project_id INTEGER,
+        fingerprint UUID,
+        import_batch_id INTEGER NOT NULL REFERENCES import_batches(id),
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS transactions_archive_import_batch_id_idx ON transactions_archive (import_batch_id);
+"""
+
+# Tâches de fond (imports, exports, factures) exécutées par `python jobs.py`.
+# Un travailleur réserve une tâche avec FOR UPDATE SKIP LOCKED; locked_until
+# est prolongé à chaque avancement et une tâche dont le travailleur a disparu
+# redevient disponible une fois ce délai passé.
+JOBS = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id SERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params JSONB NOT NULL DEFAULT '{}',
+        payload BYTEA,
+        username TEXT,
+        status TEXT NOT NULL DEFAULT 'pending'
+            CHECK (status IN ('pending', 'running', 'done', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        progress INTEGER NOT NULL DEFAULT 0,
+        total INTEGER,
+        worker TEXT,
+        locked_until TIMESTAMP,
+        info JSONB,
+        result BYTEA,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS jobs_queue_idx ON jobs (id)
+        WHERE status IN ('pending', 'running');
+"""
+
+# (version, description, étape) dans l'ordre d'application.
+# Une étape est un script SQL ou une fonction recevant un curseur.
+MIGRATIONS = [
+    (1, "Schéma initial", INITIAL_SCHEMA),
+    (2, "Factures et séquence de numérotation", INVOICES),
+    (3, "Clé étrangère transactions.project_id", transactions_project_id),
+    (4, "Index des requêtes fréquentes", INDEXES),
+    (5, "Agrégats journaliers des transactions", ROLLUP_DAILY),
+    (6, "Notifications des modifications", CHANGE_NOTIFICATIONS),
+    (7, "Index de recherche des libellés", LIBELLE_SEARCH),
+    (8, "Table de transit des imports", IMPORT_STAGING),
+    (9, "Empreinte des transactions importées", TRANSACTION_FINGERPRINT),
+    (10, "Lots d'import et archive des imports annulés", IMPORT_BATCHES),
+    (11, "File des tâches de fond", JOBS),
+    # Toujours après les migrations dont le code a besoin: voir COMPATIBLE_VERSION
+    (12, "Suppression de l'ancienne colonne transactions.project", drop_transactions_project),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Plus ancienne version du schéma avec laquelle le code fonctionne: celle qui précède la
+# suppression de transactions.project, que seul l'ancien code lit encore. Pendant un déploiement,
+# l'ancien et le nouveau code tournent ensemble sur cette version; la dernière migration est
+# appliquée une fois l'ancien code arrêté.
+COMPATIBLE_VERSION = 11
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(conn):
+    """Renvoie la dernière version appliquée, 0 pour une base vierge."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations')")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cur.fetchone()[0]
+
+
+def apply_migrations(conn, target=None):
+    """Applique les migrations en attente, chacune dans sa propre transaction.
+
+    Renvoie la liste des versions appliquées.
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    old_autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            with conn.cursor() as cur:
+                _ensure_migrations_table(cur)
+            # Relu après le verrou: un autre processus a pu migrer entre-temps
+            version = current_version(conn)
+            conn.autocommit = False
+            for number, description, step in MIGRATIONS:
+                if number <= version or number > target:
+                    continue
+                try:
+                    with conn.cursor() as cur:
+                        if callable(step):
+                            step(cur)
+                        else:
+                            cur.execute(step)
+                        cur.execute(
+                            "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (number, description)
+                        )
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Erreur lors de la migration {number} ({description}): {str(e)}")
+                    raise
+                print(f"Migration {number} appliquée: {description}")
+                applied.append(number)
+        finally:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.autocommit = old_autocommit
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrations du schéma de la base de données")
+    parser.add_argument('--status', action='store_true', help="affiche la version du schéma sans migrer")
+    parser.add_argument('--target', type=int, help="version à atteindre (par défaut la dernière)")
+    args = parser.parse_args(argv)
+
+    from database import get_pool
+
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        if args.status:
+            print(f"Version du schéma: {current_version(conn)} (dernière disponible: {LATEST_VERSION})")
+            return 0
+        applied = apply_migrations(conn, args.target)
+        if not applied:
+            print(f"Schéma déjà à jour (version {current_version(conn)})")
+        return 0
+    except Exception as e:
+        print(f"Erreur: {str(e)}")
+        return 1
+    finally:
+        pool.putconn(conn)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
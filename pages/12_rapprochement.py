@@ -0,0 +1,104 @@
+import streamlit as st
+import pandas as pd
+from database import Database
+from utils import set_page_config
+from reconciliation import read_statement, match_statement
+from auth.auth_decorator import require_auth
+
+set_page_config()
+
+@require_auth
+def main():
+    st.title("🏦 Rapprochement bancaire")
+
+    # Initialize database connection
+    if 'db' not in st.session_state:
+        st.session_state.db = Database()
+
+    st.markdown("""
+    Importez un relevé bancaire (Excel ou CSV) avec les colonnes **date**, **libelle** et soit **montant**
+    (négatif pour un débit), soit **debit** et **credit**. Chaque ligne est rapprochée d'une transaction
+    non payée de même montant et de date proche: un débit d'une charge, un crédit d'une recette.
+    Les transactions validées sont marquées comme payées à la date du relevé.
+    """)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        max_days = st.number_input("Écart de dates accepté (jours)", min_value=0, max_value=365, value=15)
+    with col2:
+        amount_tolerance = st.number_input("Tolérance sur le montant (DH)", min_value=0.0, value=0.0, step=0.5)
+
+    uploaded_file = st.file_uploader("Choisir un relevé bancaire", type=['xlsx', 'csv'])
+    if uploaded_file is None:
+        return
+
+    # Le rapprochement est gardé le temps de la validation
+    match_key = (uploaded_file.name, uploaded_file.size, max_days, amount_tolerance)
+    if st.session_state.get('rapprochement_key') != match_key:
+        try:
+            statement = read_statement(uploaded_file)
+        except Exception as e:
+            st.error(f"Erreur lors de la lecture du relevé: {str(e)}")
+            return
+        if statement.empty:
+            st.warning("Aucune ligne exploitable dans le relevé")
+            return
+        margin = pd.Timedelta(days=max_days)
+        unpaid = st.session_state.db.get_unpaid_transactions(
+            (statement['date'].min() - margin).date(), (statement['date'].max() + margin).date()
+        )
+        st.session_state.rapprochement = match_statement(statement, unpaid, amount_tolerance, max_days)
+        st.session_state.rapprochement_lines = len(statement)
+        st.session_state.rapprochement_key = match_key
+    matches, unmatched = st.session_state.rapprochement
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Lignes du relevé", st.session_state.rapprochement_lines)
+    col2.metric("Rapprochées", len(matches))
+    col3.metric("Sans correspondance", len(unmatched))
+
+    if not matches.empty:
+        st.subheader("✅ Correspondances proposées")
+        display = matches.rename(columns={
+            'line': 'Ligne',
+            'date': 'Date relevé',
+            'libelle': 'Libellé relevé',
+            'montant': 'Montant relevé',
+            'type': 'Type',
+            'transaction_date': 'Date transaction',
+            'transaction_libelle': 'Libellé transaction',
+            'transaction_montant': 'Montant transaction',
+            'ecart_jours': 'Écart (jours)',
+            'ecart_montant': 'Écart (DH)',
+            'similarite': 'Ressemblance',
+        }).drop(columns=['transaction_id'])
+        display.insert(0, 'Valider', True)
+        edited = st.data_editor(
+            display,
+            use_container_width=True,
+            hide_index=True,
+            disabled=[column for column in display.columns if column != 'Valider'],
+            key=f"rapprochement_editor_{hash(match_key)}"
+        )
+        selected = matches[edited['Valider'].to_numpy()]
+
+        if st.button(f"💰 Marquer {len(selected)} transactions comme payées", disabled=selected.empty):
+            try:
+                count = st.session_state.db.mark_transactions_paid(
+                    selected['transaction_id'].tolist(), selected['date'].tolist()
+                )
+                st.session_state.rapprochement_key = None
+                st.success(f"{count} transactions marquées comme payées")
+            except Exception as e:
+                st.error(f"Erreur lors du rapprochement: {str(e)}")
+
+    if not unmatched.empty:
+        st.subheader("❓ Lignes sans correspondance")
+        unmatched_display = unmatched.drop(columns=['line']).rename(columns={
+            'date': 'Date', 'libelle': 'Libellé', 'montant': 'Montant', 'type': 'Type'
+        })
+        unmatched_display['Date'] = pd.to_datetime(unmatched_display['Date']).dt.strftime('%d/%m/%Y')
+        st.dataframe(unmatched_display, use_container_width=True, hide_index=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import streamlit as st
 import pandas as pd
 import datetime
-from database import Database
-from utils import set_page_config
+from database import Database, TransactionQuery, amount_from_cents
+from utils import set_page_config, follow_jobs, follow_job
+from importer import files_checksum
+import jobs
 import io
 
 set_page_config()
@@ -19,139 +21,137 @@ if 'db' not in st.session_state:
     st.session_state.db = Database()
 
 # Get categories for the select box
-categories_df = st.session_state.db.get_categories()
+refs = st.session_state.db.get_reference_data()
+categories_df = refs.categories
 if categories_df.empty:
     st.warning("⚠️ Veuillez d'abord créer des catégories dans la section 'Gestion des Catégories'")
     st.stop()
 
-# Liste des projets disponibles depuis la base de données
-projects_df = st.session_state.db.get_projects()
-PROJETS = projects_df['name'].tolist() if not projects_df.empty else []
-
-# Fonction pour traiter le fichier Excel
-def process_excel_file(df, categories_df):
-    try:
-        # Afficher les colonnes trouvées dans le fichier
-        st.write("Colonnes trouvées dans le fichier:", list(df.columns))
-
-        # Normaliser les noms de colonnes (enlever les accents, espaces, majuscules)
-        df.columns = df.columns.str.lower().str.strip()
-        df.columns = df.columns.str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-
-        # Vérifier les colonnes requises
-        required_columns = ['date', 'montant', 'libelle', 'type', 'projet', 'categorie', 'payer']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            st.error("Structure attendue du fichier Excel:")
-            st.code("""
-            | date       | montant | libelle        | type    | projet   | categorie | payer  | date_paiement |
-            |------------|---------|----------------|---------|----------|-----------|--------|---------------|
-            | 31/01/2025| 100.00  | Description... | charge  | TAWSSIL  | Loyer     | oui    | 31/01/2025   |
-            """)
-            return False, f"Colonnes manquantes: {', '.join(missing_columns)}\nColonnes trouvées: {', '.join(df.columns)}"
-
-        # Vérifier les types de données
-        df['date'] = pd.to_datetime(df['date'])
-        df['montant'] = pd.to_numeric(df['montant'])
-        if 'date_paiement' in df.columns:
-            df['date_paiement'] = pd.to_datetime(df['date_paiement'])
-
-        # Vérifier les valeurs valides pour le type et le projet
-        if not df['type'].isin(['charge', 'recette']).all():
-            invalid_types = df[~df['type'].isin(['charge', 'recette'])]['type'].unique()
-            return False, f"Types invalides trouvés: {invalid_types}. Utilisez 'charge' ou 'recette'."
-
-        if not df['projet'].isin(PROJETS).all():
-            invalid_projects = df[~df['projet'].isin(PROJETS)]['projet'].unique()
-            return False, f"Projets invalides trouvés: {invalid_projects}. Utilisez: {', '.join(PROJETS)}"
-
-        # Convertir les noms de catégories en IDs
-        categories_dict = dict(zip(categories_df['name'].str.lower(), categories_df['id']))
-        df['categorie'] = df['categorie'].str.lower()
-        invalid_categories = df[~df['categorie'].isin(categories_dict.keys())]['categorie'].unique()
-        if len(invalid_categories) > 0:
-            return False, f"Catégories invalides trouvées: {invalid_categories}.\nCatégories disponibles: {', '.join(categories_df['name'])}."
-
-        # Add payer validation
-        df['payer'] = df['payer'].str.lower()
-        if not df['payer'].isin(['oui', 'non']).all():
-            invalid_payer = df[~df['payer'].isin(['oui', 'non'])]['payer'].unique()
-            return False, f"Valeurs invalides pour 'payer' trouvées: {invalid_payer}. Utilisez 'oui' ou 'non'."
-
-        # Convert 'oui'/'non' to boolean
-        df['payer'] = df['payer'].map({'oui': True, 'non': False})
-
-        # Validate date_paiement if present
-        if 'date_paiement' in df.columns:
-            # Pour les lignes où payer = True, date_paiement est obligatoire
-            missing_payment_dates = df[df['payer'] & df['date_paiement'].isna()]
-            if not missing_payment_dates.empty:
-                return False, "Date de paiement manquante pour certaines transactions marquées comme payées"
-
-        # Formater les données pour l'affichage
-        display_df = df.copy()
-        display_df['date'] = display_df['date'].dt.strftime('%d/%m/%Y')
-        if 'date_paiement' in display_df.columns:
-            display_df['date_paiement'] = display_df['date_paiement'].dt.strftime('%d/%m/%Y')
-
-        # Initialiser l'état de confirmation si nécessaire
-        if 'import_confirmed' not in st.session_state:
-            st.session_state.import_confirmed = False
-
-        # Afficher l'aperçu seulement si pas encore confirmé
-        if not st.session_state.import_confirmed:
-            st.subheader("Aperçu des données à importer")
-            st.dataframe(display_df, use_container_width=True)
-
-            # Demander confirmation
-            if st.button("Confirmer l'import des données"):
-                # Insérer les données
-                success_count = 0
-                for _, row in df.iterrows():
-                    try:
-                        # Déterminer la date de paiement
-                        payment_date = None
-                        if row['payer']:
-                            payment_date = row['date_paiement'].date() if 'date_paiement' in df.columns and pd.notna(row['date_paiement']) else row['date'].date()
-
-                        query = """
-                        INSERT INTO transactions (date, montant, libelle, category_id, type, project, payer, payment_date)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """
-                        cur = st.session_state.db.conn.cursor()
-                        cur.execute(query, (
-                            row['date'].date(),
-                            float(row['montant']),
-                            row['libelle'],
-                            categories_dict[row['categorie']],
-                            row['type'],
-                            row['projet'],
-                            row['payer'],
-                            payment_date
-                        ))
-                        st.session_state.db.conn.commit()
-                        success_count += 1
-                    except Exception as e:
-                        st.warning(f"Erreur pour la ligne {_ + 2}: {str(e)}")
-                        continue
-
-                st.session_state.import_confirmed = True
-                return True, f"{success_count} transactions importées avec succès sur {len(df)} au total."
-        else:
-            # Réinitialiser l'état après l'affichage du message de succès
-            st.session_state.import_confirmed = False
-
-        return False, "En attente de confirmation..."
-
-    except Exception as e:
-        return False, f"Erreur lors du traitement du fichier: {str(e)}"
+# Fonction pour traiter les fichiers importés
+def process_import_files(uploaded_files):
+    # Lecture, validation et import tournent en tâches de fond et survivent aux relances de la
+    # page: les fichiers sont lus en parallèle dans la table de transit, puis leurs lignes sont
+    # validées ensemble et importées en une seule transaction
+    files_key = tuple((uploaded_file.name, uploaded_file.size) for uploaded_file in uploaded_files)
+    if st.session_state.get('import_files_key') != files_key:
+        if st.session_state.get('import_staged') and st.session_state.get('import_job') is None:
+            # Fichiers lus mais pas importés: leurs lignes en transit sont abandonnées
+            st.session_state.db.discard_import(st.session_state.import_staged)
+        st.session_state.import_scan_jobs = [
+            jobs.submit(st.session_state.db, 'import_scan', {'file_name': uploaded_file.name},
+                        payload=uploaded_file.getvalue(), username=st.session_state.get('username'))
+            for uploaded_file in uploaded_files
+        ]
+        st.session_state.import_staged = None
+        st.session_state.import_check_job = None
+        st.session_state.import_job = None
+        st.session_state.import_files_key = files_key
+    scans = follow_jobs(st.session_state.import_scan_jobs, "Lecture des fichiers")
+    if not all(scan['status'] in jobs.FINISHED for scan in scans):
+        return
+    failed = [(uploaded_file.name, scan['error']) for uploaded_file, scan in zip(uploaded_files, scans)
+              if scan['status'] == 'failed']
+    if failed:
+        st.session_state.import_staged = [scan['info']['import_id'] for scan in scans if scan['status'] == 'done']
+        if any(scan.get('missing') for scan in scans):
+            # Tâche disparue: les fichiers seront relus à la prochaine relance de la page
+            st.session_state.import_files_key = None
+        st.error("Structure attendue du fichier:")
+        st.code("""
+        | date       | montant | libelle        | type    | projet   | categorie | payer  | date_paiement |
+        |------------|---------|----------------|---------|----------|-----------|--------|---------------|
+        | 31/01/2025| 100.00  | Description... | charge  | TAWSSIL  | Loyer     | oui    | 31/01/2025   |
+        """)
+        for name, error in failed:
+            st.error(f"{name}: {error}")
+        return
+
+    # Les fichiers forment un seul import: leurs lignes sont validées ensemble
+    summaries = [scan['info'] for scan in scans]
+    import_ids = [summary['import_id'] for summary in summaries]
+    file_names = {summary['import_id']: uploaded_file.name for uploaded_file, summary in zip(uploaded_files, summaries)}
+    rows = sum(summary['rows'] for summary in summaries)
+    st.session_state.import_staged = import_ids
+    if st.session_state.import_check_job is None:
+        st.session_state.import_check_job = jobs.submit(
+            st.session_state.db, 'import_check', {'import_ids': import_ids}, username=st.session_state.get('username')
+        )
+    check = follow_job(st.session_state.import_check_job, "Validation des lignes")
+    if check['status'] not in jobs.FINISHED:
+        return
+    if check['status'] == 'failed':
+        st.error(f"Erreur lors de la validation des fichiers: {check['error']}")
+        st.session_state.import_check_job = None
+        return
+    counts = jobs.frame_from_json(check['info']['files'])
+    by_file = pd.DataFrame({
+        'Fichier': counts['import_id'].map(file_names), 'Lignes': counts['rows'], 'Invalides': counts['invalid'],
+        'Déjà importées': counts['duplicates'], 'Charges': counts['charges'], 'Recettes': counts['recettes']
+    })
+    invalid, duplicates = (int(by_file[column].sum()) for column in ['Invalides', 'Déjà importées'])
+    errors = jobs.frame_from_json(check['info']['errors'])
+    errors = errors.assign(fichier=errors['import_id'].map(file_names))[['fichier', 'ligne', 'erreur']]
+
+    st.subheader("Aperçu des données à importer")
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Lignes", rows)
+    col2.metric("Lignes invalides", invalid)
+    col3.metric("Déjà importées", duplicates)
+    col4.metric("Total charges", f"{by_file['Charges'].sum():,.2f} DH")
+    col5.metric("Total recettes", f"{by_file['Recettes'].sum():,.2f} DH")
+    if len(uploaded_files) > 1:
+        st.dataframe(by_file, use_container_width=True, hide_index=True)
+    for tab, summary in zip(st.tabs([uploaded_file.name for uploaded_file in uploaded_files]), summaries):
+        with tab:
+            preview = jobs.frame_from_json(summary['preview'])
+            st.write("Colonnes trouvées dans le fichier:", list(preview.columns))
+            st.dataframe(preview, use_container_width=True)
+            if summary['rows'] > len(preview):
+                st.caption(f"{len(preview)} premières lignes sur {summary['rows']}")
+    if invalid:
+        st.warning(f"{invalid} lignes invalides ne seront pas importées")
+        st.dataframe(errors, use_container_width=True, hide_index=True)
+
+    if duplicates:
+        st.info(f"{duplicates} lignes ont déjà été importées et seront ignorées")
+
+    if st.session_state.import_job is None:
+        if rows > invalid + duplicates and st.button("Confirmer l'import des données"):
+            # Un seul lot pour tous les fichiers: il s'annule d'un bloc
+            username = st.session_state.get('username')
+            st.session_state.import_job = jobs.submit(
+                st.session_state.db, 'import',
+                {'import_ids': import_ids, 'total_rows': rows, 'username': username,
+                 'file_name': ', '.join(uploaded_file.name for uploaded_file in uploaded_files),
+                 'checksum': files_checksum(uploaded_files)},
+                username=username
+            )
+            st.rerun()
+        return
+
+    job = follow_job(st.session_state.import_job, "Import en cours")
+    if job['status'] not in jobs.FINISHED:
+        return
+    if job['status'] == 'failed':
+        st.error(f"Erreur lors de l'import, aucune transaction n'a été importée: {job['error']}")
+        st.session_state.import_job = None
+        return
+    info = job['info']
+    import_errors = jobs.frame_from_json(info['errors'])
+    if not import_errors.empty:
+        import_errors = import_errors.assign(fichier=import_errors['import_id'].map(file_names))
+        st.dataframe(import_errors[['fichier', 'ligne', 'erreur']], use_container_width=True, hide_index=True)
+    st.success(f"{info['inserted']} transactions importées avec succès sur {rows} au total "
+               f"(import n° {info['batch_id']}).")
+    if info['skipped']:
+        st.info(f"{info['skipped']} doublons déjà importés ont été ignorés")
 
 # Section d'import Excel
 st.subheader("📤 Importer depuis Excel")
 with st.expander("Cliquez pour importer un fichier Excel"):
     st.markdown("""
     ### Instructions
-    1. Préparez un fichier Excel avec les colonnes suivantes:
+    1. Préparez un fichier Excel (ou CSV, séparé par , ou ;, ou Parquet) avec les colonnes suivantes:
         - date (format: DD/MM/YYYY)
         - montant (nombres)
         - libelle (texte)
@@ -160,7 +160,8 @@ with st.expander("Cliquez pour importer un fichier Excel"):
         - categorie (doit correspondre aux catégories existantes)
         - payer ('oui' ou 'non')
         - date_paiement (format: DD/MM/YYYY, optionnel - utilisé si payer = 'oui')
-    2. Sélectionnez votre fichier ci-dessous
+    2. Sélectionnez vos fichiers ci-dessous (par exemple un classeur par projet): ils sont lus
+       en parallèle, validés ensemble puis importés d'un bloc, en un seul import annulable
     """)
 
     # Exemple de fichier
@@ -177,18 +178,46 @@ with st.expander("Cliquez pour importer un fichier Excel"):
     })
     st.dataframe(example_df)
 
-    uploaded_file = st.file_uploader("Choisir un fichier Excel", type=['xlsx'])
-    if uploaded_file is not None:
+    uploaded_files = st.file_uploader("Choisir un ou plusieurs fichiers Excel, CSV ou Parquet",
+                                      type=['xlsx', 'csv', 'parquet'],
+                                      accept_multiple_files=True)
+    if uploaded_files:
         try:
-            df = pd.read_excel(uploaded_file)
-            success, message = process_excel_file(df, categories_df)
-            if success:
-                st.success(message)
-                st.rerun()
-            elif message != "En attente de confirmation...":
-                st.error(message)
+            process_import_files(uploaded_files)
         except Exception as e:
-            st.error(f"Erreur lors de la lecture du fichier: {str(e)}")
+            st.error(f"Erreur lors de la lecture des fichiers: {str(e)}")
+
+    # Historique des imports, annulables d'un bloc par un administrateur
+    import_batches = st.session_state.db.get_import_batches()
+    if not import_batches.empty:
+        st.markdown("### Derniers imports")
+        for _, batch in import_batches.iterrows():
+            col1, col2, col3 = st.columns([4, 2, 1])
+            with col1:
+                st.write(f"**{batch['file_name']}** ({batch['username'] or 'inconnu'}, "
+                         f"{pd.to_datetime(batch['created_at']).strftime('%d/%m/%Y %H:%M')})")
+            with col2:
+                if pd.notna(batch['undone_at']):
+                    st.write(f"❌ Annulé ({batch['row_count']} transactions)")
+                else:
+                    st.write(f"✅ {batch['row_count']} transactions")
+            with col3:
+                if st.session_state.get('user_role') == 'admin':
+                    if pd.isna(batch['undone_at']):
+                        if st.button("↩️", key=f"undo_import_{batch['id']}", help="Annuler cet import"):
+                            try:
+                                count = st.session_state.db.undo_import_batch(int(batch['id']))
+                                st.success(f"Import annulé: {count} transactions retirées")
+                                st.rerun()
+                            except Exception as e:
+                                st.error(str(e))
+                    elif st.button("🔄", key=f"restore_import_{batch['id']}", help="Rétablir cet import"):
+                        try:
+                            count = st.session_state.db.restore_import_batch(int(batch['id']))
+                            st.success(f"Import rétabli: {count} transactions")
+                            st.rerun()
+                        except Exception as e:
+                            st.error(str(e))
 
 # Initialize session state variables if they don't exist
 if 'form_montant' not in st.session_state:
@@ -221,12 +250,12 @@ with st.form("transaction_form", clear_on_submit=True):
         type_ = st.selectbox("Type", ["charge", "recette"])
         category = st.selectbox(
             "Catégorie",
-            options=categories_df['id'].tolist(),
-            format_func=lambda x: categories_df[categories_df['id'] == x]['name'].iloc[0]
+            options=refs.category_options,
+            format_func=refs.category_names.get
         )
 
     with col3:
-        projet = st.selectbox("Projet", options=PROJETS)
+        projet = st.selectbox("Projet", options=refs.project_options, format_func=refs.project_names.get)
         libelle = st.text_input("Libellé", 
                               key="input_libelle",
                               value=st.session_state.form_libelle)
@@ -246,21 +275,20 @@ with st.form("transaction_form", clear_on_submit=True):
 
                 # Update database query to include payment date
                 query = """
-                INSERT INTO transactions (date, montant, libelle, category_id, type, project, payer, payment_date)
+                INSERT INTO transactions (date, montant, libelle, category_id, type, project_id, payer, payment_date)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 """
-                cur = st.session_state.db.conn.cursor()
-                cur.execute(query, (
-                    date,
-                    montant,
-                    libelle,
-                    int(category),
-                    type_,
-                    projet,
-                    payer == "oui",
-                    payment_date
-                ))
-                st.session_state.db.conn.commit()
+                with st.session_state.db.connection() as conn, conn.cursor() as cur:
+                    cur.execute(query, (
+                        date,
+                        montant,
+                        libelle,
+                        int(category),
+                        type_,
+                        projet,
+                        payer == "oui",
+                        payment_date
+                    ))
 
                 # Reset form values
                 reset_form()
@@ -273,33 +301,40 @@ with st.form("transaction_form", clear_on_submit=True):
 
 # Display recent transactions
 st.subheader("Transactions Récentes")
-df = st.session_state.db.get_transactions()
-
-if not df.empty:
-    # Add search bar
-    search_term = st.text_input("🔍 Rechercher une transaction", help="Rechercher par libellé, type, ou projet")
-
-    # Filter dataframe based on search term
-    if search_term:
-        mask = (
-            df['libelle'].str.contains(search_term, case=False, na=False) |
-            df['type'].str.contains(search_term, case=False, na=False) |
-            df['project'].str.contains(search_term, case=False, na=False)
-        )
-        df = df[mask]
-
-    # Initialize pagination state if not exists
-    if 'current_page' not in st.session_state:
-        st.session_state.current_page = 0
-
-    # Calculate total pages
-    transactions_per_page = 6
-    total_pages = (len(df) + transactions_per_page - 1) // transactions_per_page
-
-    # Get current page transactions
-    start_idx = st.session_state.current_page * transactions_per_page
-    end_idx = start_idx + transactions_per_page
-    page_transactions = df.iloc[start_idx:end_idx]
+search_term = st.text_input("🔍 Rechercher une transaction", help="Rechercher par libellé ou projet")
+query = TransactionQuery(search=search_term or None)
+
+# Curseurs des pages déjà visitées; on repart de la première page quand la recherche change
+if st.session_state.get('saisie_search') != search_term:
+    st.session_state.saisie_search = search_term
+    st.session_state.current_page = 0
+    st.session_state.page_cursors = [None]
+
+transactions_per_page = 6
+page_cursor = st.session_state.page_cursors[st.session_state.current_page]
+if search_term:
+    # Résultats classés par pertinence
+    page_transactions, next_cursor = st.session_state.db.search_transactions(
+        search_term,
+        limit=transactions_per_page,
+        cursor=page_cursor
+    )
+else:
+    page_transactions, next_cursor = st.session_state.db.get_transaction_page(
+        query,
+        limit=transactions_per_page,
+        after=page_cursor
+    )
+
+if page_transactions.empty and st.session_state.current_page > 0:
+    # La page a été vidée par des suppressions: retour au début de la liste
+    st.session_state.current_page = 0
+    st.session_state.page_cursors = [None]
+    st.rerun()
+
+if not page_transactions.empty:
+    total_count = st.session_state.db.get_transaction_totals(query)['count']
+    total_pages = (total_count + transactions_per_page - 1) // transactions_per_page
 
     # Display pagination info
     col1, col2, col3 = st.columns([2, 3, 2])
@@ -311,7 +346,7 @@ if not df.empty:
         col1, col2, col3, col4, col5 = st.columns([3, 1, 1, 1, 2])
         with col1:
             st.write(f"**{row['libelle']}** ({row['category_name']})")
-            st.write(f"{row['montant']} DH - {row['type']}")
+            st.write(f"{amount_from_cents(row['montant_cents']):.2f} DH - {row['type']}")
         with col2:
             # Afficher la date et l'heure de création
             created_at = pd.to_datetime(row['created_at'])
@@ -325,7 +360,7 @@ if not df.empty:
             with col5_1:
                 if st.button("✏️", key=f"edit_{row['id']}", help="Modifier le statut de paiement"):
                     # Store the transaction ID in session state
-                    st.session_state.editing_transaction = row['id']
+                    st.session_state.editing_transaction = int(row['id'])
                     st.session_state.show_edit_modal = True
 
             with col5_2:
@@ -364,15 +399,13 @@ if not df.empty:
                 if st.form_submit_button("Enregistrer"):
                     try:
                         # Update transaction payment status and date
-                        db = Database()
                         query = """
                         UPDATE transactions 
                         SET payer = %s, payment_date = %s 
                         WHERE id = %s
                         """
-                        cur = db.conn.cursor()
-                        cur.execute(query, (nouveau_statut == "oui", date_paiement, st.session_state.editing_transaction))
-                        db.conn.commit()
+                        with st.session_state.db.connection() as conn, conn.cursor() as cur:
+                            cur.execute(query, (nouveau_statut == "oui", date_paiement, st.session_state.editing_transaction))
 
                         st.success("Statut de paiement mis à jour avec succès!")
                         st.session_state.show_edit_modal = False
@@ -390,9 +423,13 @@ if not df.empty:
                 st.rerun()
 
     with col3:
-        if st.session_state.current_page < total_pages - 1:
+        if next_cursor is not None:
             if st.button("Suivant →"):
                 st.session_state.current_page += 1
+                del st.session_state.page_cursors[st.session_state.current_page:]
+                st.session_state.page_cursors.append(next_cursor)
                 st.rerun()
+elif search_term:
+    st.info("Aucune transaction ne correspond à la recherche")
 else:
     st.info("Aucune transaction enregistrée")
\ No newline at end of file
@@ -1,7 +1,8 @@
 import streamlit as st
-import pandas as pd
-from database import Database
-from utils import set_page_config
+from database import Database, TransactionQuery
+from exports import prepare_display
+import jobs
+from utils import set_page_config, follow_job
 from datetime import datetime, timedelta
 from auth.auth_decorator import require_auth
 
@@ -15,12 +16,8 @@ def main():
     if 'db' not in st.session_state:
         st.session_state.db = Database()
 
-    # Get categories for filter
-    categories_df = st.session_state.db.get_categories()
-
-    # Get projects from database
-    projects_df = st.session_state.db.get_projects()
-    PROJETS = ["Tous"] + projects_df['name'].tolist() if not projects_df.empty else ["Tous"]
+    # Catégories et projets pour les filtres
+    refs = st.session_state.db.get_reference_data()
 
     # Section des filtres
     st.subheader("🔍 Filtres")
@@ -34,14 +31,15 @@ def main():
         with filter_col1:
             selected_category = st.selectbox(
                 "Catégorie",
-                ["Toutes"] + categories_df['id'].tolist(),
-                format_func=lambda x: "Toutes" if x == "Toutes" else categories_df[categories_df['id'] == x]['name'].iloc[0]
+                ["Toutes"] + refs.category_options,
+                format_func=lambda x: "Toutes" if x == "Toutes" else refs.category_names[x]
             )
 
         with filter_col2:
             selected_project = st.selectbox(
                 "Projet",
-                PROJETS
+                ["Tous"] + refs.project_options,
+                format_func=lambda x: "Tous" if x == "Tous" else refs.project_names[x]
             )
 
         with filter_col3:
@@ -98,72 +96,35 @@ def main():
     # Séparateur avant les résultats
     st.markdown("---")
 
-    # Get and display data
-    if selected_category == "Toutes":
-        df = st.session_state.db.get_transactions()
-    else:
-        df = st.session_state.db.get_filtered_transactions(selected_category)
-
-    if not df.empty:
-        # Convert date columns to datetime for filtering
-        df['date'] = pd.to_datetime(df['date'])
-        if 'payment_date' in df.columns:
-            df['payment_date'] = pd.to_datetime(df['payment_date'])
-
-        # Apply date filter for transaction date
-        mask = (df['date'].dt.date >= date_debut) & (df['date'].dt.date <= date_fin)
-
-        # Apply payment status filter
-        if payment_status != "Tous":
-            mask &= df['payer'] == (payment_status == "Payé")
-
-        # Apply payment date filter if dates are selected
-        if payment_date_debut and payment_date_fin:
-            mask &= (
-                (df['payment_date'].notna()) & 
-                (df['payment_date'].dt.date >= payment_date_debut) & 
-                (df['payment_date'].dt.date <= payment_date_fin)
-            )
+    # Filtres appliqués par la base de données
+    query = TransactionQuery(
+        category_id=None if selected_category == "Toutes" else selected_category,
+        project_id=None if selected_project == "Tous" else selected_project,
+        date_from=date_debut,
+        date_to=date_fin,
+        payment_date_from=payment_date_debut if payment_date_debut and payment_date_fin else None,
+        payment_date_to=payment_date_fin if payment_date_debut and payment_date_fin else None,
+        payer=None if payment_status == "Tous" else payment_status == "Payé",
+        inclus_calcul=None if inclusion_status == "Tous" else inclusion_status == "Inclus",
+        order='date'
+    )
+
+    # On repart de la première page quand un filtre change
+    filters_key = repr(vars(query))
+    if st.session_state.get('rapport_filters') != filters_key:
+        st.session_state.rapport_filters = filters_key
+        st.session_state.rapport_page = 0
+        st.session_state.rapport_cursors = [None]
+        st.session_state.rapport_export = None
+        st.session_state.rapport_export_data = None
 
-        # Apply inclusion status filter
-        if inclusion_status != "Tous":
-            mask &= df['inclus_calcul'] == (inclusion_status == "Inclus")
-
-        df = df[mask]
-
-        # Apply project filter if not "Tous"
-        if selected_project != "Tous":
-            df = df[df['project'] == selected_project]
-
-        # Prepare data for display
-        df['date'] = df['date'].dt.strftime('%d/%m/%Y')
-        if 'payment_date' in df.columns:
-            df['payment_date'] = df['payment_date'].dt.strftime('%d/%m/%Y')
-
-        # Suppression explicite des colonnes is_paid et paid si elles existent
-        columns_to_drop = ['id', 'created_at', 'category_id', 'is_paid', 'paid']
-        display_df = df.drop(columns=[col for col in columns_to_drop if col in df.columns], errors='ignore')
-
-        display_df = display_df.rename(columns={
-            'date': 'Date',
-            'payment_date': 'Date de paiement',
-            'montant': 'Montant',
-            'libelle': 'Libellé',
-            'category_name': 'Catégorie',
-            'type': 'Type',
-            'project': 'Projet',
-            'payer': 'Payé',
-            'inclus_calcul': 'Inclus dans les calculs'
-        })
-
-        # Convert boolean payer to Oui/Non
-        display_df['Payé'] = display_df['Payé'].map({True: 'Oui', False: 'Non'})
-        display_df['Inclus dans les calculs'] = display_df['Inclus dans les calculs'].map({True: 'Oui', False: 'Non'})
+    totals = st.session_state.db.get_transaction_totals(query)
 
+    if totals['count'] > 0:
         # Summary statistics
         st.subheader("📈 Résumé")
-        total_charges = df[df['type'] == 'charge']['montant'].sum()
-        total_recettes = df[df['type'] == 'recette']['montant'].sum()
+        total_charges = totals['charges']
+        total_recettes = totals['recettes']
         balance = total_recettes - total_charges
 
         col1, col2, col3 = st.columns(3)
@@ -179,36 +140,48 @@ def main():
         # Résultats détaillés
         st.subheader("📋 Résultats détaillés")
 
-        # Initialize pagination state if not exists
-        if 'rapport_page' not in st.session_state:
-            st.session_state.rapport_page = 0
-
-        # Calculate total pages (15 transactions per page)
+        # 15 transactions par page
         transactions_per_page = 15
-        total_pages = (len(display_df) + transactions_per_page - 1) // transactions_per_page
-
-        # Get current page transactions
-        start_idx = st.session_state.rapport_page * transactions_per_page
-        end_idx = start_idx + transactions_per_page
-        page_df = display_df.iloc[start_idx:end_idx]
+        total_pages = (totals['count'] + transactions_per_page - 1) // transactions_per_page
+        page_df, next_cursor = st.session_state.db.get_transaction_page(
+            query,
+            limit=transactions_per_page,
+            after=st.session_state.rapport_cursors[st.session_state.rapport_page]
+        )
 
-        # Export options
+        # Export options: le fichier complet est préparé à la demande par une tâche de fond
         export_col1, export_col2 = st.columns([1, 8])
         with export_col1:
-            # Export button
-            st.download_button(
-                "📥 Exporter",
-                get_csv(display_df),
-                "transactions.csv",
-                "text/csv",
-                key='download-csv'
-            )
+            if st.session_state.rapport_export is None:
+                if st.button("📥 Préparer l'export"):
+                    st.session_state.rapport_export = jobs.submit(
+                        st.session_state.db, 'export_transactions', vars(query),
+                        username=st.session_state.get('username')
+                    )
+                    st.session_state.rapport_export_data = None
+                    st.rerun()
+            else:
+                job = follow_job(st.session_state.rapport_export, "Export")
+                if job['status'] == 'failed':
+                    st.error(f"Erreur lors de l'export: {job['error']}")
+                    st.session_state.rapport_export = None
+                elif job['status'] == 'done':
+                    if st.session_state.get('rapport_export_data') is None:
+                        st.session_state.rapport_export_data = jobs.result(
+                            st.session_state.db, st.session_state.rapport_export)[1]
+                    st.download_button(
+                        "📥 Exporter",
+                        st.session_state.rapport_export_data,
+                        "transactions.csv",
+                        "text/csv",
+                        key='download-csv'
+                    )
 
         # Display pagination info
         st.write(f"Page {st.session_state.rapport_page + 1} sur {total_pages}")
 
         # Display data
-        st.dataframe(page_df, use_container_width=True)
+        st.dataframe(prepare_display(page_df), use_container_width=True)
 
         # Navigation buttons
         col1, col2, col3 = st.columns([2, 3, 2])
@@ -219,25 +192,15 @@ def main():
                     st.rerun()
 
         with col3:
-            if st.session_state.rapport_page < total_pages - 1:
+            if next_cursor is not None:
                 if st.button("Page suivante →"):
                     st.session_state.rapport_page += 1
+                    del st.session_state.rapport_cursors[st.session_state.rapport_page:]
+                    st.session_state.rapport_cursors.append(next_cursor)
                     st.rerun()
 
     else:
         st.info("Aucune transaction trouvée pour les critères sélectionnés")
 
-def get_csv(display_df):
-    # Ensure proper ordering of columns
-    columns_order = ['Date', 'Libellé', 'Montant', 'Type', 'Catégorie', 'Projet', 'Payé', 'Date de paiement', 'Inclus dans les calculs']
-    export_df = display_df[columns_order]
-    return export_df.to_csv(
-        index=False,
-        sep=';',
-        encoding='utf-8-sig',
-        decimal=',',
-        float_format='%.2f'
-    )
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
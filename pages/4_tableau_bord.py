@@ -2,7 +2,7 @@ import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
 from database import Database
-from utils import set_page_config, create_time_series
+from utils import set_page_config, create_time_series, refresh_on_change
 import pandas as pd
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter, landscape
@@ -20,6 +20,9 @@ def main():
     if 'db' not in st.session_state:
         st.session_state.db = Database()
 
+    # Rafraîchissement automatique quand une autre session modifie les données
+    refresh_on_change('dashboard_version', ['transactions', 'projects', 'categories'])
+
     # Period selector
     period = st.selectbox(
         "Période d'analyse",
@@ -38,19 +41,18 @@ def main():
         help="Si décoché, seuls les projets marqués comme 'inclus dans les calculs' seront pris en compte"
     )
 
-    # Modifier la récupération des données pour prendre en compte le filtre
-    df_summary = st.session_state.db.get_summary_by_period(period, not inclure_tous_projets)
-    df_project_summary = st.session_state.db.get_project_summary(period, not inclure_tous_projets)
-    df_category_summary = st.session_state.db.get_category_summary(period, not inclure_tous_projets)
+    # Indicateurs, séries et répartitions calculés en une seule requête
+    cube = st.session_state.db.get_dashboard_cube(period, not inclure_tous_projets)
+    totals = cube.totals
 
-    if not df_summary.empty:
+    if not cube.empty:
         # Global summary metrics
         st.subheader("📊 Résumé Global")
 
-        # Calculer les totaux généraux
-        total_charges = df_summary[df_summary['type'] == 'charge']['charges'].sum() if not df_summary.empty else 0
-        total_recettes = df_summary[df_summary['type'] == 'recette']['recettes'].sum() if not df_summary.empty else 0
-        balance = total_recettes - total_charges
+        # Totaux généraux
+        total_charges = totals['total_charges']
+        total_recettes = totals['total_recettes']
+        balance = totals['balance']
 
         # Afficher les totaux généraux
         col1, col2, col3 = st.columns(3)
@@ -76,10 +78,9 @@ def main():
         st.markdown("##### 💸 Détail des Charges")
         charges_col1, charges_col2, charges_col3 = st.columns(3)
 
-        # Calculer les charges payées et non payées
-        charges_payees = df_summary[(df_summary['type'] == 'charge') & (df_summary['payer'])]['charges'].sum() if not df_summary.empty else 0
-        charges_non_payees = df_summary[(df_summary['type'] == 'charge') & (~df_summary['payer'])]['charges'].sum() if not df_summary.empty else 0
-        total_charges = charges_payees + charges_non_payees
+        # Charges payées et non payées
+        charges_payees = totals['charges_payees']
+        charges_non_payees = totals['charges_non_payees']
 
         charges_col1.metric(
             "Charges Payées",
@@ -102,10 +103,9 @@ def main():
         st.markdown("##### 💰 Détail des Recettes")
         recettes_col1, recettes_col2, recettes_col3 = st.columns(3)
 
-        # Calculer les recettes payées et non payées
-        recettes_payees = df_summary[(df_summary['type'] == 'recette') & (df_summary['payer'])]['recettes'].sum() if not df_summary.empty else 0
-        recettes_non_payees = df_summary[(df_summary['type'] == 'recette') & (~df_summary['payer'])]['recettes'].sum() if not df_summary.empty else 0
-        total_recettes = recettes_payees + recettes_non_payees
+        # Recettes payées et non payées
+        recettes_payees = totals['recettes_payees']
+        recettes_non_payees = totals['recettes_non_payees']
 
         recettes_col1.metric(
             "Recettes Encaissées",
@@ -127,7 +127,7 @@ def main():
         # Global evolution chart
         st.plotly_chart(
             create_time_series(
-                df_summary,
+                cube.series,
                 f"Évolution Globale - Vue {period}"
             ),
             use_container_width=True
@@ -135,9 +135,9 @@ def main():
 
         # Project summary
         st.subheader("📌 Analyse par Projet")
-        if not df_project_summary.empty:
+        if not cube.project_periods.empty:
             # Créer et afficher le tableau des totaux par projet et période
-            project_period_table = df_project_summary.pivot_table(
+            project_period_table = cube.project_periods.pivot_table(
                 values=['charges', 'recettes', 'balance'],
                 index=['period'],
                 columns=['project'],
@@ -256,16 +256,9 @@ def main():
                 )
 
 
-                            # ترتيب المشاريع حسب الترتيب الأصلي من قاعدة البيانات
-                ordered_projects = df_project_summary['project'].unique()
-                
-                # Group data properly
-                df_grouped = df_project_summary.groupby('project', as_index=False).sum()
-                
-                # تأكد أن المشاريع مرتبة بنفس ترتيب قاعدة البيانات
-                df_grouped['project'] = pd.Categorical(df_grouped['project'], categories=ordered_projects, ordered=True)
-                df_grouped = df_grouped.sort_values('project')
-                
+                # Totaux par projet, déjà agrégés par la base
+                df_grouped = cube.projects
+
                 # Create a bar chart for projects
                 fig_projects = go.Figure()
                 
@@ -301,11 +294,7 @@ def main():
 
 
             # Detailed project metrics
-            for idx, row in df_project_summary.groupby('project').agg({
-                'charges': 'sum',
-                'recettes': 'sum',
-                'balance': 'sum'
-            }).reset_index().iterrows():
+            for idx, row in cube.projects.iterrows():
                 col1, col2, col3 = st.columns(3)
                 col1.metric(
                     f"{row['project']} - Charges",
@@ -324,9 +313,9 @@ def main():
 
         # Category summary
         st.subheader("🏷️ Analyse par Catégorie")
-        if not df_category_summary.empty:
+        if not cube.category_periods.empty:
             # Créer et afficher le tableau des totaux par catégorie et période
-            category_period_table = df_category_summary.pivot_table(
+            category_period_table = cube.category_periods.pivot_table(
                 values=['charges', 'recettes', 'balance'],
                 index=['period'],
                 columns=['category_name'],
@@ -402,8 +391,8 @@ def main():
             # Add bars for charges
             fig_categories.add_trace(go.Bar(
                 name='Charges',
-                x=df_category_summary['category_name'].unique(),
-                y=df_category_summary.groupby('category_name')['charges'].sum(),
+                x=cube.categories['category_name'],
+                y=cube.categories['charges'],
                 marker_color='red',
                 opacity=0.7
             ))
@@ -411,8 +400,8 @@ def main():
             # Add bars for recettes
             fig_categories.add_trace(go.Bar(
                 name='Recettes',
-                x=df_category_summary['category_name'].unique(),
-                y=df_category_summary.groupby('category_name')['recettes'].sum(),
+                x=cube.categories['category_name'],
+                y=cube.categories['recettes'],
                 marker_color='green',
                 opacity=0.7
             ))
@@ -428,11 +417,7 @@ def main():
             st.plotly_chart(fig_categories, use_container_width=True)
 
             # Detailed category metrics
-            for idx, row in df_category_summary.groupby('category_name').agg({
-                'charges': 'sum',
-                'recettes': 'sum',
-                'balance': 'sum'
-            }).reset_index().iterrows():
+            for idx, row in cube.categories.iterrows():
                 col1, col2, col3 = st.columns(3)
                 col1.metric(
                     f"{row['category_name']} - Charges",
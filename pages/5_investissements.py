@@ -9,7 +9,7 @@ import io
 set_page_config()
 
 def load_immobilisations():
-    db = Database()
+    db = st.session_state.db
     query = """
     SELECT i.*, 
            COALESCE(SUM(ti.montant), 0) as montant_investi,
@@ -20,10 +20,11 @@ def load_immobilisations():
     GROUP BY i.id, i.nom, i.description, i.prix_total, i.date_acquisition, i.created_at
     ORDER BY i.created_at DESC
     """
-    return pd.read_sql_query(query, db.conn)
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn)
 
 def load_transactions_investissement():
-    db = Database()
+    db = st.session_state.db
     query = """
     SELECT ti.*, i.nom as immobilisation_nom, p.name as associe_nom
     FROM transactions_investissement ti
@@ -31,10 +32,11 @@ def load_transactions_investissement():
     JOIN partners p ON ti.associe_id = p.id
     ORDER BY ti.created_at DESC
     """
-    return pd.read_sql_query(query, db.conn)
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn)
 
 def calculate_investissements_par_associe():
-    db = Database()
+    db = st.session_state.db
     query = """
     SELECT 
         p.id,
@@ -45,49 +47,46 @@ def calculate_investissements_par_associe():
     GROUP BY p.id, p.name
     ORDER BY p.name
     """
-    return pd.read_sql_query(query, db.conn)
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn)
 
 def save_immobilisation(nom, description, prix_total, date_acquisition):
-    db = Database()
+    db = st.session_state.db
     query = """
     INSERT INTO immobilisations (nom, description, prix_total, date_acquisition)
     VALUES (%s, %s, %s, %s)
     RETURNING id
     """
-    cur = db.conn.cursor()
-    cur.execute(query, (nom, description, prix_total, date_acquisition))
-    immobilisation_id = cur.fetchone()[0]
-    db.conn.commit()
-    return immobilisation_id
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(query, (nom, description, prix_total, date_acquisition))
+        return cur.fetchone()[0]
 
 def save_transaction_investissement(associe_id, immobilisation_id, montant, description):
-    db = Database()
+    db = st.session_state.db
     query = """
     INSERT INTO transactions_investissement (associe_id, immobilisation_id, montant, description)
     VALUES (%s, %s, %s, %s)
     """
-    cur = db.conn.cursor()
-    cur.execute(query, (associe_id, immobilisation_id, montant, description))
-    db.conn.commit()
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(query, (associe_id, immobilisation_id, montant, description))
 
 def delete_transaction(transaction_id):
-    db = Database()
+    db = st.session_state.db
     query = "DELETE FROM transactions_investissement WHERE id = %s"
-    cur = db.conn.cursor()
-    cur.execute(query, (transaction_id,))
-    db.conn.commit()
-
-def load_partners():
-    db = Database()
-    query = "SELECT * FROM partners ORDER BY name"
-    return pd.read_sql_query(query, db.conn)
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(query, (transaction_id,))
 
 @require_auth
 def main():
     st.title("💼 Investissements des Associés")
 
+    # Initialize database connection
+    if 'db' not in st.session_state:
+        st.session_state.db = Database()
+
     # Charger les données
-    partners_df = load_partners()
+    refs = st.session_state.db.get_reference_data()
+    partners_df = refs.partners
     investissements_df = calculate_investissements_par_associe()
     immobilisations_df = load_immobilisations()
     transactions_df = load_transactions_investissement()
@@ -138,16 +137,16 @@ def main():
         with col1:
             associe1 = st.selectbox(
                 "Premier Investisseur",
-                options=partners_df['id'].tolist(),
-                format_func=lambda x: partners_df[partners_df['id'] == x]['name'].iloc[0]
+                options=refs.partner_options,
+                format_func=refs.partner_names.get
             )
             montant1 = st.number_input("Montant Investi (DH)", min_value=0.0, step=1000.0, key="montant1")
 
         with col2:
             associe2 = st.selectbox(
                 "Deuxième Investisseur",
-                options=partners_df['id'].tolist(),
-                format_func=lambda x: partners_df[partners_df['id'] == x]['name'].iloc[0]
+                options=refs.partner_options,
+                format_func=refs.partner_names.get
             )
             montant2 = st.number_input("Montant Investi (DH)", min_value=0.0, step=1000.0, key="montant2")
 
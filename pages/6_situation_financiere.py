@@ -2,8 +2,9 @@ import streamlit as st
 import pandas as pd
 import io # Added for Excel export
 from database import Database
+from repartition import repartition_snapshot, repartition_versements, ancienne_methode
 from datetime import datetime
-from utils import set_page_config
+from utils import set_page_config, refresh_on_change
 from auth.auth_decorator import require_auth
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
@@ -12,92 +13,56 @@ from reportlab.lib.pagesizes import landscape
 
 set_page_config()
 
-def load_partners():
-    db = Database()
-    query = "SELECT * FROM partners ORDER BY name"
-    return pd.read_sql_query(query, db.conn)
-
 def load_partner_payments():
-    db = Database()
+    db = st.session_state.db
     query = """
     SELECT pp.id, pp.payment_date, pp.partner_id, pp.amount, pp.description, p.name as partner_name 
     FROM partner_payments pp 
     JOIN partners p ON pp.partner_id = p.id 
     ORDER BY pp.payment_date DESC
     """
-    return pd.read_sql_query(query, db.conn)
-
-def calculate_global_balance():
-    db = Database()
-    query = """
-    SELECT 
-        COALESCE(SUM(CASE 
-            WHEN t.type = 'recette' AND t.payer = true THEN t.montant 
-            ELSE 0 
-        END), 0) as total_recettes_payees,
-        COALESCE(SUM(CASE 
-            WHEN t.type = 'recette' AND t.payer = false THEN t.montant 
-            ELSE 0 
-        END), 0) as total_recettes_impayees,
-        COALESCE(SUM(CASE 
-            WHEN t.type = 'charge' THEN t.montant 
-            ELSE 0 
-        END), 0) as total_depenses
-    FROM transactions t
-    LEFT JOIN projects p ON t.project = p.name
-    WHERE p.inclus_calcul = TRUE OR t.project IS NULL
-    """
-    df = pd.read_sql_query(query, db.conn)
-    return df
-
-def calculate_partner_investments():
-    db = Database()
-    query = """
-    SELECT 
-        p.id,
-        p.name,
-        p.share_percentage,
-        COALESCE(SUM(ti.montant), 0) as total_investi
-    FROM partners p
-    LEFT JOIN transactions_investissement ti ON p.id = ti.associe_id
-    GROUP BY p.id, p.name, p.share_percentage
-    ORDER BY p.name
-    """
-    return pd.read_sql_query(query, db.conn)
+    with db.connection() as conn:
+        return pd.read_sql_query(query, conn)
 
 def save_payment(partner_id, amount, description):
-    db = Database()
+    db = st.session_state.db
     query = """
     INSERT INTO partner_payments (partner_id, amount, description)
     VALUES (%s, %s, %s)
     """
-    cur = db.conn.cursor()
-    cur.execute(query, (partner_id, amount, description))
-    db.conn.commit()
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(query, (partner_id, amount, description))
 
 def delete_payment(payment_id):
-    db = Database()
+    db = st.session_state.db
     query = "DELETE FROM partner_payments WHERE id = %s"
-    cur = db.conn.cursor()
-    cur.execute(query, (payment_id,))
-    db.conn.commit()
+    with db.connection() as conn, conn.cursor() as cur:
+        cur.execute(query, (payment_id,))
 
 @require_auth
 def main():
     st.title("💰 Situation Financière des Associés")
 
+    # Initialize database connection
+    if 'db' not in st.session_state:
+        st.session_state.db = Database()
+
+    # Rafraîchissement automatique quand une autre session modifie les données
+    refresh_on_change('situation_version', [
+        'transactions', 'projects', 'partners', 'partner_payments', 'transactions_investissement'
+    ])
+
     # Charger les données
-    partners_df = load_partners()
+    refs = st.session_state.db.get_reference_data()
+    snapshot = st.session_state.db.get_financial_snapshot()
     payments_df = load_partner_payments()
-    balance_df = calculate_global_balance()
-    investments_df = calculate_partner_investments()
 
     # Afficher le bilan global
     st.header("📊 Bilan Global des Projets")
-    total_recettes_payees = balance_df['total_recettes_payees'].iloc[0]
-    total_recettes_impayees = balance_df['total_recettes_impayees'].iloc[0]
+    total_recettes_payees = snapshot['total_recettes_payees']
+    total_recettes_impayees = snapshot['total_recettes_impayees']
     total_recettes_global = total_recettes_payees + total_recettes_impayees
-    total_depenses = balance_df['total_depenses'].iloc[0]
+    total_depenses = snapshot['total_depenses']
     total_balance = total_recettes_payees - total_depenses
     balance_global = total_recettes_global - total_depenses
 
@@ -156,35 +121,20 @@ def main():
     # Tableau détaillé de répartition
     st.header("📈 Tableau de Répartition Détaillé")
 
-    # Créer un DataFrame pour le tableau de répartition
-    repartition_data = []
-
-    for _, partner in partners_df.iterrows():
-        # Calculer les parts des bénéfices
-        share_percentage = partner['share_percentage'] / 100
-        benefices_payes = (total_recettes_payees - total_depenses) * share_percentage
-        benefices_a_recevoir = total_recettes_impayees * share_percentage
-        total_benefices = benefices_payes + benefices_a_recevoir  # Nouveau calcul: somme des bénéfices
-
-        # Obtenir les investissements et paiements
-        partner_investments = investments_df[investments_df['id'] == partner['id']]['total_investi'].iloc[0]
-        partner_payments = payments_df[payments_df['partner_id'] == partner['id']]['amount'].sum() if not payments_df.empty else 0
-        remaining_payment = benefices_payes - partner_payments
-        remaining_treasury = benefices_payes + partner_investments - partner_payments  # Modification ici: utilisation de benefices_payes au lieu de total_benefices
-
-        repartition_data.append({
-            'Associé': partner['name'],
-            'Part des bénéfices (payés)': f"{benefices_payes:,.2f} DH",
-            'Part des bénéfices (à recevoir)': f"{benefices_a_recevoir:,.2f} DH",
-            'Total des bénéfices': f"{total_benefices:,.2f} DH",
-            'Total investissements': f"{partner_investments:,.2f} DH",
-            'Montant payé': f"{partner_payments:,.2f} DH",
-            'Reste à payer': f"{remaining_payment:,.2f} DH",
-            'Reste à payer (Trésorerie)': f"{remaining_treasury:,.2f} DH"
-        })
-
-    # Créer le DataFrame
-    repartition_df = pd.DataFrame(repartition_data)
+    # Répartition de tous les associés en une passe
+    split = repartition_snapshot(snapshot)
+    repartition_df = pd.DataFrame({
+        'Associé': split['name'],
+        'Part des bénéfices (payés)': split['benefices_payes'],
+        'Part des bénéfices (à recevoir)': split['benefices_a_recevoir'],
+        'Total des bénéfices': split['total_benefices'],
+        'Total investissements': split['total_investi'],
+        'Montant payé': split['montant_paye'],
+        'Reste à payer': split['reste_a_payer'],
+        'Reste à payer (Trésorerie)': split['reste_tresorerie']
+    })
+    amount_cols = repartition_df.columns.difference(['Associé'])
+    repartition_df[amount_cols] = repartition_df[amount_cols].map(lambda x: f"{x:,.2f} DH")
 
     # Boutons d'export
     col1, col2 = st.columns([1, 8])
@@ -217,21 +167,10 @@ def main():
 
     # Préparer les données pour le graphique
     total_benefices = total_recettes_payees - total_depenses
-    total_payments = payments_df['amount'].sum() if not payments_df.empty else 0
-    montant_restant = total_benefices - total_payments
-
-    # Créer la liste des données pour le graphique
-    partners_payments = []
-    for _, partner in partners_df.iterrows():
-        payment = payments_df[payments_df['partner_id'] == partner['id']]['amount'].sum() if not payments_df.empty else 0
-        partners_payments.append({
-            'name': partner['name'],
-            'payment': payment
-        })
-
-    # Données pour le graphique
-    labels = [p['name'] for p in partners_payments] + ['Reste à distribuer']
-    values = [p['payment'] for p in partners_payments] + [montant_restant]
+    total_payments = split['montant_paye'].sum()
+    versements = repartition_versements(split, snapshot)
+    labels = versements['name'].tolist()
+    values = versements['amount'].tolist()
 
     # Créer le graphique avec plotly
     import plotly.graph_objects as go
@@ -267,56 +206,27 @@ def main():
     # Nouvelle section: Ancienne méthode de calcul
     st.header("📊 Ancienne Méthode de Calcul")
 
-    # Préparer les données pour le tableau
-    abderrahim_investment = investments_df[investments_df['name'] == 'EL AZZAOUY ABDERRAHIM']['total_investi'].iloc[0] if not investments_df.empty else 0
-    mohamed_investment = investments_df[investments_df['name'].str.contains('MOHAMED LAHBIB', na=False)]['total_investi'].iloc[0] if not investments_df.empty else 0
-    total_investment = abderrahim_investment + mohamed_investment
-
-    # Balance des opérations (0 pour Abderrahim, total balance pour Mohamed Lahbib)
-    balance_operations = total_balance  # Using the total_balance calculated earlier
-
-    # Calculer les différences
-    abderrahim_diff = 0 - abderrahim_investment  # Car balance est 0 pour Abderrahim
-    mohamed_diff = balance_operations - mohamed_investment
-    total_diff = balance_operations - total_investment
-
-    # Montants payés
-    abderrahim_paid = payments_df[payments_df['partner_name'] == 'EL AZZAOUY ABDERRAHIM']['amount'].sum() if not payments_df.empty else 0
-    mohamed_paid = payments_df[payments_df['partner_name'].str.contains('MOHAMED LAHBIB', na=False)]['amount'].sum() if not payments_df.empty else 0
-    total_paid = abderrahim_paid + mohamed_paid
-
-    # Décaissements (inverse du montant payé de l'autre associé)
-    abderrahim_decaissement = -mohamed_paid  # L'inverse du montant payé par Mohamed
-    mohamed_decaissement = -abderrahim_paid  # L'inverse du montant payé par Abderrahim
-    total_decaissement = -(abderrahim_paid + mohamed_paid)  # Total des décaissements
-
-    # Encaissements
-    abderrahim_encaissement = abderrahim_diff + abderrahim_paid + abderrahim_decaissement
-    mohamed_encaissement = mohamed_diff + mohamed_paid + mohamed_decaissement
-    total_encaissement = total_diff + total_paid + total_decaissement
-
-    # Répartition trésorerie
-    repartition = (balance_operations - total_investment) / 2
-
-    # Reste
-    abderrahim_reste = repartition - abderrahim_encaissement
-    mohamed_reste = repartition - mohamed_encaissement
-    total_reste = (repartition * 2) - total_encaissement
-
-    # Créer le DataFrame pour le tableau
-    old_method_data = {
-        'Associé': ['EL AZZAOUY ABDERRAHIM', 'EL AZZOUY MOHAMED LAHBIB ET STE', 'TOTAL'],
-        'Investissement': [abderrahim_investment, mohamed_investment, total_investment],
-        'Balance des Opérations': [0, balance_operations, balance_operations],  # Mise à 0 pour Abderrahim
-        'Différence': [abderrahim_diff, mohamed_diff, total_diff],
-        'Montant Payé': [abderrahim_paid, mohamed_paid, total_paid],
-        'Décaissement': [abderrahim_decaissement, mohamed_decaissement, total_decaissement],  # Nouvelle colonne
-        'Encaissement': [abderrahim_encaissement, mohamed_encaissement, total_encaissement],
-        'Répartition Trésorerie': [repartition, repartition, repartition * 2],
-        'Reste': [abderrahim_reste, mohamed_reste, total_reste]
-    }
-
-    old_method_df = pd.DataFrame(old_method_data)
+    # L'associé exploitant porte la balance des opérations
+    operateur_default = next(
+        (i for i, name in enumerate(split['name']) if 'MOHAMED LAHBIB' in name), 0
+    )
+    col1, col2 = st.columns(2)
+    with col1:
+        operateur_id = st.selectbox(
+            "Associé exploitant",
+            options=split['id'].tolist(),
+            index=operateur_default,
+            format_func=refs.partner_names.get
+        )
+    with col2:
+        associes = st.multiselect(
+            "Associés",
+            options=split['id'].tolist(),
+            default=split['id'].tolist(),
+            format_func=refs.partner_names.get
+        )
+
+    old_method_df = ancienne_methode(split, snapshot, operateur_id, associes)
 
     # Formatage des colonnes numériques
     numeric_cols = old_method_df.columns.difference(['Associé'])
@@ -395,24 +305,20 @@ def main():
     # Section existante de répartition par associé
     st.header("💼 Répartition par Associé")
     col1, col2 = st.columns(2)
-    for idx, partner in partners_df.iterrows():
+    for idx, partner in split.iterrows():
         with col1 if idx % 2 == 0 else col2:
-            partner_share = total_balance * (partner['share_percentage'] / 100)
-            partner_payments = payments_df[payments_df['partner_id'] == partner['id']]['amount'].sum() if not payments_df.empty else 0
-            remaining = partner_share - partner_payments
-
             st.subheader(partner['name'])
-            st.write(f"Part des bénéfices (🔄): {partner_share:,.2f} DH")
-            st.write(f"Montant payé (✅): {partner_payments:,.2f} DH")
-            st.write(f"Reste à payer (💰): {remaining:,.2f} DH")
+            st.write(f"Part des bénéfices (🔄): {partner['benefices_payes']:,.2f} DH")
+            st.write(f"Montant payé (✅): {partner['montant_paye']:,.2f} DH")
+            st.write(f"Reste à payer (💰): {partner['reste_a_payer']:,.2f} DH")
 
     # Formulaire de saisie des paiements
     st.header("📝 Enregistrer un Nouveau Paiement")
     with st.form("payment_form"):
         partner_id = st.selectbox(
             "Associé",
-            options=partners_df['id'].tolist(),
-            format_func=lambda x: partners_df[partners_df['id'] == x]['name'].iloc[0]
+            options=refs.partner_options,
+            format_func=refs.partner_names.get
         )
         amount = st.number_input("Montant (DH)", min_value=0.0, step=1000.0)
         description = st.text_area("Description", placeholder="Détails du paiement...")
@@ -1,17 +1,10 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
-import io
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, PageTemplate, Frame
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
 from database import Database
-from utils import set_page_config
-from num2words import num2words
+from utils import set_page_config, follow_job
+from invoices import invoice_totals
+import jobs
 from auth.auth_decorator import require_auth
-import json
 
 set_page_config()
 
@@ -142,9 +135,10 @@ def main():
                     st.rerun()
 
         # Calculs
-        total_ht = sum(line['quantite'] * line['prix_unitaire'] for line in st.session_state.invoice_lines)
-        total_tva = sum(line['quantite'] * line['prix_unitaire'] * (line['tva']/100) for line in st.session_state.invoice_lines)
-        total_ttc = total_ht + total_tva
+        totals_info = invoice_totals(st.session_state.invoice_lines)
+        total_ht = totals_info['total_ht']
+        total_tva = totals_info['total_tva']
+        total_ttc = totals_info['total_ttc']
 
         # Afficher les totaux
         st.subheader("💰 Totaux")
@@ -153,182 +147,38 @@ def main():
         col2.metric("Total TVA", f"{total_tva:,.2f} DH")
         col3.metric("Total TTC", f"{total_ttc:,.2f} DH")
 
-        def create_invoice_pdf():
-            buffer = io.BytesIO()
-
-            # Configuration du document avec des marges adaptées
-            doc = SimpleDocTemplate(
-                buffer,
-                pagesize=A4,
-                rightMargin=1.5*cm,
-                leftMargin=1.5*cm,
-                topMargin=2.5*cm,
-                bottomMargin=3*cm
-            )
-
-            elements = []
-            styles = getSampleStyleSheet()
-
-            # En-tête avec date à droite
-            header_data = [
-                ["", "Date: " + invoice_date.strftime("%d/%m/%Y")],
-                ["", f"Période de facturation: Du {date_debut.strftime('%d/%m/%Y')} au {date_fin.strftime('%d/%m/%Y')}"]
-            ]
-            header_table = Table(header_data, colWidths=[400, 150])
-            header_table.setStyle(TableStyle([
-                ('ALIGN', (-1, -1), (-1, -1), 'RIGHT'),
-                ('FONTNAME', (-1, -1), (-1, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (-1, -1), (-1, -1), 10),
-            ]))
-            elements.append(header_table)
-            elements.append(Spacer(1, 20))
-
-            # Titre Facture
-            header_style = ParagraphStyle(
-                'CustomHeader',
-                parent=styles['Heading1'],
-                fontSize=16,
-                alignment=1,
-                spaceAfter=20
-            )
-            elements.append(Paragraph("FACTURE", header_style))
-
-            # Informations client et facture
-            info_data = [
-                ["N° Facture:", invoice_number],
-                ["Client:", st.session_state.client_info["nom"]],
-                ["ICE:", st.session_state.client_info["ice"]],
-                ["Adresse:", st.session_state.client_info["adresse"]]
-            ]
-
-            info_table = Table(info_data, colWidths=[100, 300])
-            info_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ]))
-            elements.append(info_table)
-            elements.append(Spacer(1, 20))
-
-            # Lignes de facture
-            invoice_data = [["Description", "Quantité", "Prix Unit. HT", "TVA", "Total HT"]]
-            for line in st.session_state.invoice_lines:
-                total_line = line['quantite'] * line['prix_unitaire']
-                invoice_data.append([
-                    line['description'],
-                    str(line['quantite']),
-                    f"{line['prix_unitaire']:,.2f} DH",
-                    f"{line['tva']}%",
-                    f"{total_line:,.2f} DH"
-                ])
-
-            # Ajouter les totaux
-            invoice_data.extend([
-                ["", "", "", "Total HT:", f"{total_ht:,.2f} DH"],
-                ["", "", "", "Total TVA:", f"{total_tva:,.2f} DH"],
-                ["", "", "", "Total TTC:", f"{total_ttc:,.2f} DH"]
-            ])
-
-            # Créer le tableau des lignes
-            invoice_table = Table(invoice_data, colWidths=[250, 60, 80, 60, 80])
-            invoice_table.setStyle(TableStyle([
-                ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-                ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, -1), 10),
-                ('GRID', (0, 0), (-1, -4), 1, colors.black),
-                ('LINEABOVE', (3, -3), (-1, -3), 1, colors.black),
-                ('LINEABOVE', (3, -2), (-1, -2), 1, colors.black),
-                ('LINEABOVE', (3, -1), (-1, -1), 2, colors.black),
-                ('ALIGN', (0, -3), (2, -1), 'RIGHT'),
-            ]))
-            elements.append(invoice_table)
-            elements.append(Spacer(1, 20))
-
-            # Montant en lettres
-            montant_lettres = num2words(total_ttc, lang='fr')
-            montant_text = f"Arrêté la présente facture à la somme de : {montant_lettres.upper()} DIRHAMS"
-            elements.append(Paragraph(montant_text, ParagraphStyle(
-                'MontantText',
-                parent=styles['Normal'],
-                fontSize=10,
-                alignment=0,
-                spaceBefore=10,
-                spaceAfter=20
-            )))
-
-            # Ajouter un espace pour pousser le footer vers le bas
-            elements.append(Spacer(1, 50))
-
-            # Footer avec les informations de la société (en bas de page)
-            footer_text = """
-            <para alignment="center">
-            <font size="10"><b>STE HABIBCASH SARL</b></font><br/>
-            <font size="8">ICE: 002184554000026<br/>
-            DR IKOURAMN AIT BRAIM CR BOUNAAMAN - TIZNIT<br/>
-            RC: 3939 - Patente: 49567063 - IF: 33668520 - CNSS: 2436357</font>
-            </para>
-            """
-
-            footer = Paragraph(footer_text, ParagraphStyle(
-                'Footer',
-                parent=styles['Normal'],
-                alignment=1,
-                textColor=colors.black,
-                leading=14  # Espacement entre les lignes
-            ))
-
-            # Créer un cadre pour le footer qui sera toujours en bas de page
-            frame = Frame(
-                doc.leftMargin,
-                doc.bottomMargin - 2*cm,  # Position plus basse
-                doc.width,
-                2*cm,  # Hauteur du footer
-                showBoundary=0
-            )
-
-            elements.append(Spacer(1, 1*cm))  # Espace avant le footer
-            elements.append(footer)
-
-            doc.build(elements)
-            buffer.seek(0)
-            return buffer
-
-        # Bouton pour générer la facture
+        # Bouton pour générer la facture: le PDF est rendu et sauvegardé par une tâche de fond
         if st.button("📄 Générer la facture"):
             if not st.session_state.client_info["nom"] or not st.session_state.client_info["ice"]:
                 st.error("Veuillez remplir au moins le nom et l'ICE du client.")
             elif not any(line['description'] for line in st.session_state.invoice_lines):
                 st.error("Veuillez ajouter au moins une ligne de facture avec une description.")
             else:
-                pdf_buffer = create_invoice_pdf()
-
-                # Sauvegarder la facture dans la base de données
-                try:
-                    totals_info = {
-                        'total_ht': total_ht,
-                        'total_tva': total_tva,
-                        'total_ttc': total_ttc
-                    }
-                    st.session_state.db.add_invoice(
-                        invoice_number=invoice_number,
-                        date=invoice_date,
-                        client_info=st.session_state.client_info,
-                        lines=st.session_state.invoice_lines,
-                        totals_info=totals_info,
-                        pdf_data=pdf_buffer.getvalue()
-                    )
-
-                    st.download_button(
-                        label="⬇️ Télécharger la facture PDF",
-                        data=pdf_buffer,
-                        file_name=f"facture_{invoice_number}.pdf",
-                        mime="application/pdf"
-                    )
-                    st.success("Facture générée et sauvegardée avec succès!")
-                except Exception as e:
-                    st.error(f"Erreur lors de la sauvegarde de la facture: {str(e)}")
+                st.session_state.invoice_job = jobs.submit(st.session_state.db, 'invoice', {
+                    'invoice_number': invoice_number,
+                    'date': invoice_date,
+                    'date_debut': date_debut,
+                    'date_fin': date_fin,
+                    'client_info': st.session_state.client_info,
+                    'lines': st.session_state.invoice_lines
+                }, username=st.session_state.get('username'))
+                st.session_state.invoice_pdf = None
+
+        if st.session_state.get('invoice_job') is not None:
+            job = follow_job(st.session_state.invoice_job, "Génération de la facture")
+            if job['status'] == 'done':
+                if st.session_state.get('invoice_pdf') is None:
+                    st.session_state.invoice_pdf = jobs.result(st.session_state.db, st.session_state.invoice_job)[1]
+                st.download_button(
+                    label="⬇️ Télécharger la facture PDF",
+                    data=st.session_state.invoice_pdf,
+                    file_name=f"facture_{job['info']['invoice_number']}.pdf",
+                    mime="application/pdf"
+                )
+                st.success("Facture générée et sauvegardée avec succès!")
+            elif job['status'] == 'failed':
+                st.error(f"Erreur lors de la sauvegarde de la facture: {job['error']}")
+                st.session_state.invoice_job = None
 
     with tab2:
         st.subheader("📚 Historique des Factures")
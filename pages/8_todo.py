@@ -16,9 +16,6 @@ def main():
     if 'db' not in st.session_state:
         st.session_state.db = Database()
 
-    # Create todo table if not exists
-    st.session_state.db.create_todo_table()
-
     # Form for adding new task
     st.subheader("✨ Nouveau Projet")
     with st.form("new_task_form"):
@@ -63,7 +63,7 @@ if not projects.empty:
                 with col1_1:
                     if st.button("💾 Sauvegarder", key=f"save_{project['id']}"):
                         try:
-                            st.session_state.db.update_project_name(project['id'], new_name)
+                            st.session_state.db.update_project_name(int(project['id']), new_name)
                             st.session_state.editing_project = None
                             st.success(f"Nom du projet modifié avec succès!")
                             st.rerun()
@@ -0,0 +1,180 @@
+"""Rapprochement d'un relevé bancaire avec les transactions non payées.
+
+Fonctions pandas sans Streamlit. Chaque ligne du relevé est rapprochée
+d'une transaction non payée du même sens (débit -> charge, crédit ->
+recette) dont le montant est égal à la tolérance près et la date proche.
+Les candidats sont trouvés par recherche dichotomique dans les montants
+triés (comme merge_asof, mais avec tous les candidats de l'intervalle), puis
+départagés par l'écart de montant, l'écart de dates et la ressemblance des
+libellés. Une transaction n'est rapprochée que d'une seule ligne du relevé.
+"""
+import difflib
+import re
+import unicodedata
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from importer import csv_format, normalize_columns, parse_dates
+
+# En-têtes usuels des relevés bancaires
+STATEMENT_ALIASES = {'date_operation': 'date', 'date_d\'operation': 'date', 'operation': 'libelle',
+                     'libelle_operation': 'libelle', 'debit_(dh)': 'debit', 'credit_(dh)': 'credit'}
+
+STATEMENT_COLUMNS = ['line', 'date', 'libelle', 'montant', 'type']
+
+MATCH_COLUMNS = [
+    'line', 'date', 'libelle', 'montant', 'type', 'transaction_id', 'transaction_date',
+    'transaction_libelle', 'transaction_montant', 'ecart_jours', 'ecart_montant', 'similarite'
+]
+
+
+def _amounts(values, decimal):
+    """Montants d'une colonne lue en texte ou déjà numérique (NaN si illisible)."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    text = values.astype('string').str.replace('[\\s\u00a0]', '', regex=True)
+    if decimal == ',':
+        text = text.str.replace('.', '').str.replace(',', '.')
+    return pd.to_numeric(text, errors='coerce').astype(float)
+
+
+def read_statement(file):
+    """Lit un relevé bancaire Excel ou CSV.
+
+    Le relevé doit avoir les colonnes date et libelle, et soit montant
+    (négatif pour un débit), soit debit et credit. Renvoie un DataFrame aux
+    colonnes STATEMENT_COLUMNS: montant positif, type 'charge' pour un débit
+    et 'recette' pour un crédit; les lignes sans date ou montant sont ignorées.
+    Lève ValueError si des colonnes manquent.
+    """
+    file.seek(0)
+    decimal = '.'
+    if getattr(file, 'name', '').lower().endswith('.csv'):
+        sep, decimal, _ = csv_format(file)
+        # Lignes vides gardées: l'index reste la position de la ligne dans le fichier
+        statement = pd.read_csv(file, sep=sep, dtype=str, encoding='utf-8-sig', skip_blank_lines=False)
+    else:
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = list(workbook.active.iter_rows(values_only=True))
+        finally:
+            workbook.close()
+        header = [column if column is not None else '' for column in rows[0]] if rows else []
+        statement = pd.DataFrame(rows[1:], columns=header)
+    statement.columns = normalize_columns(statement.columns).map(lambda c: STATEMENT_ALIASES.get(c, c))
+    has_amount = 'montant' in statement.columns or {'debit', 'credit'} <= set(statement.columns)
+    missing = [column for column in ['date', 'libelle'] if column not in statement.columns]
+    if missing or not has_amount:
+        if not has_amount:
+            missing.append('montant (ou debit et credit)')
+        raise ValueError(f"Colonnes manquantes: {', '.join(missing)}\nColonnes trouvées: {', '.join(statement.columns)}")
+
+    if 'montant' in statement.columns:
+        signed = _amounts(statement['montant'], decimal)
+    else:
+        signed = _amounts(statement['credit'], decimal).fillna(0) - _amounts(statement['debit'], decimal).fillna(0)
+    dates = parse_dates(statement['date'])
+    result = pd.DataFrame({
+        # Numéro de la ligne dans le fichier, avant que des lignes soient écartées: l'en-tête est la ligne 1
+        'line': statement.index + 2,
+        'date': dates.dt.normalize(),
+        'libelle': statement['libelle'].astype('string').str.strip().fillna(''),
+        'montant': signed.abs().round(2),
+        'type': np.where(signed < 0, 'charge', 'recette'),
+    })
+    return result[result['date'].notna() & signed.notna() & (signed != 0)].reset_index(drop=True)[STATEMENT_COLUMNS]
+
+
+def _words(text):
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', errors='ignore').decode().lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def libelle_similarity(left, right):
+    """Ressemblance entre deux libellés, de 0 à 1, sans accents ni casse."""
+    return difflib.SequenceMatcher(None, _words(left), _words(right)).ratio()
+
+
+def _candidates(statement, unpaid, amount_tolerance, max_days):
+    """Paires (ligne du relevé, transaction) compatibles, sans double boucle.
+
+    Les montants des transactions d'un même type sont triés; pour chaque
+    ligne, searchsorted donne l'intervalle des montants à la tolérance près,
+    et les paires sont produites d'un bloc avec np.repeat.
+    """
+    tolerance = int(round(amount_tolerance * 100))
+    pairs = []
+    for type_, lines in statement.groupby('type'):
+        transactions = unpaid[unpaid['type'] == type_].sort_values('cents')
+        if transactions.empty:
+            continue
+        cents = transactions['cents'].to_numpy()
+        wanted = lines['cents'].to_numpy()
+        low = np.searchsorted(cents, wanted - tolerance, side='left')
+        high = np.searchsorted(cents, wanted + tolerance, side='right')
+        counts = high - low
+        if not counts.sum():
+            continue
+        # Position de chaque candidat: début de l'intervalle de sa ligne + rang dans l'intervalle
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(low, counts) + offsets
+        left = lines.iloc[np.repeat(np.arange(len(lines)), counts)].reset_index(drop=True)
+        right = transactions.iloc[positions].reset_index(drop=True).add_prefix('transaction_')
+        pairs.append(pd.concat([left, right], axis=1))
+    if not pairs:
+        return pd.DataFrame()
+    pairs = pd.concat(pairs, ignore_index=True)
+    pairs['ecart_jours'] = (pairs['date'] - pairs['transaction_date']).dt.days
+    return pairs[pairs['ecart_jours'].abs() <= max_days].reset_index(drop=True)
+
+
+def match_statement(statement, unpaid, amount_tolerance=0.0, max_days=15):
+    """Rapproche les lignes du relevé des transactions non payées.
+
+    statement: relevé lu par read_statement
+    unpaid: transactions non payées id, date, libelle, montant, type
+    amount_tolerance: écart de montant accepté (DH)
+    max_days: écart de dates accepté, dans un sens ou dans l'autre (jours)
+
+    Les paires candidates sont classées par écart de montant, puis écart de
+    dates, puis ressemblance des libellés (calculée seulement pour les
+    candidats à départager). À chaque tour, les paires qui sont le meilleur
+    choix à la fois de leur ligne et de leur transaction sont retenues, puis
+    les lignes et transactions restantes passent au tour suivant.
+
+    Renvoie (DataFrame aux colonnes MATCH_COLUMNS, lignes du relevé non rapprochées).
+    """
+    statement = statement.assign(cents=(statement['montant'] * 100).round().astype('int64'))
+    unpaid = unpaid.assign(cents=(unpaid['montant'].astype(float) * 100).round().astype('int64'),
+                           date=pd.to_datetime(unpaid['date']))
+    pairs = _candidates(statement, unpaid, amount_tolerance, max_days)
+    if pairs.empty:
+        return pd.DataFrame(columns=MATCH_COLUMNS), statement[STATEMENT_COLUMNS]
+
+    pairs['ecart_montant'] = (pairs['transaction_cents'] - pairs['cents']) / 100
+    pairs['similarite'] = np.nan
+    ambiguous = (pairs.groupby('line')['transaction_id'].transform('size') > 1) | \
+                (pairs.groupby('transaction_id')['line'].transform('size') > 1)
+    pairs.loc[ambiguous, 'similarite'] = [
+        libelle_similarity(left, right)
+        for left, right in zip(pairs.loc[ambiguous, 'libelle'], pairs.loc[ambiguous, 'transaction_libelle'])
+    ]
+    pairs = pairs.assign(
+        _montant=pairs['ecart_montant'].abs(), _jours=pairs['ecart_jours'].abs(), _libelle=-pairs['similarite'].fillna(1)
+    ).sort_values(['_montant', '_jours', '_libelle', 'line', 'transaction_id'], kind='stable')
+
+    matches = []
+    while not pairs.empty:
+        # Paires classées en tête à la fois pour leur ligne et pour leur transaction;
+        # la toute première paire l'est toujours, chaque tour avance donc
+        chosen = pairs[~pairs.duplicated('line') & ~pairs.duplicated('transaction_id')]
+        matches.append(chosen)
+        pairs = pairs[~pairs['line'].isin(chosen['line']) & ~pairs['transaction_id'].isin(chosen['transaction_id'])]
+
+    matches = pd.concat(matches, ignore_index=True).sort_values('line').reset_index(drop=True)
+    matches['transaction_date'] = matches['transaction_date'].dt.date
+    matches['date'] = matches['date'].dt.date
+    unmatched = statement[~statement['line'].isin(matches['line'])][STATEMENT_COLUMNS]
+    return matches[MATCH_COLUMNS], unmatched.reset_index(drop=True)
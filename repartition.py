@@ -0,0 +1,119 @@
+"""Répartition des bénéfices entre associés.
+
+Fonctions pandas pures, sans Streamlit ni base de données: elles prennent
+les associés, les versements et les investissements sous forme de
+DataFrame et calculent toutes les colonnes pour tous les associés en une
+seule passe, quel que soit leur nombre.
+"""
+import pandas as pd
+
+SPLIT_COLUMNS = [
+    'id', 'name', 'share_percentage', 'benefices_payes', 'benefices_a_recevoir', 'total_benefices',
+    'total_investi', 'montant_paye', 'reste_a_payer', 'reste_tresorerie'
+]
+
+OLD_METHOD_COLUMNS = [
+    'Associé', 'Investissement', 'Balance des Opérations', 'Différence', 'Montant Payé',
+    'Décaissement', 'Encaissement', 'Répartition Trésorerie', 'Reste'
+]
+
+
+def _flows_by_partner(payments, investments):
+    """Somme versements et investissements par associé en un seul groupby."""
+    flows = pd.concat([
+        pd.DataFrame({'partner_id': payments['partner_id'], 'kind': 'montant_paye',
+                      'amount': payments['amount']}),
+        pd.DataFrame({'partner_id': investments['partner_id'], 'kind': 'total_investi',
+                      'amount': investments['amount']}),
+    ], ignore_index=True)
+    flows['amount'] = flows['amount'].astype(float)
+    sums = flows.groupby(['partner_id', 'kind'])['amount'].sum().unstack('kind')
+    return sums.reindex(columns=['montant_paye', 'total_investi'])
+
+
+def repartition_associes(partners, payments, investments, balance):
+    """Calcule la répartition des bénéfices de chaque associé.
+
+    partners: id, name, share_percentage
+    payments: partner_id, amount (versements déjà faits aux associés)
+    investments: partner_id, amount (sommes investies par les associés)
+    balance: totaux de Database.get_financial_snapshot()
+
+    Renvoie un DataFrame aux colonnes SPLIT_COLUMNS, une ligne par associé.
+    """
+    balance_nette = balance['total_recettes_payees'] - balance['total_depenses']
+    split = partners[['id', 'name', 'share_percentage']].merge(
+        _flows_by_partner(payments, investments), left_on='id', right_index=True, how='left'
+    )
+    split[['montant_paye', 'total_investi']] = split[['montant_paye', 'total_investi']].fillna(0.0)
+
+    share = split['share_percentage'].astype(float) / 100
+    split['benefices_payes'] = balance_nette * share
+    split['benefices_a_recevoir'] = balance['total_recettes_impayees'] * share
+    split['total_benefices'] = split['benefices_payes'] + split['benefices_a_recevoir']
+    split['reste_a_payer'] = split['benefices_payes'] - split['montant_paye']
+    split['reste_tresorerie'] = split['reste_a_payer'] + split['total_investi']
+    return split[SPLIT_COLUMNS].reset_index(drop=True)
+
+
+def repartition_versements(split, balance):
+    """Montants versés à chaque associé et reste à distribuer, pour le graphique.
+
+    Renvoie un DataFrame name, amount dont la dernière ligne est le reste.
+    """
+    balance_nette = balance['total_recettes_payees'] - balance['total_depenses']
+    reste = pd.DataFrame({'name': ['Reste à distribuer'],
+                          'amount': [balance_nette - split['montant_paye'].sum()]})
+    versements = split[['name', 'montant_paye']].rename(columns={'montant_paye': 'amount'})
+    return pd.concat([versements, reste], ignore_index=True)
+
+
+def ancienne_methode(split, balance, operateur_id, associes=None):
+    """Tableau de l'ancienne méthode de calcul, avec une ligne TOTAL.
+
+    L'associé operateur_id porte la balance des opérations, les autres 0.
+    Le décaissement d'un associé est l'opposé des versements faits aux autres
+    et la trésorerie restante (balance - investissements) est partagée à
+    parts égales. associes limite le tableau à certains associés (tous par
+    défaut).
+    """
+    if associes is not None:
+        split = split[split['id'].isin(associes)]
+    balance_operations = balance['total_recettes_payees'] - balance['total_depenses']
+    nb = len(split)
+    total_investi = split['total_investi'].sum()
+    total_paye = split['montant_paye'].sum()
+    repartition = (balance_operations - total_investi) / nb if nb else 0.0
+
+    table = pd.DataFrame({
+        'Associé': split['name'],
+        'Investissement': split['total_investi'],
+        'Balance des Opérations': (split['id'] == operateur_id) * balance_operations,
+        'Montant Payé': split['montant_paye'],
+        'Décaissement': split['montant_paye'] - total_paye,
+    })
+    total = pd.DataFrame({
+        'Associé': ['TOTAL'],
+        'Investissement': [total_investi],
+        'Balance des Opérations': [balance_operations],
+        'Montant Payé': [total_paye],
+        'Décaissement': [-total_paye],
+    })
+    table = pd.concat([table, total], ignore_index=True)
+    table['Différence'] = table['Balance des Opérations'] - table['Investissement']
+    table['Encaissement'] = table['Différence'] + table['Montant Payé'] + table['Décaissement']
+    table['Répartition Trésorerie'] = repartition
+    table.loc[table.index[-1], 'Répartition Trésorerie'] = repartition * nb
+    table['Reste'] = table['Répartition Trésorerie'] - table['Encaissement']
+    return table[OLD_METHOD_COLUMNS].astype({c: float for c in OLD_METHOD_COLUMNS[1:]})
+
+
+def repartition_snapshot(snapshot):
+    """repartition_associes() appliquée à Database.get_financial_snapshot()."""
+    partners = snapshot['partners']
+    return repartition_associes(
+        partners,
+        pd.DataFrame({'partner_id': partners['id'], 'amount': partners['montant_paye']}),
+        pd.DataFrame({'partner_id': partners['id'], 'amount': partners['total_investi']}),
+        snapshot
+    )
@@ -0,0 +1,106 @@
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from importer import parse_dates, prepare_chunk, prepare_table
+
+
+def chunk(**columns):
+    rows = {
+        'date': ['02/01/2025'], 'montant': ['10.50'], 'libelle': ['Loyer'], 'type': ['Charge'],
+        'projet': ['TAWSSIL'], 'categorie': ['Loyer'], 'payer': ['Non'],
+    }
+    rows.update(columns)
+    size = max(len(values) for values in rows.values())
+    frame = pd.DataFrame({name: (values * size if len(values) == 1 else values) for name, values in rows.items()},
+                         dtype=object)
+    frame.index = range(2, 2 + size)
+    return frame
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('2025-01-02', datetime.datetime(2025, 1, 2)),
+    ('02/01/2025', datetime.datetime(2025, 1, 2)),
+    ('2/1/2025', datetime.datetime(2025, 1, 2)),
+    ('02-01-2025', datetime.datetime(2025, 1, 2)),
+    ('2025-01-02 14:30:00', datetime.datetime(2025, 1, 2, 14, 30)),
+    (' 13/01/2025 ', datetime.datetime(2025, 1, 13)),
+])
+def test_parse_dates_text_formats(text, expected):
+    assert parse_dates(pd.Series([text], dtype=object)).tolist() == [pd.Timestamp(expected)]
+
+
+def test_parse_dates_never_swaps_iso_day_and_month():
+    dates = parse_dates(pd.Series(['2025-01-02', '2025-01-05', '2025-12-01'], dtype=object))
+    assert dates.dt.month.tolist() == [1, 1, 12]
+    assert dates.dt.day.tolist() == [2, 5, 1]
+
+
+def test_parse_dates_keeps_date_cells():
+    cells = pd.Series([datetime.datetime(2025, 1, 2, 9, 0), datetime.date(2025, 2, 1), pd.Timestamp('2025-03-04')],
+                      dtype=object)
+    assert parse_dates(cells).tolist() == [pd.Timestamp('2025-01-02 09:00'), pd.Timestamp('2025-02-01'),
+                                           pd.Timestamp('2025-03-04')]
+
+
+def test_parse_dates_mixed_cells_and_formats():
+    cells = pd.Series(['2025-01-02', '03/01/2025', datetime.datetime(2025, 1, 4), '2025-01-05 00:00:00'],
+                      dtype=object)
+    assert parse_dates(cells).dt.day.tolist() == [2, 3, 4, 5]
+
+
+def test_parse_dates_invalid_values():
+    dates = parse_dates(pd.Series(['31/02/2025', 'demain', '', None, 45000, float('nan')], dtype=object))
+    assert dates.isna().all()
+
+
+def test_prepare_chunk_dates_and_raw_values():
+    rows = prepare_chunk(chunk(date=['2025-01-02', '05/01/2025', datetime.datetime(2025, 1, 7), '2025-13-01']))
+    assert rows['date'].tolist()[:3] == [pd.Timestamp('2025-01-02'), pd.Timestamp('2025-01-05'),
+                                         pd.Timestamp('2025-01-07')]
+    assert pd.isna(rows['date'].iloc[3])
+    assert rows['date_raw'].isna().tolist() == [True, True, True, False]
+    assert rows['date_raw'].iloc[3] == '2025-13-01'
+    # Sans colonne date_paiement, la date de paiement est la date
+    assert rows['date_paiement'].iloc[0] == pd.Timestamp('2025-01-02')
+
+
+def test_prepare_chunk_same_result_whatever_the_chunk():
+    # Les formats ne sont plus devinés morceau par morceau
+    mixed = chunk(date=['2025-01-02', '03/01/2025'])
+    alone = chunk(date=['03/01/2025'])
+    assert prepare_chunk(mixed)['date'].iloc[1] == prepare_chunk(alone)['date'].iloc[0] == pd.Timestamp('2025-01-03')
+
+
+def test_prepare_chunk_payment_dates():
+    rows = prepare_chunk(chunk(payer=['Oui', 'oui'], date_paiement=['2025-02-01', datetime.date(2025, 2, 3)]))
+    assert rows['payer'].tolist() == ['oui', 'oui']
+    assert rows['date_paiement'].tolist() == [pd.Timestamp('2025-02-01'), pd.Timestamp('2025-02-03')]
+
+
+def test_prepare_chunk_amounts():
+    rows = prepare_chunk(chunk(montant=['10.505', 12, 'abc', 'inf', '1e14']))
+    assert rows['montant'].iloc[:2].tolist() == [pytest.approx(10.5, abs=0.006), 12.0]
+    assert rows['montant'].iloc[2:4].isna().all()
+    assert rows['montant_raw'].iloc[2:4].tolist() == ['abc', 'inf']
+    # Un montant trop grand est gardé: la validation SQL le signale pour sa ligne
+    assert rows['montant'].iloc[4] == 1e14
+    assert pd.isna(rows['montant_raw'].iloc[4])
+
+
+def test_prepare_chunk_text_columns():
+    rows = prepare_chunk(chunk(libelle=['  Loyer\x00 janvier '], type=[' CHARGE ']))
+    assert rows['libelle'].iloc[0] == 'Loyer janvier'
+    assert rows['type'].iloc[0] == 'charge'
+    assert rows['line'].tolist() == [2]
+
+
+def test_prepare_table_matches_prepare_chunk():
+    frame = chunk(date=['2025-01-02', '03/01/2025', 'x'], montant=['10.50', '7', 'abc'])
+    table = pa.table({column: pa.array(frame[column].tolist(), pa.string()) for column in frame.columns})
+    from_chunk = prepare_chunk(frame)
+    from_table = prepare_table(table, frame.index)
+    for column in ['date', 'date_raw', 'montant', 'montant_raw', 'libelle', 'type', 'payer', 'date_paiement']:
+        pd.testing.assert_series_equal(from_table[column], from_chunk[column], check_dtype=False, obj=column)
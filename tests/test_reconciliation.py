@@ -0,0 +1,133 @@
+import datetime
+import io
+import random
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from reconciliation import (MATCH_COLUMNS, STATEMENT_COLUMNS, libelle_similarity, match_statement,
+                            read_statement)
+
+
+def csv_file(text, name='releve.csv'):
+    file = io.BytesIO(text.encode('utf-8'))
+    file.name = name
+    return file
+
+
+def excel_file(rows):
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    file = io.BytesIO()
+    workbook.save(file)
+    file.seek(0)
+    file.name = 'releve.xlsx'
+    return file
+
+
+def test_read_statement_csv_dates_are_not_swapped():
+    statement = read_statement(csv_file("date;libelle;montant\n2025-01-05;A;-10,50\n05/01/2025;B;20\n"))
+    assert list(statement.columns) == STATEMENT_COLUMNS
+    assert statement['date'].tolist() == [pd.Timestamp('2025-01-05'), pd.Timestamp('2025-01-05')]
+    assert statement['montant'].tolist() == [10.5, 20.0]
+    assert statement['type'].tolist() == ['charge', 'recette']
+
+
+def test_read_statement_line_numbers_survive_skipped_rows():
+    statement = read_statement(csv_file(
+        "date;libelle;montant\n2025-01-05;A;-10\n\n2025-01-06;B;20\n;;\nxx;C;5\n2025-01-07;D;0\n2025-01-08;E;7\n"
+    ))
+    assert statement['line'].tolist() == [2, 4, 8]
+    assert statement['libelle'].tolist() == ['A', 'B', 'E']
+
+
+def test_read_statement_excel_date_cells_and_debit_credit():
+    statement = read_statement(excel_file([
+        ['Date opération', 'Libellé opération', 'Débit (DH)', 'Crédit (DH)'],
+        [datetime.datetime(2025, 1, 5), 'VIR LOYER', 1200, None],
+        [None, None, None, None],
+        ['2025-01-06', 'ENCAISSEMENT', None, 300.5],
+    ]))
+    assert statement['line'].tolist() == [2, 4]
+    assert statement['date'].tolist() == [pd.Timestamp('2025-01-05'), pd.Timestamp('2025-01-06')]
+    assert statement['montant'].tolist() == [1200.0, 300.5]
+    assert statement['type'].tolist() == ['charge', 'recette']
+
+
+def test_read_statement_missing_columns():
+    with pytest.raises(ValueError, match='Colonnes manquantes'):
+        read_statement(csv_file("date;libelle\n2025-01-05;A\n"))
+
+
+def test_match_statement_prefers_amount_then_date_then_label():
+    statement = pd.DataFrame({
+        'line': [2, 3], 'date': pd.to_datetime(['2025-01-10', '2025-01-10']),
+        'libelle': ['VIR LOYER JANVIER', 'FACTURE ELECTRICITE'], 'montant': [100.0, 100.0],
+        'type': ['charge', 'charge'],
+    })
+    unpaid = pd.DataFrame({
+        'id': [1, 2, 3], 'date': [datetime.date(2025, 1, 9)] * 3,
+        'libelle': ['Electricité janvier', 'Loyer janvier', 'Autre'], 'montant': [100.0, 100.0, 100.01],
+        'type': ['charge', 'charge', 'charge'],
+    })
+    matches, unmatched = match_statement(statement, unpaid, amount_tolerance=0.05)
+    assert list(matches.columns) == MATCH_COLUMNS
+    assert dict(zip(matches['line'], matches['transaction_id'])) == {2: 2, 3: 1}
+    assert unmatched.empty
+
+
+def test_match_statement_respects_type_tolerance_and_days():
+    statement = pd.DataFrame({
+        'line': [2, 3, 4], 'date': pd.to_datetime(['2025-01-10', '2025-01-10', '2025-01-10']),
+        'libelle': ['A', 'B', 'C'], 'montant': [50.0, 80.0, 90.0], 'type': ['recette', 'charge', 'charge'],
+    })
+    unpaid = pd.DataFrame({
+        'id': [1, 2, 3], 'date': [datetime.date(2025, 1, 10), datetime.date(2025, 1, 10), datetime.date(2025, 3, 1)],
+        'libelle': ['A', 'B', 'C'], 'montant': [50.0, 80.5, 90.0], 'type': ['charge', 'charge', 'charge'],
+    })
+    matches, unmatched = match_statement(statement, unpaid, amount_tolerance=0.10, max_days=15)
+    assert matches.empty
+    assert unmatched['line'].tolist() == [2, 3, 4]
+
+
+def greedy_reference(statement, unpaid, amount_tolerance, max_days):
+    """Rapprochement naïf: toutes les paires classées, la meilleure retenue à chaque fois."""
+    pairs = []
+    for _, line in statement.iterrows():
+        for _, transaction in unpaid.iterrows():
+            ecart = round(transaction['montant'] * 100) - round(line['montant'] * 100)
+            jours = (line['date'] - pd.Timestamp(transaction['date'])).days
+            if line['type'] == transaction['type'] and abs(ecart) <= round(amount_tolerance * 100) \
+                    and abs(jours) <= max_days:
+                similarite = libelle_similarity(line['libelle'], transaction['libelle'])
+                pairs.append((abs(ecart), abs(jours), -similarite, line['line'], transaction['id']))
+    chosen = {}
+    for *_, line, transaction_id in sorted(pairs):
+        if line not in chosen and transaction_id not in chosen.values():
+            chosen[line] = transaction_id
+    return chosen
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_match_statement_matches_greedy_reference(seed):
+    rng = random.Random(seed)
+    words = ['loyer', 'facture', 'electricite', 'transport', 'salaire', 'client', 'vir', 'cheque']
+    start = datetime.date(2025, 1, 1)
+
+    def rows(count):
+        return [{
+            'date': start + datetime.timedelta(days=rng.randint(0, 40)),
+            'libelle': ' '.join(rng.sample(words, 2)),
+            'montant': rng.choice([100.0, 100.05, 250.0, 99.98, 42.5, 1000.0]),
+            'type': rng.choice(['charge', 'recette']),
+        } for _ in range(count)]
+
+    statement = pd.DataFrame(rows(12)).assign(line=range(2, 14))
+    statement['date'] = pd.to_datetime(statement['date'])
+    unpaid = pd.DataFrame(rows(15)).assign(id=range(1, 16))
+    matches, unmatched = match_statement(statement[STATEMENT_COLUMNS], unpaid, amount_tolerance=0.05, max_days=10)
+    assert dict(zip(matches['line'], matches['transaction_id'])) == greedy_reference(statement, unpaid, 0.05, 10)
+    assert matches['transaction_id'].is_unique
+    assert sorted(matches['line'].tolist() + unmatched['line'].tolist()) == list(range(2, 14))
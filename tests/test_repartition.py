@@ -0,0 +1,137 @@
+import pandas as pd
+import pytest
+
+from repartition import (OLD_METHOD_COLUMNS, SPLIT_COLUMNS, ancienne_methode, repartition_associes,
+                         repartition_snapshot, repartition_versements)
+
+BALANCE = {'total_recettes_payees': 125000.35, 'total_depenses': 40210.10, 'total_recettes_impayees': 9870.55}
+
+
+def baseline_split(partners, payments, investments, balance):
+    """Boucle de la page Situation financière avant repartition.py, sans la mise en forme."""
+    rows = []
+    for _, partner in partners.iterrows():
+        share_percentage = partner['share_percentage'] / 100
+        benefices_payes = (balance['total_recettes_payees'] - balance['total_depenses']) * share_percentage
+        benefices_a_recevoir = balance['total_recettes_impayees'] * share_percentage
+        partner_investments = investments[investments['partner_id'] == partner['id']]['amount'].sum()
+        partner_payments = payments[payments['partner_id'] == partner['id']]['amount'].sum() if not payments.empty else 0
+        rows.append({
+            'benefices_payes': benefices_payes,
+            'benefices_a_recevoir': benefices_a_recevoir,
+            'total_benefices': benefices_payes + benefices_a_recevoir,
+            'total_investi': partner_investments,
+            'montant_paye': partner_payments,
+            'reste_a_payer': benefices_payes - partner_payments,
+            'reste_tresorerie': benefices_payes + partner_investments - partner_payments,
+        })
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def partners():
+    return pd.DataFrame({'id': [1, 2, 3], 'name': ['ALAMI', 'BENNANI', 'CHRAIBI'],
+                         'share_percentage': [33.33, 33.33, 33.34]})
+
+
+@pytest.fixture
+def payments():
+    # L'associé 3 n'a reçu aucun versement
+    return pd.DataFrame({'partner_id': [1, 2, 1, 2], 'amount': [1000.10, 2500.00, 499.95, 0.05]})
+
+
+@pytest.fixture
+def investments():
+    # L'associé 2 n'a rien investi
+    return pd.DataFrame({'partner_id': [1, 3, 3], 'amount': [20000.00, 5000.50, 7499.50]})
+
+
+def test_split_matches_baseline(partners, payments, investments):
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    expected = baseline_split(partners, payments, investments, BALANCE)
+    assert list(split.columns) == SPLIT_COLUMNS
+    assert split['id'].tolist() == [1, 2, 3]
+    for column in expected.columns:
+        assert split[column].tolist() == pytest.approx(expected[column].tolist(), abs=1e-9), column
+
+
+def test_split_matches_baseline_to_the_cent(partners, payments, investments):
+    # La page affiche les montants au centime: l'arrondi doit être identique à l'ancien calcul
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    expected = baseline_split(partners, payments, investments, BALANCE)
+    for column in expected.columns:
+        assert [f"{value:,.2f}" for value in split[column]] == [f"{value:,.2f}" for value in expected[column]]
+
+
+def test_split_without_payments_or_investments(partners):
+    empty = pd.DataFrame({'partner_id': pd.Series(dtype='int64'), 'amount': pd.Series(dtype=float)})
+    split = repartition_associes(partners, empty, empty, BALANCE)
+    assert split['montant_paye'].tolist() == [0.0, 0.0, 0.0]
+    assert split['total_investi'].tolist() == [0.0, 0.0, 0.0]
+    assert split['reste_tresorerie'].tolist() == pytest.approx(split['benefices_payes'].tolist())
+
+
+def test_split_without_partners(payments, investments):
+    partners = pd.DataFrame({'id': pd.Series(dtype='int64'), 'name': pd.Series(dtype=str),
+                             'share_percentage': pd.Series(dtype=float)})
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    assert split.empty
+    assert list(split.columns) == SPLIT_COLUMNS
+
+
+def test_versements_remaining_amount(partners, payments, investments):
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    versements = repartition_versements(split, BALANCE)
+    assert versements['name'].tolist() == ['ALAMI', 'BENNANI', 'CHRAIBI', 'Reste à distribuer']
+    balance_nette = BALANCE['total_recettes_payees'] - BALANCE['total_depenses']
+    assert versements['amount'].iloc[-1] == pytest.approx(balance_nette - payments['amount'].sum())
+
+
+def test_ancienne_methode_matches_baseline_for_two_partners():
+    partners = pd.DataFrame({'id': [1, 2], 'name': ['EL AZZAOUY ABDERRAHIM', 'EL AZZOUY MOHAMED LAHBIB ET STE'],
+                             'share_percentage': [50.0, 50.0]})
+    payments = pd.DataFrame({'partner_id': [1, 2, 2], 'amount': [3000.0, 1200.5, 800.0]})
+    investments = pd.DataFrame({'partner_id': [1, 2], 'amount': [15000.0, 22000.25]})
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    table = ancienne_methode(split, BALANCE, operateur_id=2)
+
+    # Calcul de l'ancienne page, écrit pour ces deux associés
+    balance_operations = BALANCE['total_recettes_payees'] - BALANCE['total_depenses']
+    a_investment, m_investment = 15000.0, 22000.25
+    a_paid, m_paid = 3000.0, 2000.5
+    total_investment, total_paid = a_investment + m_investment, a_paid + m_paid
+    a_diff, m_diff, total_diff = -a_investment, balance_operations - m_investment, balance_operations - total_investment
+    a_enc = a_diff + a_paid - m_paid
+    m_enc = m_diff + m_paid - a_paid
+    total_enc = total_diff + total_paid - total_paid
+    repartition = (balance_operations - total_investment) / 2
+    expected = pd.DataFrame({
+        'Associé': ['EL AZZAOUY ABDERRAHIM', 'EL AZZOUY MOHAMED LAHBIB ET STE', 'TOTAL'],
+        'Investissement': [a_investment, m_investment, total_investment],
+        'Balance des Opérations': [0, balance_operations, balance_operations],
+        'Différence': [a_diff, m_diff, total_diff],
+        'Montant Payé': [a_paid, m_paid, total_paid],
+        'Décaissement': [-m_paid, -a_paid, -total_paid],
+        'Encaissement': [a_enc, m_enc, total_enc],
+        'Répartition Trésorerie': [repartition, repartition, repartition * 2],
+        'Reste': [repartition - a_enc, repartition - m_enc, repartition * 2 - total_enc],
+    })
+    assert list(table.columns) == OLD_METHOD_COLUMNS
+    assert table['Associé'].tolist() == expected['Associé'].tolist()
+    for column in OLD_METHOD_COLUMNS[1:]:
+        assert table[column].tolist() == pytest.approx(expected[column].tolist()), column
+
+
+def test_ancienne_methode_without_partners(partners, payments, investments):
+    split = repartition_associes(partners, payments, investments, BALANCE)
+    table = ancienne_methode(split, BALANCE, operateur_id=1, associes=[])
+    assert table['Associé'].tolist() == ['TOTAL']
+    assert table['Répartition Trésorerie'].tolist() == [0.0]
+
+
+def test_snapshot_uses_partner_totals(partners):
+    snapshot = dict(BALANCE, partners=partners.assign(montant_paye=[100.0, 0.0, 50.0],
+                                                      total_investi=[0.0, 10.0, 0.0]))
+    split = repartition_snapshot(snapshot)
+    assert split['montant_paye'].tolist() == [100.0, 0.0, 50.0]
+    assert split['total_investi'].tolist() == [0.0, 10.0, 0.0]
@@ -1,6 +1,7 @@
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
+import jobs
 
 def set_page_config():
     st.set_page_config(
@@ -60,6 +61,73 @@ def set_page_config():
         </style>
     """, unsafe_allow_html=True)
 
+def refresh_on_change(key, tables, interval=10):
+    """Relance la page quand une des tables change, vérifié toutes les interval secondes.
+
+    Les versions viennent du flux des modifications de la base: la page n'est
+    recalculée que si ses données ont réellement changé.
+    """
+    @st.fragment(run_every=interval)
+    def watch():
+        version = st.session_state.db.data_version(*tables)
+        if st.session_state.get(key) is None:
+            st.session_state[key] = version
+        elif st.session_state[key] != version:
+            st.session_state[key] = version
+            st.rerun()
+
+    watch()
+
+def _finished(job):
+    return job['status'] in jobs.FINISHED
+
+
+def _job_state(job_id):
+    """État d'une tâche; une tâche disparue (purgée ou inconnue) est présentée comme un échec."""
+    job = jobs.status(st.session_state.db, job_id)
+    if job is None:
+        return {'id': job_id, 'status': 'failed', 'progress': 0, 'total': None, 'info': None, 'missing': True,
+                'error': "Tâche introuvable (supprimée ou inconnue), relancez l'opération"}
+    return job
+
+
+def follow_jobs(job_ids, label, interval=2):
+    """Affiche l'avancement de tâches de fond et relance la page quand elles sont toutes terminées.
+
+    Renvoie l'état de chaque tâche (voir jobs.status): la page n'utilise les
+    résultats que lorsque tous les status valent 'done' ou 'failed'. Une
+    tâche introuvable est en échec, avec missing=True et un message d'erreur.
+    """
+    states = [_job_state(job_id) for job_id in job_ids]
+    if all(_finished(job) for job in states):
+        return states
+
+    @st.fragment(run_every=interval)
+    def watch():
+        current = [_job_state(job_id) for job_id in job_ids]
+        if all(_finished(job) for job in current):
+            st.rerun()
+        done = sum(_finished(job) for job in current)
+        lines = sum(job['progress'] for job in current)
+        total = sum(job['total'] or 0 for job in current)
+        files = f" ({done}/{len(job_ids)} fichiers)" if len(job_ids) > 1 else ""
+        if all(job['status'] == 'pending' for job in current):
+            st.progress(0.0, text=f"{label}: en attente...")
+        elif total and all(job['total'] for job in current):
+            st.progress(min(lines / total, 1.0), text=f"{label}... {lines}/{total} lignes{files}")
+        elif lines:
+            st.progress(done / len(job_ids), text=f"{label}... {lines} lignes{files}")
+        else:
+            st.progress(done / len(job_ids), text=f"{label}...{files}")
+
+    watch()
+    return states
+
+
+def follow_job(job_id, label, interval=2):
+    """follow_jobs() pour une seule tâche: renvoie son état."""
+    return follow_jobs([job_id], label, interval)[0]
+
 def create_time_series(df, title):
     fig = go.Figure()
     fig.add_trace(go.Scatter(